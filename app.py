@@ -1,15 +1,17 @@
 from openai import AzureOpenAI
 import dotenv
-import os
 import streamlit as st
-import urllib
-import re
 from audio_recorder_streamlit import audio_recorder
-import tempfile
 
+import assets
+import chat
+import settings
+import tracing
+import transcribe
+import video_lib
 
-SHOW_VIDEO = "SHOW_VIDEO"
 dotenv.load_dotenv()
+tracing.configure_logging()
 
 client = AzureOpenAI(
     azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
@@ -18,15 +20,34 @@ client = AzureOpenAI(
     api_version=st.secrets["AZURE_OPENAI_API_VERSION"],
 )
 
-whisper_client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    api_version="2024-02-01",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-)
+transcriber = transcribe.default()
+
+
+def show_videos(videos, wait=False):
+    """Embed the clips whose lookup is over, return the others"""
+    pending = []
+    for slot, term, future in videos:
+        if not (wait or future.done()):
+            pending.append((slot, term, future))
+            continue
+        shown = future.result()
+        with slot.container():
+            if shown is None:
+                st.caption(f"No video found for {term}")
+                continue
+            if shown != chat.normalize_term(term):
+                st.caption(f"No video found for {term}, showing {shown}")
+            st.video(
+                assets.clip_url(shown, repeat, padding),
+                autoplay=False,
+                loop=True,
+            )
+    return pending
 
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "history" not in st.session_state:
+    st.session_state.history = chat.History()
+history = st.session_state.history
 
 # for message in st.session_state.messages[-1:]:
 #     with st.chat_message(message["role"]):
@@ -47,71 +68,44 @@ with st.sidebar:
 if audio_bytes or text_prompt:
     if audio_bytes:
         st.audio(audio_bytes, format="audio/wav", autoplay=True)
-        deployment_id = "wisper"  # This will correspond to the custom name you chose for your deployment when you deployed a model."
-
-        # Save the recorded audio to a temporary file
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".wav"
-        ) as temp_audio_file:
-            temp_audio_file.write(audio_bytes)
-            temp_audio_path = temp_audio_file.name
 
+    prompt = text_prompt
+    if not prompt:
         try:
-            result = whisper_client.audio.transcriptions.create(
-                file=open(temp_audio_path, "rb"), model="wisper"
-            )
-        except:
-            pass
-
-        # Remove temporary file
-        os.remove(temp_audio_path)
-
-    prompt = text_prompt or result.text
+            prompt = transcriber.transcribe(audio_bytes)
+        except transcribe.TranscriptionError as e:
+            st.error(f"Could not understand the recording: {e}")
+            st.stop()
 
     with st.chat_message("user"):
         st.write(prompt)
 
-    st.session_state.messages.append(
-        {
-            "role": "system",
-            "content": f"""
-            You are an English teacher. You find an innovative way 
-            to teach English. Whenever you want to teach user a new word
-            or phrase, you can show a video clip containing the word or phrase.
-            Youc an just use {SHOW_VIDEO}: word or {SHOW_VIDEO}: phrase to show the video
-            to the user. For example, if you want to teach students word "hola",
-            you should say: {SHOW_VIDEO}: hola. The video will be shown to the user.
-            When you show a word using the video, please also provide Chinese
-            explaination of the meaning. Please also make sure
-            you only output not more than 3 videos. 
-            """,
-        }
-    )
-    st.session_state.messages.append({"role": "user", "content": prompt})
-
-    print("=" * 10, "Sending prompt to OpenAI")
-    print(st.session_state.messages)
+    history.add("user", prompt)
 
-    response = client.chat.completions.create(
-        messages=st.session_state.messages,
-        model="gpt-4o",
+    stream = client.chat.completions.create(
+        messages=history.messages(),
+        model=settings.CHAT_MODEL,
+        stream=True,
     )
-    print("Getting resutl from OpenAI", response)
 
     with st.chat_message("assistant"):
-        reply = response.choices[0].message.content
-        for line in reply.splitlines():
-            st.write(line)
-            if match := re.search(f"{SHOW_VIDEO}:.*", line):
-                term = line.replace(SHOW_VIDEO + ":", "")
-                st.video(
-                    "https://video.chato.cn/m3u8/"
-                    + urllib.parse.quote(term)
-                    + f".m3u8?repeat={repeat}&padding={padding}",
-                    autoplay=False,
-                    loop=True,
-                )
-
-    st.session_state.messages.append(
-        {"role": "assistant", "content": response.choices[0].message.content}
-    )
+        # Each line is rewritten as its tokens arrive. The clips of a
+        # SHOW_VIDEO line are looked up while the rest streams in, and
+        # embedded in its slot once found
+        resolver = chat.VideoResolver(video_lib.term_has_clips)
+        lines, videos = [], []
+        placeholder = st.empty()
+        for line, complete in chat.stream_lines(chat.deltas(stream)):
+            placeholder.write(line)
+            if not complete:
+                continue
+            lines.append(line)
+            term = chat.video_term(line)
+            if term and (future := resolver.submit(term)):
+                videos.append((st.empty(), term, future))
+            placeholder = st.empty()
+            videos = show_videos(videos)
+        show_videos(videos, wait=True)
+
+    history.add("assistant", "\n".join(lines))
+    history.compact(client)
@@ -0,0 +1,198 @@
+"""Fetch the assets of a clip from the clip server
+
+A clip is identified by (term, repeat, padding). Its subtitles (.srt) and
+thumbnails (.jpgs) are fetched in parallel over one pooled HTTP session,
+then kept in memory and on disk for a while so that clicking a word again
+costs nothing. A Prefetcher warms the clips of the next words of a list
+in the background, while the current one plays.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import settings
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ClipAssets = namedtuple("ClipAssets", ["url", "subtitles", "thumbnails"])
+
+CACHE_DIR = os.path.join(".cache", "assets")
+
+session = requests.Session()
+for scheme in ("https://", "http://"):
+    session.mount(scheme, HTTPAdapter(pool_maxsize=settings.ASSET_POOL_SIZE))
+executor = ThreadPoolExecutor(max_workers=settings.ASSET_POOL_SIZE)
+memory = TTLCache(max_entries=512, ttl=settings.ASSET_CACHE_TTL)
+
+
+def clip_url(term, repeat=1, padding=0, ext="m3u8"):
+    """URL of the playlist (or .srt, .jpgs) of a term on the clip server"""
+    return (
+        f"{settings.CLIP_SERVER}/{urllib.parse.quote(term)}.{ext}"
+        f"?repeat={repeat}&padding={padding}"
+    )
+
+
+def get(url):
+    """GET through the pooled session, raising on HTTP errors"""
+    timeout = (settings.ASSET_CONNECT_TIMEOUT, settings.ASSET_TIMEOUT)
+    resp = session.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return resp
+
+
+def _disk_path(key):
+    digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, digest + ".json")
+
+
+def _read_disk(key):
+    path = _disk_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > settings.ASSET_CACHE_TTL:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return ClipAssets(*json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _write_disk(key, assets):
+    path = _disk_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(assets), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def cached_clip_assets(term, repeat=1, padding=0):
+    """The ClipAssets of a term if they are cached, None otherwise"""
+    key = [term.strip(), repeat, padding]
+    assets = memory.get(tuple(key)) or _read_disk(key)
+    if assets is not None:
+        memory.set(tuple(key), assets)
+    return assets
+
+
+def fetch_clip_assets(term, repeat=1, padding=0):
+    """The ClipAssets of a term, None for an empty term.
+    A part that fails to download is None (subtitles) or empty
+    (thumbnails), and is not cached so the next call tries again."""
+    term = term.strip()
+    if not term:
+        return None
+    key = [term, repeat, padding]
+    assets = cached_clip_assets(term, repeat, padding)
+    if assets is not None:
+        return assets
+
+    url = clip_url(term, repeat, padding)
+    srt = executor.submit(get, clip_url(term, repeat, padding, "srt"))
+    jpgs = executor.submit(get, clip_url(term, repeat, padding, "jpgs"))
+    complete = True
+    try:
+        subtitles = srt.result().text
+    except requests.RequestException as e:
+        logger.warning("Cannot fetch subtitles of %s: %s", term, e)
+        subtitles, complete = None, False
+    try:
+        thumbnails = [
+            line for line in jpgs.result().text.splitlines() if line.startswith("http")
+        ]
+    except requests.RequestException as e:
+        logger.warning("Cannot fetch thumbnails of %s: %s", term, e)
+        thumbnails, complete = [], False
+
+    assets = ClipAssets(url, subtitles, thumbnails)
+    if complete:
+        memory.set(tuple(key), assets)
+        _write_disk(key, assets)
+    return assets
+
+
+def warm(term, repeat=1, padding=0):
+    """Have the clip server build the playlist of a term, and cache its
+    subtitles and thumbnails. Return False when they were already cached"""
+    term = term.strip()
+    if not term or cached_clip_assets(term, repeat, padding) is not None:
+        return False
+    playlist = executor.submit(get, clip_url(term, repeat, padding))
+    fetch_clip_assets(term, repeat, padding)
+    try:
+        playlist.result()
+    except requests.RequestException as e:
+        logger.warning("Cannot warm the playlist of %s: %s", term, e)
+    return True
+
+
+# Shared by the Prefetchers of every session, so the number of threads
+# stays the same however many sessions come and go
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=settings.PREFETCH_WORKERS, thread_name_prefix="prefetch"
+)
+
+
+class Prefetcher:
+    """Warm the clips of the next terms on the shared prefetch pool.
+    There is one Prefetcher per session, holding the warms it queued.
+    Each batch belongs to a target, e.g. the list and letter being browsed;
+    moving to another target cancels whatever was not started yet, and a
+    new batch replaces the warms of the previous one still queued."""
+
+    def __init__(self):
+        self.target = None
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def retarget(self, target):
+        """Cancel the pending warms if the target changed"""
+        with self.lock:
+            if target == self.target:
+                return
+            self.target = target
+            self._cancel()
+
+    def _cancel(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+
+    def prefetch(self, terms, repeat=1, padding=0, target=None):
+        """Queue the terms to be warmed, in order"""
+        self.retarget(target)
+        with self.lock:
+            self._cancel()
+            for term in terms:
+                self.futures.append(
+                    prefetch_executor.submit(self._warm, term, repeat, padding, target)
+                )
+
+    def _warm(self, term, repeat, padding, target):
+        if target != self.target:
+            return False  # a running batch can not be cancelled, skip instead
+        return warm(term, repeat, padding)
+
+    def pending(self):
+        with self.lock:
+            return sum(not future.done() for future in self.futures)
+
+    def shutdown(self):
+        """Drop the warms of this session. The pool is shared, it stays"""
+        self.retarget(None)
+        with self.lock:
+            self._cancel()
@@ -0,0 +1,896 @@
+# Storage backends for esdata.Data
+# Data talks to a backend with plain Elasticsearch request and response
+# bodies, so the same Search built by elasticsearch_dsl can run against the
+# remote cluster or against the in-process MemoryBackend.
+
+import ast
+import asyncio
+import fnmatch
+import operator
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch.exceptions import NotFoundError
+
+
+class Backend:
+    """The storage operations used by Data"""
+
+    def get(self, index, id):
+        """Return {"_id": ..., "_source": ...} or None if not found"""
+        raise NotImplementedError
+
+    def mget(self, index, ids):
+        """Return a list aligned with ids, None for the missing ones"""
+        return [self.get(index, id) for id in ids]
+
+    def index(self, index, body, id=None):
+        """Store the body and return its id"""
+        raise NotImplementedError
+
+    def bulk(self, index, docs):
+        """Index (id, body) pairs in one request.
+        Return one {"_id", "status", "error"} result per doc, in order"""
+        results = []
+        for id, body in docs:
+            results.append({"_id": self.index(index, body, id=id), "status": 201})
+        return results
+
+    def search(self, index, body):
+        """Run a search body and return the raw response dict"""
+        raise NotImplementedError
+
+    def msearch(self, index, bodies):
+        """Run several search bodies in one request. Return their responses
+        in order, a failed one being {"error": ...}"""
+        return [self.search(index, body) for body in bodies]
+
+    def update_by_query(self, index, body):
+        """Run the painless script of body on every document matching its
+        query, in the store. Return the response, with the "updated" count"""
+        raise NotImplementedError
+
+    def open_pit(self, index, keep_alive="1m"):
+        """Open a point in time of the index and return its id. Searches
+        with {"pit": {"id": ...}} see the index as it was then"""
+        raise NotImplementedError
+
+    def close_pit(self, pit_id):
+        """Release a point in time"""
+
+    def put_mapping(self, index, mapping):
+        """Add field mappings to the index"""
+
+    def refresh(self, index):
+        """Make the recent writes visible to search"""
+
+    def close(self):
+        """Release the resources held by the backend"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _body(resp):
+    """The dict behind an Elasticsearch API response"""
+    return getattr(resp, "body", resp)
+
+
+def _task_response(task, status):
+    """The response of a completed update_by_query task, None while it runs.
+    Raise RuntimeError if the task failed or some documents were not updated"""
+    if not status.get("completed"):
+        return None
+    if status.get("error"):
+        raise RuntimeError(f"Task {task} failed: {status['error']}")
+    response = status.get("response", {})
+    if response.get("failures"):
+        failures = response["failures"]
+        raise RuntimeError(
+            f"Task {task} failed on {len(failures)} documents, e.g. {failures[0]}"
+        )
+    return response
+
+
+def _task_timeout(task, timeout):
+    return TimeoutError(
+        f"Task {task} still running after {timeout}s; "
+        "check or cancel it with the tasks API"
+    )
+
+
+class ElasticsearchBackend(Backend):
+    """Backend talking to an Elasticsearch cluster.
+    The client and its connection pool are created on first use, and
+    created again after close(). task_timeout is the number of seconds an
+    update_by_query may run before giving up on waiting for it."""
+
+    def __init__(self, task_timeout=3600, **kwargs):
+        self.task_timeout = task_timeout
+        self.options = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = Elasticsearch(**self.options)
+        return self._client
+
+    def get(self, index, id):
+        try:
+            return _body(self.client.get(index=index, id=id))
+        except NotFoundError:
+            return None
+
+    def mget(self, index, ids):
+        docs = _body(self.client.mget(index=index, ids=list(ids)))["docs"]
+        return [doc if doc.get("found") else None for doc in docs]
+
+    def index(self, index, body, id=None):
+        kwargs = {"index": index, "body": body}
+        if id is not None:
+            kwargs["id"] = id
+        return _body(self.client.index(**kwargs))["_id"]
+
+    def bulk(self, index, docs):
+        operations = []
+        for id, body in docs:
+            action = {"_index": index}
+            if id is not None:
+                action["_id"] = id
+            operations += [{"index": action}, body]
+        items = _body(self.client.bulk(body=operations))["items"]
+        return [item["index"] for item in items]
+
+    def search(self, index, body):
+        if "pit" in body:  # the point in time already names the index
+            return _body(self.client.search(body=body))
+        return _body(self.client.search(index=index, body=body))
+
+    def msearch(self, index, bodies):
+        searches = [part for body in bodies for part in ({}, body)]
+        return _body(self.client.msearch(index=index, body=searches))["responses"]
+
+    def update_by_query(self, index, body):
+        # Run as a task and poll it: a large update outlasts the timeout
+        resp = self.client.update_by_query(
+            index=index,
+            body=body,
+            conflicts="proceed",
+            slices="auto",
+            wait_for_completion=False,
+        )
+        task = _body(resp)["task"]
+        deadline = time.monotonic() + self.task_timeout
+        while True:
+            status = _body(self.client.tasks.get(task_id=task))
+            response = _task_response(task, status)
+            if response is not None:
+                return response
+            if time.monotonic() > deadline:
+                raise _task_timeout(task, self.task_timeout)
+            time.sleep(1)
+
+    def open_pit(self, index, keep_alive="1m"):
+        resp = self.client.open_point_in_time(index=index, keep_alive=keep_alive)
+        return _body(resp)["id"]
+
+    def close_pit(self, pit_id):
+        try:
+            self.client.close_point_in_time(body={"id": pit_id})
+        except NotFoundError:
+            pass  # expired already
+
+    def put_mapping(self, index, mapping):
+        self.client.indices.put_mapping(index=index, body=mapping)
+
+    def refresh(self, index):
+        self.client.indices.refresh(index=index)
+
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+class AsyncElasticsearchBackend(Backend):
+    """ElasticsearchBackend with coroutine methods, on the async client.
+    The client is created on first use inside the running event loop."""
+
+    def __init__(self, task_timeout=3600, **kwargs):
+        self.task_timeout = task_timeout
+        self.options = kwargs
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncElasticsearch(**self.options)
+        return self._client
+
+    async def get(self, index, id):
+        try:
+            return _body(await self.client.get(index=index, id=id))
+        except NotFoundError:
+            return None
+
+    async def mget(self, index, ids):
+        docs = _body(await self.client.mget(index=index, ids=list(ids)))["docs"]
+        return [doc if doc.get("found") else None for doc in docs]
+
+    async def index(self, index, body, id=None):
+        kwargs = {"index": index, "body": body}
+        if id is not None:
+            kwargs["id"] = id
+        return _body(await self.client.index(**kwargs))["_id"]
+
+    async def bulk(self, index, docs):
+        operations = []
+        for id, body in docs:
+            action = {"_index": index}
+            if id is not None:
+                action["_id"] = id
+            operations += [{"index": action}, body]
+        items = _body(await self.client.bulk(body=operations))["items"]
+        return [item["index"] for item in items]
+
+    async def search(self, index, body):
+        if "pit" in body:
+            return _body(await self.client.search(body=body))
+        return _body(await self.client.search(index=index, body=body))
+
+    async def msearch(self, index, bodies):
+        searches = [part for body in bodies for part in ({}, body)]
+        resp = await self.client.msearch(index=index, body=searches)
+        return _body(resp)["responses"]
+
+    async def update_by_query(self, index, body):
+        resp = await self.client.update_by_query(
+            index=index,
+            body=body,
+            conflicts="proceed",
+            slices="auto",
+            wait_for_completion=False,
+        )
+        task = _body(resp)["task"]
+        deadline = time.monotonic() + self.task_timeout
+        while True:
+            status = _body(await self.client.tasks.get(task_id=task))
+            response = _task_response(task, status)
+            if response is not None:
+                return response
+            if time.monotonic() > deadline:
+                raise _task_timeout(task, self.task_timeout)
+            await asyncio.sleep(1)
+
+    async def open_pit(self, index, keep_alive="1m"):
+        resp = await self.client.open_point_in_time(index=index, keep_alive=keep_alive)
+        return _body(resp)["id"]
+
+    async def close_pit(self, pit_id):
+        try:
+            await self.client.close_point_in_time(body={"id": pit_id})
+        except NotFoundError:
+            pass
+
+    async def close(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncBackendAdapter:
+    """Expose a synchronous backend (e.g. MemoryBackend) through the
+    coroutine interface of AsyncElasticsearchBackend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+def tokenize(text):
+    """Lowercase word tokens, close to the standard analyzer"""
+    return re.findall(r"\w+(?:[.'’]\w+)*", str(text).lower())
+
+
+def _clauses(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _compare(values, after, clauses):
+    """Order of the sort values of a hit relative to search_after ones:
+    -1 before, 0 same, 1 after. Missing values sort last"""
+    for a, b, (_, descending) in zip(values, after, clauses):
+        if a == b:
+            continue
+        if a is None or b is None:
+            return 1 if a is None else -1
+        result = 1 if a > b else -1
+        return -result if descending else result
+    return 0
+
+
+_SCRIPT_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def _compile_script(source):
+    """Parse a script translated to Python. Only arithmetic, comparisons
+    and boolean logic on numbers and _v[n] slots are accepted: no power,
+    no call, no attribute, so a script cannot run away"""
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError:
+        raise NotImplementedError(f"Unsupported script {source}")
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            allowed = type(node.op) in _SCRIPT_OPERATORS
+        elif isinstance(node, ast.Compare):
+            allowed = all(type(op) in _SCRIPT_OPERATORS for op in node.ops)
+        elif isinstance(node, ast.Constant):
+            allowed = type(node.value) in (int, float, bool)
+        elif isinstance(node, ast.Subscript):
+            allowed = (
+                isinstance(node.value, ast.Name)
+                and node.value.id == "_v"
+                and isinstance(node.slice, ast.Constant)
+            )
+        elif isinstance(node, ast.Name):
+            allowed = node.id == "_v"
+        else:
+            allowed = isinstance(
+                node, (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.Load)
+            ) or type(node) in _SCRIPT_OPERATORS
+        if not allowed:
+            raise NotImplementedError(f"Unsupported script {source}")
+    return tree.body
+
+
+def _run_script(node, values):
+    """Evaluate a tree of _compile_script on the slot values"""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Subscript):
+        return values[node.slice.value]
+    if isinstance(node, ast.BinOp):
+        return _SCRIPT_OPERATORS[type(node.op)](
+            _run_script(node.left, values), _run_script(node.right, values)
+        )
+    if isinstance(node, ast.UnaryOp):
+        return _SCRIPT_OPERATORS[type(node.op)](_run_script(node.operand, values))
+    if isinstance(node, ast.BoolOp):
+        if isinstance(node.op, ast.And):
+            return all(_run_script(value, values) for value in node.values)
+        return any(_run_script(value, values) for value in node.values)
+    left = _run_script(node.left, values)
+    for op, comparator in zip(node.ops, node.comparators):
+        right = _run_script(comparator, values)
+        if not _SCRIPT_OPERATORS[type(op)](left, right):
+            return False
+        left = right
+    return True
+
+
+def _field_value(value):
+    """Accept both {"field": v} and {"field": {"query": v}} forms"""
+    (field, value), *_ = value.items()
+    if isinstance(value, dict):
+        value = value.get("query", value.get("value"))
+    return field, value
+
+
+class MemoryIndex:
+    """Documents of one index plus an inverted index of their text fields"""
+
+    def __init__(self):
+        self.docs = {}
+        self.postings = defaultdict(lambda: defaultdict(set))
+
+    def put(self, id, source):
+        self.remove(id)
+        self.docs[id] = source
+        for field, value in source.items():
+            if isinstance(value, str):
+                for token in tokenize(value):
+                    self.postings[field][token].add(id)
+
+    def remove(self, id):
+        source = self.docs.pop(id, None)
+        if source is None:
+            return
+        for field, value in source.items():
+            if isinstance(value, str):
+                for token in tokenize(value):
+                    self.postings[field][token].discard(id)
+
+    def lookup(self, token, field=None):
+        """Ids containing the token in field, or in any field"""
+        if field is not None:
+            return self.postings.get(field, {}).get(token, set())
+        ids = set()
+        for postings in self.postings.values():
+            ids |= postings.get(token, set())
+        return ids
+
+
+class MemoryBackend(Backend):
+    """In-process search engine for tests, benchmarks and hot corpora.
+
+    It understands the subset of the query DSL used by Data.find: match,
+    term(s), ids, range, exists, query_string, bool, simple painless
+    arithmetic scripts, sort, collapse, from/size and the cardinality and
+    terms aggregations. The knn section is answered by an exact NumPy scan.
+    Points in time and search_after are emulated: a point in time keeps
+    the order of the documents of the time, and hides the ones added since.
+    update_by_query runs scripts of ctx._source assignments.
+    """
+
+    def __init__(self):
+        self.indices = defaultdict(MemoryIndex)
+        self.mappings = defaultdict(dict)
+        self.pits = {}
+
+    def open_pit(self, index, keep_alive="1m"):
+        pit_id = uuid.uuid4().hex
+        names = [name for name in list(self.indices) if fnmatch.fnmatch(name, index)]
+        order = {}
+        for name in names:
+            for id in self.indices[name].docs:
+                order[(name, id)] = len(order)
+        self.pits[pit_id] = {"index": index, "order": order}
+        return pit_id
+
+    def close_pit(self, pit_id):
+        self.pits.pop(pit_id, None)
+
+    def put_mapping(self, index, mapping):
+        self.mappings[index].update(mapping.get("properties", {}))
+
+    def _indices(self, index):
+        return [
+            self.indices[name]
+            for name in list(self.indices)
+            if fnmatch.fnmatch(name, index)
+        ]
+
+    def get(self, index, id):
+        for idx in self._indices(index):
+            if id in idx.docs:
+                return {"_id": id, "_source": dict(idx.docs[id]), "found": True}
+        return None
+
+    def index(self, index, body, id=None):
+        id = id or uuid.uuid4().hex
+        self.indices[index].put(id, dict(body))
+        return id
+
+    def search(self, index, body):
+        pit = None
+        if "pit" in body:
+            pit = self.pits.get(body["pit"]["id"])
+            if pit is None:
+                raise ValueError(f"No point in time {body['pit']['id']}")
+            index = pit["index"]
+        hits = []
+        for name in list(self.indices):
+            if not fnmatch.fnmatch(name, index):
+                continue
+            idx = self.indices[name]
+            if "knn" in body:
+                # Like Elasticsearch, the kNN hits are added to the query hits
+                scores = self._knn(body["knn"], name, idx)
+                if "query" in body:
+                    for id, score in self._eval(body["query"], idx, idx.docs).items():
+                        scores[id] = scores.get(id, 0.0) + score
+            else:
+                scores = self._eval(body.get("query", {"match_all": {}}), idx, idx.docs)
+            hits += [
+                {"_index": name, "_id": id, "_score": score, "_source": idx.docs[id]}
+                for id, score in scores.items()
+                if pit is None or (name, id) in pit["order"]
+            ]
+
+        hits = self._sort(hits, body.get("sort"), pit)
+        resp = {
+            "took": 0,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": max((hit["_score"] for hit in hits), default=None),
+            },
+        }
+        if "aggs" in body or "aggregations" in body:
+            resp["aggregations"] = self._aggs(
+                body.get("aggs", body.get("aggregations")), hits
+            )
+        if pit is not None:
+            resp["pit_id"] = body["pit"]["id"]
+        if "search_after" in body:
+            clauses = self._sort_clauses(body.get("sort"), pit)
+            hits = [
+                hit
+                for hit in hits
+                if _compare(hit["sort"], body["search_after"], clauses) > 0
+            ]
+        if "collapse" in body:
+            hits = self._collapse(hits, body["collapse"]["field"])
+        start = body.get("from", 0)
+        resp["hits"]["hits"] = [
+            {**hit, "_source": self._source(hit["_source"], body.get("_source"))}
+            for hit in hits[start : start + body.get("size", 10)]
+        ]
+        return resp
+
+    def _source(self, source, spec):
+        """Apply _source filtering: False, a list of fields or includes"""
+        if spec is None or spec is True:
+            return dict(source)
+        if spec is False:
+            return {}
+        if isinstance(spec, dict):
+            spec = spec.get("includes", list(source))
+        return {
+            key: value
+            for key, value in source.items()
+            if any(fnmatch.fnmatch(key, pattern) for pattern in _clauses(spec))
+        }
+
+    def _knn(self, spec, name, idx):
+        """Exact nearest neighbors with NumPy, scored like Elasticsearch"""
+        import numpy as np
+
+        field = spec["field"]
+        universe = idx.docs
+        for query in _clauses(spec.get("filter")):
+            universe = self._eval(query, idx, universe)
+        ids = [id for id in universe if idx.docs[id].get(field) is not None]
+        if not ids:
+            return {}
+
+        vectors = np.array([idx.docs[id][field] for id in ids], dtype=np.float32)
+        query = np.array(spec["query_vector"], dtype=np.float32)
+        similarity = self.mappings[name].get(field, {}).get("similarity", "l2_norm")
+        if similarity == "l2_norm":
+            scores = 1 / (1 + ((vectors - query) ** 2).sum(axis=1))
+        elif similarity == "cosine":
+            norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+            scores = (1 + vectors @ query / np.maximum(norms, 1e-12)) / 2
+        else:  # dot_product
+            scores = (1 + vectors @ query) / 2
+
+        k = min(spec.get("k", 10), len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return {ids[n]: float(scores[n]) for n in top}
+
+    def _eval(self, query, idx, universe):
+        """Return {id: score} for the ids of universe matching the query"""
+        (kind, spec), *_ = query.items()
+        evaluate = getattr(self, f"_q_{kind}", None)
+        if evaluate is None:
+            raise NotImplementedError(f"MemoryBackend does not support {kind}")
+        return evaluate(spec, idx, universe)
+
+    def _q_match_all(self, spec, idx, universe):
+        return {id: 1.0 for id in universe}
+
+    def _q_bool(self, spec, idx, universe):
+        # Clauses backed by the inverted index go first to narrow the universe
+        cheap = ("ids", "term", "terms", "match", "query_string")
+        required = _clauses(spec.get("must")) + _clauses(spec.get("filter"))
+        required.sort(key=lambda q: next(iter(q)) not in cheap)
+        scores = None
+        for query in required:
+            matched = self._eval(query, idx, universe if scores is None else scores)
+            if scores is not None:
+                matched = {id: scores[id] + matched[id] for id in matched}
+            scores = matched
+        if scores is None:
+            scores = {id: 0.0 for id in universe}
+        for query in _clauses(spec.get("must_not")):
+            for id in self._eval(query, idx, scores):
+                scores.pop(id)
+
+        should = _clauses(spec.get("should"))
+        if should:
+            minimum = int(spec.get("minimum_should_match", 0 if required else 1))
+            hits = defaultdict(int)
+            for query in should:
+                for id, score in self._eval(query, idx, scores).items():
+                    scores[id] += score
+                    hits[id] += 1
+            scores = {id: s for id, s in scores.items() if hits[id] >= minimum}
+        return scores
+
+    def _q_ids(self, spec, idx, universe):
+        return {id: 1.0 for id in spec["values"] if id in universe}
+
+    def _q_term(self, spec, idx, universe):
+        field, value = _field_value(spec)
+        return {
+            id: 1.0
+            for id in universe
+            if idx.docs[id].get(field.replace(".keyword", "")) == value
+        }
+
+    def _q_terms(self, spec, idx, universe):
+        (field, values), *_ = spec.items()
+        field = field.replace(".keyword", "")
+        return {id: 1.0 for id in universe if idx.docs[id].get(field) in values}
+
+    def _q_match(self, spec, idx, universe):
+        field, value = _field_value(spec)
+        if not isinstance(value, str):
+            return {id: 1.0 for id in universe if idx.docs[id].get(field) == value}
+        scores = defaultdict(float)
+        for token in tokenize(value):
+            for id in idx.lookup(token, field):
+                if id in universe:
+                    scores[id] += 1.0
+        return dict(scores)
+
+    def _q_range(self, spec, idx, universe):
+        (field, bounds), *_ = spec.items()
+        checks = {
+            "gt": lambda v, b: v > b,
+            "gte": lambda v, b: v >= b,
+            "lt": lambda v, b: v < b,
+            "lte": lambda v, b: v <= b,
+        }
+        scores = {}
+        for id in universe:
+            value = idx.docs[id].get(field)
+            if value is None:
+                continue
+            if all(checks[op](value, b) for op, b in bounds.items() if op in checks):
+                scores[id] = 1.0
+        return scores
+
+    def _q_exists(self, spec, idx, universe):
+        field = spec["field"]
+        return {id: 1.0 for id in universe if idx.docs[id].get(field) is not None}
+
+    def _q_query_string(self, spec, idx, universe):
+        """Support bare terms (OR), "phrases", +required, -excluded,
+        AND/OR/NOT, field:value and trailing * prefixes"""
+        text = spec["query"]
+        default_and = spec.get("default_operator", "OR").upper() == "AND"
+        parts = re.findall(r'([+-]?)(?:(\w+):)?("[^"]*"|\S+)', text)
+        scores = defaultdict(float)
+        required, excluded = [], []
+        negate_next = False
+        for sign, field, term in parts:
+            if term in ("AND", "OR"):
+                continue
+            if term == "NOT":
+                negate_next = True
+                continue
+            ids = self._term_ids(term, field or None, idx, universe)
+            if sign == "-" or negate_next:
+                excluded.append(ids)
+            elif sign == "+" or default_and:
+                required.append(ids)
+                for id in ids:
+                    scores[id] += 1.0
+            else:
+                for id in ids:
+                    scores[id] += 1.0
+            negate_next = False
+        if required:
+            scores = {id: scores[id] for id in set.intersection(*required)}
+        for ids in excluded:
+            for id in ids:
+                scores.pop(id, None)
+        return dict(scores)
+
+    def _term_ids(self, term, field, idx, universe):
+        if term.startswith('"'):
+            tokens = tokenize(term)
+            if not tokens:
+                return set()
+            ids = set.intersection(*(set(idx.lookup(t, field)) for t in tokens))
+            phrase = " ".join(tokens)
+            return {
+                id
+                for id in ids
+                if id in universe
+                and any(
+                    phrase in " ".join(tokenize(value))
+                    for name, value in idx.docs[id].items()
+                    if isinstance(value, str) and field in (None, name)
+                )
+            }
+        if term.endswith("*"):
+            prefix = term[:-1].lower()
+            fields = [field] if field else list(idx.postings)
+            ids = set()
+            for name in fields:
+                for token, posting in idx.postings.get(name, {}).items():
+                    if token.startswith(prefix):
+                        ids |= posting
+            return {id for id in ids if id in universe}
+        ids = set()
+        for token in tokenize(term):
+            ids |= idx.lookup(token, field)
+        return {id for id in ids if id in universe}
+
+    _SCRIPT_VALUE = re.compile(r"doc\[['\"](\w+)['\"]\]\.value|params\.(\w+)")
+    _SCRIPT_SOURCE = re.compile(r"ctx\._source\.(\w+)|params\.(\w+)")
+    _ASSIGNMENT = re.compile(r"\s*ctx\._source\.(\w+)\s*=(?!=)(.*)$", re.S)
+
+    def _translate(self, source, values):
+        """Compile a painless expression whose field and params references
+        match the values pattern. Return the code and the (field, param)
+        name of each of its _v slots"""
+        names = []
+
+        def slot(match):
+            names.append(match.groups())
+            return f"_v[{len(names) - 1}]"
+
+        source = values.sub(slot, source)
+        source = source.replace("&&", " and ").replace("||", " or ")
+        source = re.sub(r"!(?!=)", " not ", source)
+        return _compile_script(source), names
+
+    def _q_script(self, spec, idx, universe):
+        """Evaluate simple painless arithmetic such as
+        doc['end'].value - doc['start'].value < params.threshold"""
+        script = spec["script"]
+        params = script.get("params", {})
+        code, names = self._translate(script["source"], self._SCRIPT_VALUE)
+
+        scores = {}
+        for id in universe:
+            doc = idx.docs[id]
+            values = [doc.get(f) if f else params.get(p) for f, p in names]
+            if None in values:
+                continue
+            if _run_script(code, values):
+                scores[id] = 1.0
+        return scores
+
+    def update_by_query(self, index, body):
+        """Run scripts made of assignments such as
+        ctx._source.duration = ctx._source.end - ctx._source.start"""
+        script = body["script"]
+        params = script.get("params", {})
+        statements = []
+        for statement in script["source"].split(";"):
+            if not statement.strip():
+                continue
+            match = self._ASSIGNMENT.match(statement)
+            if match is None:
+                raise NotImplementedError(f"Unsupported script {script['source']}")
+            code, names = self._translate(match.group(2), self._SCRIPT_SOURCE)
+            statements.append((match.group(1), code, names))
+
+        updated = 0
+        for idx in self._indices(index):
+            query = body.get("query", {"match_all": {}})
+            for id in list(self._eval(query, idx, idx.docs)):
+                doc = dict(idx.docs[id])
+                for field, code, names in statements:
+                    values = [doc.get(f) if f else params.get(p) for f, p in names]
+                    doc[field] = _run_script(code, values)
+                idx.put(id, doc)
+                updated += 1
+        return {"updated": updated, "total": updated, "failures": []}
+
+    def _sort_clauses(self, sort, pit=None):
+        """[(field, descending)] of a sort. Like Elasticsearch, searches on a
+        point in time are sorted by _shard_doc last, to break ties"""
+        clauses = []
+        for spec in _clauses(sort):
+            if isinstance(spec, str):
+                field, order = spec.lstrip("-"), "desc" if spec[0] == "-" else "asc"
+            else:
+                (field, order), *_ = spec.items()
+                if isinstance(order, dict):
+                    order = order.get("order", "asc")
+            clauses.append((field, order == "desc"))
+        if pit is not None and "_shard_doc" not in [field for field, _ in clauses]:
+            clauses.append(("_shard_doc", False))
+        return clauses
+
+    def _sort_value(self, hit, field, pit):
+        if field == "_score":
+            return hit["_score"]
+        if field == "_id":
+            return hit["_id"]
+        if field == "_shard_doc":
+            return pit["order"][(hit["_index"], hit["_id"])]
+        return hit["_source"].get(field)
+
+    def _sort(self, hits, sort, pit=None):
+        clauses = self._sort_clauses(sort, pit)
+        hits.sort(key=lambda hit: -hit["_score"])
+        for field, reverse in reversed(clauses):
+            # Missing values sort last, whatever the order
+            keyed = [(self._sort_value(hit, field, pit), hit) for hit in hits]
+            present = [pair for pair in keyed if pair[0] is not None]
+            present.sort(key=lambda pair: pair[0], reverse=reverse)
+            hits = [hit for _, hit in present] + [
+                hit for value, hit in keyed if value is None
+            ]
+        if clauses:
+            for hit in hits:
+                hit["sort"] = [self._sort_value(hit, field, pit) for field, _ in clauses]
+        return hits
+
+    def _collapse(self, hits, field):
+        seen = set()
+        results = []
+        for hit in hits:
+            value = hit["_source"].get(field.replace(".keyword", ""))
+            key = repr(value)
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(hit)
+        return results
+
+    def _aggs(self, aggs, hits):
+        results = {}
+        for name, spec in aggs.items():
+            if "cardinality" in spec:
+                field = spec["cardinality"]["field"].replace(".keyword", "")
+                values = {repr(hit["_source"].get(field)) for hit in hits}
+                results[name] = {"value": len(values)}
+            elif "terms" in spec:
+                field = spec["terms"]["field"].replace(".keyword", "")
+                counts = defaultdict(int)
+                for hit in hits:
+                    value = hit["_source"].get(field)
+                    for item in value if isinstance(value, list) else [value]:
+                        if item is not None:
+                            counts[item] += 1
+                buckets = sorted(counts.items(), key=lambda kv: (-kv[1], str(kv[0])))
+                results[name] = {
+                    "buckets": [
+                        {"key": key, "doc_count": count}
+                        for key, count in buckets[: spec["terms"].get("size", 10)]
+                    ]
+                }
+            else:
+                raise NotImplementedError(f"MemoryBackend does not support {spec}")
+        return results
@@ -0,0 +1,49 @@
+"""Fill the duration field of the Sub documents saved before it existed
+
+The documents are updated in the store by an update_by_query, which only
+sets duration: the other fields of their _source are kept, and modified
+is not stamped, so the replicas of snapshot.py and term_index.py are not
+synced again (run them with --full to pick the durations up).
+
+Usage:
+    python backfill.py --dry-run
+    python backfill.py
+"""
+
+import argparse
+
+from elasticsearch_dsl import Q
+
+from esdata import Sub
+
+DURATION_SCRIPT = "ctx._source.duration = ctx._source.end - ctx._source.start"
+
+
+def backfill_duration(dry_run=False):
+    """Set duration = end - start on every Sub without one.
+    Return the number of documents updated"""
+    sub = Sub()
+    sub.put_mapping()
+    missing = Q(
+        "bool",
+        must_not=[Q("exists", field="duration")],
+        filter=[Q("exists", field="start"), Q("exists", field="end")],
+    )
+    left = sub.find(query=missing, size=0).count
+    print(f"{left} Sub without duration")
+    if dry_run or not left:
+        return 0
+    updated = sub.update_by_query(missing, DURATION_SCRIPT)
+    print(f"{updated} updated")
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Only count")
+    args = parser.parse_args()
+    backfill_duration(args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Benchmark the clip pipeline against a local stand-in store
+
+A synthetic corpus of subtitles is generated into a MemoryBackend, behind
+a wrapper counting the requests it receives, and each scenario is timed
+over many terms: the search of a term, its playlist with padding 0-5 and
+repeat 1-10, lessons of several words, and the word list page. For each
+one the p50/p99 latency, the round-trips to the store per call, and the
+memory retained per call and at peak (tracemalloc) are reported, and
+saved as JSON so that two runs can be compared.
+
+The query cache of Data is disabled, so that every call reaches the
+store; --cache turns it on, with 1024 entries unless QUERY_CACHE_ENTRIES
+sets another size.
+
+Usage:
+    python benchmark.py --movies 20 --lines 1000 --out bench.json
+    python benchmark.py --out new.json --compare bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import settings
+import tracing
+import video_lib
+import wordlists
+from backends import Backend, MemoryBackend
+from cache import TTLCache
+from esdata import Data, Sub
+
+REGRESSION = 0.2  # a p50 20% slower than the baseline is a regression
+
+
+class CountingBackend(Backend):
+    """Forward to a backend, counting the requests made to it"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = Counter()
+
+    def _call(self, name, *args, **kwargs):
+        self.calls[name] += 1
+        return getattr(self.backend, name)(*args, **kwargs)
+
+    def get(self, index, id):
+        return self._call("get", index, id)
+
+    def mget(self, index, ids):
+        return self._call("mget", index, ids)
+
+    def index(self, index, body, id=None):
+        return self._call("index", index, body, id=id)
+
+    def bulk(self, index, docs):
+        return self._call("bulk", index, docs)
+
+    def search(self, index, body):
+        return self._call("search", index, body)
+
+    def msearch(self, index, bodies):
+        return self._call("msearch", index, bodies)
+
+    def update_by_query(self, index, body):
+        return self._call("update_by_query", index, body)
+
+    def open_pit(self, index, keep_alive="1m"):
+        return self._call("open_pit", index, keep_alive)
+
+    def close_pit(self, pit_id):
+        return self._call("close_pit", pit_id)
+
+    def put_mapping(self, index, mapping):
+        self.backend.put_mapping(index, mapping)
+
+    def refresh(self, index):
+        self.backend.refresh(index)
+
+    def round_trips(self):
+        return sum(self.calls.values())
+
+
+def vocabulary(size=2000):
+    """Single words of the word lists, most common first"""
+    words = {}
+    for name in wordlists.names():
+        for term in wordlists.load(name).terms:
+            if term.isalpha() and term.islower():
+                words[term] = words.get(term, 0) + 1
+    return sorted(words, key=lambda word: (-words[word], word))[:size]
+
+
+def corpus(movies=20, lines=1000, words=None, seed=1):
+    """Yield synthetic Subs: movies srt files of lines subtitles each,
+    with words drawn from a Zipf-like distribution"""
+    rand = random.Random(seed)
+    words = words or vocabulary()
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    for m in range(movies):
+        srt_file = f"movie{m:03}.srt"
+        clock = rand.uniform(0, 5)
+        for index in range(1, lines + 1):
+            sub = Sub()
+            sub.srt_file = srt_file
+            sub.index = index
+            sub.sub_start = clock
+            sub.sub_end = clock + rand.uniform(0.8, 6)
+            sub.start = sub.sub_start - rand.uniform(0, 0.3)
+            sub.end = sub.sub_end + rand.uniform(0, 0.3)
+            sub.content = " ".join(rand.choices(words, weights, k=rand.randint(4, 10)))
+            sub.ts_ready = True
+            sub.id = f"{srt_file}_{index}"
+            clock = sub.end + rand.uniform(0.1, 2)
+            yield sub
+
+
+def load_corpus(backend, movies, lines, words, seed=1, batch=1000):
+    Data.backend = backend
+    Sub().put_mapping()
+    chunk = []
+    for sub in corpus(movies, lines, words, seed):
+        chunk.append(sub)
+        if len(chunk) >= batch:
+            Sub().save_many(chunk)
+            chunk = []
+    if chunk:
+        Sub().save_many(chunk)
+
+
+def sample_terms(words, count=30, seed=2):
+    """Terms of every frequency: common, middle and rare words"""
+    rand = random.Random(seed)
+    third = len(words) // 3
+    bands = [words[:third], words[third : 2 * third], words[2 * third :]]
+    return [rand.choice(bands[n % 3]) for n in range(count)]
+
+
+def playlist(term, repeat=1, padding=0):
+    """term_m3u8 without PLAYLIST_CACHE"""
+    subs = video_lib.padded_subs(video_lib.term_clips(term), repeat, padding)
+    return video_lib.m3u8(subs)
+
+
+def lesson_serial(terms):
+    return "".join(playlist(term) for term in terms)
+
+
+def word_list_page(name, letter="S", prefix="st", page_size=50):
+    wordlist = wordlists.load(name)
+    for positions in (wordlist.search(letter=letter), wordlist.search(prefix)):
+        wordlist.items(positions[:page_size])
+
+
+def scenarios(terms, lesson_size=12):
+    """(name, function, list of argument tuples)"""
+    lessons = [
+        tuple(terms[n : n + lesson_size]) for n in range(0, len(terms), lesson_size)
+    ]
+    names = wordlists.names()
+    result = [("find", video_lib.term_clips, [(t,) for t in terms])]
+    for padding in range(6):
+        result.append(
+            (f"playlist_padding_{padding}", playlist, [(t, 1, padding) for t in terms])
+        )
+    for repeat in (1, 2, 5, 10):
+        result.append(
+            (f"playlist_repeat_{repeat}", playlist, [(t, repeat, 0) for t in terms])
+        )
+    result += [
+        ("srtseg_padding_1", video_lib.srtseg_from_es, [(t, 1, 1) for t in terms]),
+        ("lesson_serial", lesson_serial, [(lesson,) for lesson in lessons]),
+        ("lesson_msearch", video_lib.terms_m3u8, [(lesson,) for lesson in lessons]),
+        ("word_list_page", word_list_page, [(name,) for name in names]),
+    ]
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def measure(backend, function, args, iterations):
+    """Time the calls, then count their round-trips and allocations"""
+    calls = [args[n % len(args)] for n in range(iterations)]
+    timings = []
+    function(*calls[0])  # warm up
+    backend.calls.clear()
+    for call in calls:
+        started = time.perf_counter()
+        function(*call)
+        timings.append(time.perf_counter() - started)
+    round_trips = backend.round_trips()
+
+    sample = calls[: min(len(calls), 10)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for call in sample:
+        function(*call)
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    retained = sum(stat.size_diff for stat in diff if stat.size_diff > 0)
+    return {
+        "calls": len(timings),
+        "p50_ms": round(1000 * percentile(timings, 0.5), 3),
+        "p99_ms": round(1000 * percentile(timings, 0.99), 3),
+        "mean_ms": round(1000 * statistics.fmean(timings), 3),
+        "round_trips": round(round_trips / len(timings), 2),
+        "retained_bytes": retained // len(sample),
+        "peak_bytes": peak,
+    }
+
+
+def run(movies=20, lines=1000, iterations=50, terms=30, cache=False, only=None):
+    words = vocabulary()
+    backend = CountingBackend(MemoryBackend())
+    started = time.perf_counter()
+    load_corpus(backend, movies, lines, words)
+    load_seconds = time.perf_counter() - started
+    if not cache:
+        Data.cache = None
+    elif Data.cache is None:
+        Data.cache = TTLCache(
+            ttl=settings.QUERY_CACHE_TTL, max_bytes=settings.QUERY_CACHE_BYTES
+        )
+
+    results = {}
+    for name, function, args in scenarios(sample_terms(words, terms)):
+        if only and not any(part in name for part in only):
+            continue
+        try:
+            results[name] = measure(backend, function, args, iterations)
+        except Exception as e:
+            results[name] = {"error": f"{e.__class__.__name__}: {e}"}
+        print(f"{name:28} {_describe(results[name])}")
+
+    return {
+        "meta": {
+            "movies": movies,
+            "lines": lines,
+            "iterations": iterations,
+            "terms": terms,
+            "cache": cache,
+            "load_seconds": round(load_seconds, 2),
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": results,
+    }
+
+
+def _describe(result):
+    if "error" in result:
+        return result["error"]
+    return (
+        f"p50 {result['p50_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms"
+        f"  {result['round_trips']:5} round-trips"
+        f"  {result['retained_bytes'] / 1024:8.1f}KiB/call"
+    )
+
+
+def compare(results, baseline, threshold=REGRESSION):
+    """Print the p50 changes against a baseline run.
+    Return the names of the scenarios that regressed"""
+    regressions = []
+    for name, result in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old or "error" in old or "error" in result:
+            continue
+        change = result["p50_ms"] / max(old["p50_ms"], 1e-9) - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:28} p50 {old['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}ms"
+            f" ({change:+.0%}), round-trips {old['round_trips']} -> "
+            f"{result['round_trips']}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=1000, help="Lines per movie")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--terms", type=int, default=30, help="Distinct terms")
+    parser.add_argument("--cache", action="store_true", help="Turn the query cache on")
+    parser.add_argument("--only", nargs="+", help="Scenarios containing these")
+    parser.add_argument("--out", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION)
+    args = parser.parse_args()
+    tracing.configure_logging()
+
+    results = run(
+        args.movies, args.lines, args.iterations, args.terms, args.cache, args.only
+    )
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    scenarios = results["scenarios"]
+    failed = [name for name, result in scenarios.items() if "error" in result]
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+    if failed:
+        print(f"{len(failed)} scenarios failed: {', '.join(failed)}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
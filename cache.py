@@ -0,0 +1,86 @@
+# In-process cache with LRU and TTL eviction and a memory cap.
+# Used by esdata to keep the results of popular searches, and by anything
+# else that wants to keep a rendered value for a while.
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def size_of(value):
+    """Approximate the memory held by a JSON-like value"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire after ttl seconds.
+    Least recently used entries are evicted once there are more than
+    max_entries of them or their total size exceeds max_bytes."""
+
+    def __init__(self, max_entries=1024, ttl=60, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires, size, tag, value)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def set(self, key, value, tag=None, size=None):
+        size = size_of(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, tag, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drop the entries whose tag satisfies predicate, all if None"""
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if predicate is None or predicate(entry[2]):
+                    self._drop(key)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[1]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,253 @@
+"""Precompute the clips of every word list
+
+Each term of a dicts/*.txt list is searched once, offline, the same way the
+clip server does, and the ids, durations and thumbnails of its clips are
+saved into catalog/<list>.json. The thumbnails are the ones CLIP_SERVER
+lists for the term. The app builds the playlist of a clicked term from
+the catalog, with one mget and no search, and knows in advance which
+terms have no clip.
+
+Terms are resolved in batches by a pool of processes. Every finished batch
+is appended to catalog/<list>.partial.jsonl, so a job started again after
+a crash only searches the terms not resolved yet.
+
+Usage:
+    python catalog.py                    # every list of dicts/
+    python catalog.py CET4.txt --workers 8
+    python catalog.py --report           # coverage of the built catalogs
+"""
+
+import argparse
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import assets
+import wordlists
+from video_lib import m3u8, padded_subs_by_id, segment_duration, srt_of, term_clips
+
+Playlist = namedtuple("Playlist", ["m3u8", "subtitles", "thumbnails"])
+
+CATALOG_DIR = "catalog"
+BATCH_TERMS = 50
+
+
+def thumbnails(term):
+    """The thumbnail URLs the clip server lists for a term"""
+    text = assets.get(assets.clip_url(term, ext="jpgs")).text
+    return [line for line in text.splitlines() if line.startswith("http")]
+
+
+def resolve(terms, max_duration=5, size=10):
+    """[(term, clips)] for a batch of terms, clips being a list of
+    [sub id, duration, thumbnail url or None], or None if the search or
+    the thumbnails failed"""
+    results = []
+    for term in terms:
+        try:
+            subs = term_clips(term, max_duration, size)
+            urls = thumbnails(term) if subs else []
+        except Exception as e:
+            print(f"Cannot resolve {term!r}: {e}")
+            results.append((term, None))
+            continue
+        urls += [None] * (len(subs) - len(urls))
+        clips = [[sub.id, segment_duration(sub), url] for sub, url in zip(subs, urls)]
+        results.append((term, clips))
+    return results
+
+
+def catalog_path(name, catalog_dir=CATALOG_DIR):
+    return os.path.join(catalog_dir, name.replace(".txt", "") + ".json")
+
+
+def partial_path(name, catalog_dir=CATALOG_DIR):
+    return os.path.join(catalog_dir, name.replace(".txt", "") + ".partial.jsonl")
+
+
+def load_partial(path):
+    """The terms resolved by a previous run: {term: clips}"""
+    resolved = {}
+    if not os.path.exists(path):
+        return resolved
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                term, clips = json.loads(line)
+            except ValueError:
+                continue  # the last line of a crashed run
+            resolved[term] = clips
+    return resolved
+
+
+def _write_catalog(name, terms, resolved, catalog_dir):
+    path = catalog_path(name, catalog_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {"name": name, "terms": {term: resolved[term] for term in terms}},
+            f,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    os.replace(tmp, path)
+
+
+class Job:
+    """The terms of one list still to resolve, and what was resolved"""
+
+    def __init__(self, name, catalog_dir):
+        self.name = name
+        self.catalog_dir = catalog_dir
+        self.terms = list(dict.fromkeys(wordlists.load(name).terms))
+        self.partial = partial_path(name, catalog_dir)
+        self.resolved = load_partial(self.partial)
+        self.todo = [term for term in self.terms if term not in self.resolved]
+        self.batches = 0
+        self.errors = 0
+
+    def add(self, results):
+        """Checkpoint a finished batch"""
+        done = [(term, clips) for term, clips in results if clips is not None]
+        self.errors += len(results) - len(done)
+        with open(self.partial, "a", encoding="utf-8") as f:
+            for term, clips in done:
+                self.resolved[term] = clips
+                f.write(json.dumps([term, clips], ensure_ascii=False) + "\n")
+
+    def finish(self):
+        """Write the catalog once every term is resolved"""
+        if self.errors:
+            print(f"{self.name}: {self.errors} terms failed, run again to retry")
+            return
+        _write_catalog(self.name, self.terms, self.resolved, self.catalog_dir)
+        os.remove(self.partial)
+
+
+def build(names=None, workers=None, max_duration=5, size=10, catalog_dir=CATALOG_DIR):
+    """Resolve every term of the lists and write their catalogs"""
+    os.makedirs(catalog_dir, exist_ok=True)
+    jobs = [Job(name, catalog_dir) for name in names or wordlists.names()]
+    batches = [
+        (job, job.todo[i : i + BATCH_TERMS])
+        for job in jobs
+        for i in range(0, len(job.todo), BATCH_TERMS)
+    ]
+    for job in jobs:
+        job.batches = sum(1 for owner, _ in batches if owner is job)
+        resolved = len(job.terms) - len(job.todo)
+        print(f"{job.name}: {resolved} resolved, {len(job.todo)} to go")
+        if not job.batches:
+            open(job.partial, "a").close()
+            job.finish()
+
+    def done(job, results):
+        job.add(results)
+        job.batches -= 1
+        if not job.batches:
+            job.finish()
+
+    if workers == 1:
+        for job, terms in batches:
+            done(job, resolve(terms, max_duration, size))
+        return jobs
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(resolve, terms, max_duration, size): job
+            for job, terms in batches
+        }
+        for future in as_completed(futures):
+            done(futures[future], future.result())
+    return jobs
+
+
+class Catalog:
+    """The clips of the terms of a list, as built by build()"""
+
+    def __init__(self, name, terms):
+        self.name = name
+        self.terms = terms  # term -> [[sub id, duration, thumbnail url]]
+
+    def clips(self, term):
+        return self.terms.get(term, [])
+
+    def has_clips(self, term):
+        """False for terms known to have no clip, True for unknown ones"""
+        return term not in self.terms or bool(self.terms[term])
+
+    def missing(self):
+        return [term for term, clips in self.terms.items() if not clips]
+
+    def playlist(self, term, repeat=1, padding=0):
+        """The Playlist of the catalogued clips of a term, loaded with one
+        mget and no search. None if it has no clip left"""
+        clips = self.clips(term)
+        subs = padded_subs_by_id([clip[0] for clip in clips], repeat, padding)
+        if not subs:
+            return None
+        return Playlist(
+            m3u8(subs), srt_of(subs), [clip[2] for clip in clips if clip[2]]
+        )
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load(name, catalog_dir=CATALOG_DIR):
+    """The Catalog of a list, None if it was not built"""
+    path = catalog_path(name, catalog_dir)
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        if path in _loaded and _loaded[path][0] == stamp:
+            return _loaded[path][1]
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    catalog = Catalog(data["name"], data["terms"])
+    with _lock:
+        _loaded[path] = (stamp, catalog)
+    return catalog
+
+
+def report(name, catalog_dir=CATALOG_DIR):
+    """Coverage line of the catalog of a list"""
+    catalog = load(name, catalog_dir)
+    if catalog is None:
+        return f"{name}: no catalog"
+    missing = catalog.missing()
+    total = max(len(catalog.terms), 1)
+    return (
+        f"{name}: {len(catalog.terms)} terms, {len(missing)} without clips"
+        f" ({100 * (1 - len(missing) / total):.1f}% covered)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", help="Word lists, all if omitted")
+    parser.add_argument("--workers", type=int, default=None, help="Default: cores")
+    parser.add_argument("--max-duration", type=float, default=5)
+    parser.add_argument("--size", type=int, default=10, help="Clips per term")
+    parser.add_argument("--catalog-dir", default=CATALOG_DIR)
+    parser.add_argument("--report", action="store_true", help="Coverage only")
+    parser.add_argument(
+        "--missing", action="store_true", help="List the terms without clips"
+    )
+    args = parser.parse_args()
+    names = args.names or wordlists.names()
+    if not args.report:
+        build(names, args.workers, args.max_duration, args.size, args.catalog_dir)
+    for name in names:
+        print(report(name, args.catalog_dir))
+        catalog = load(name, args.catalog_dir)
+        if args.missing and catalog:
+            print("\n".join("    " + term for term in catalog.missing()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Conversation state of the English teacher chat
+
+The system prompt is sent once per request, never stored in the history.
+Only the recent turns that fit in a token budget are sent; older turns are
+folded into a short summary, so the prompt stops growing with the
+conversation. Replies are streamed and split into lines as they arrive,
+which lets the app show a SHOW_VIDEO clip before the reply is finished.
+The clips of the SHOW_VIDEO terms are looked up concurrently, and a term
+without clips is replaced by one of its words that has some.
+"""
+
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+SHOW_VIDEO = "SHOW_VIDEO"
+
+SYSTEM_PROMPT = f"""You are an English teacher. You find an innovative way
+to teach English. Whenever you want to teach user a new word
+or phrase, you can show a video clip containing the word or phrase.
+You can just use {SHOW_VIDEO}: word or {SHOW_VIDEO}: phrase to show the video
+to the user. For example, if you want to teach students word "hola",
+you should say: {SHOW_VIDEO}: hola. The video will be shown to the user.
+When you show a word using the video, please also provide Chinese
+explaination of the meaning. Please also make sure
+you only output not more than 3 videos."""
+
+SUMMARY_PROMPT = """Summarize this conversation between an English teacher
+and a student in under 150 words. Keep the words and phrases already taught,
+the student's level and what they asked for."""
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text):
+        return len(_encoding.encode(text))
+
+except ImportError:  # a rough estimate is enough for a budget
+
+    def count_tokens(text):
+        return len(text) // 4 + 1
+
+
+def _message_tokens(message):
+    return count_tokens(message["content"]) + 4
+
+
+class History:
+    """The turns of a conversation, and the summary of the oldest ones"""
+
+    def __init__(self, budget=settings.CHAT_HISTORY_TOKENS):
+        self.budget = budget
+        self.turns = []  # {"role": "user"|"assistant", "content": ...}
+        self.summary = ""
+
+    def add(self, role, content):
+        self.turns.append({"role": role, "content": content})
+
+    def _split(self, budget=None):
+        """Index of the first turn that fits in the budget. The last turn
+        is always kept, however long"""
+        budget = self.budget if budget is None else budget
+        used = 0
+        for n in range(len(self.turns) - 1, -1, -1):
+            used += _message_tokens(self.turns[n])
+            if used > budget:
+                return min(n + 1, len(self.turns) - 1)
+        return 0
+
+    def messages(self):
+        """The messages to send: system prompt, summary, recent turns"""
+        system = SYSTEM_PROMPT
+        if self.summary:
+            system += "\n\nSummary of the conversation so far:\n" + self.summary
+        return [{"role": "system", "content": system}] + self.turns[self._split() :]
+
+    def compact(self, client, model=settings.CHAT_MODEL):
+        """Once the turns no longer fit, fold the oldest ones into the
+        summary until the rest fits in half of the budget: the next turns
+        then fit without another summary. Call it after a reply is shown,
+        so it never delays one"""
+        if not self._split():
+            return False
+        split = self._split(self.budget // 2)
+        old = self.turns[:split]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old)
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n\n{transcript}"
+        response = client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            model=model,
+        )
+        self.summary = response.choices[0].message.content.strip()
+        self.turns = self.turns[split:]
+        return True
+
+
+def deltas(stream):
+    """The text pieces of a streamed chat completion"""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def stream_lines(pieces):
+    """Yield (line, complete): the line being written after each piece,
+    then each line once complete, the last one included"""
+    line = ""
+    for piece in pieces:
+        *done, line = (line + piece).split("\n")
+        for complete in done:
+            yield complete, True
+        if line:
+            yield line, False
+    if line:
+        yield line, True
+
+
+def video_term(line):
+    """The word or phrase of a SHOW_VIDEO line, None for other lines"""
+    if match := re.search(f"{SHOW_VIDEO}:(.*)", line):
+        return match.group(1).strip() or None
+    return None
+
+
+def normalize_term(term):
+    """'**Break down** (分解)' -> 'break down', '"Hola!"' -> 'hola'"""
+    term = re.sub(r"\s*[(（].*?[)）]", "", term)
+    term = re.split(r"\s[-–—:]\s|[,，;；。]", term)[0]  # drop an explanation
+    term = re.sub(r"[*_`]", "", term)
+    return " ".join(term.strip(" .!?\"'“”‘’").split()).lower()
+
+
+def directives(text):
+    """The normalized SHOW_VIDEO terms of a reply, each once, in order"""
+    terms = (normalize_term(video_term(line) or "") for line in text.splitlines())
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+def fallbacks(term):
+    """The term, then the longer words of a phrase, longest first"""
+    words = [word for word in dict.fromkeys(term.split()) if len(word) > 2]
+    if len(words) < 2:
+        return [term]
+    return [term] + sorted(words, key=len, reverse=True)
+
+
+_executor = ThreadPoolExecutor(max_workers=settings.RESOLVE_WORKERS)
+
+
+class VideoResolver:
+    """Find the clip to show for each SHOW_VIDEO term of a reply.
+    Lookups run concurrently, so a reply is ready in the time of its
+    slowest term. has_clips(term) tells whether a term has clips."""
+
+    def __init__(self, has_clips):
+        self.has_clips = has_clips
+        self.futures = {}
+
+    def submit(self, term):
+        """Start looking up a term. The future gives the term to show,
+        None when neither it nor its fallbacks have clips. Return None
+        for an empty term or one already submitted"""
+        term = normalize_term(term)
+        if not term or term in self.futures:
+            return None
+        self.futures[term] = _executor.submit(self._resolve, term)
+        return self.futures[term]
+
+    def _resolve(self, term):
+        for candidate in fallbacks(term):
+            try:
+                if self.has_clips(candidate):
+                    return candidate
+            except Exception as e:
+                logger.warning("Cannot look up the clips of %s: %s", candidate, e)
+                return term  # unknown, let the player try
+        return None
+
+    def resolve_all(self, text):
+        """{term: term to show or None} for the directives of a reply"""
+        for term in directives(text):
+            self.submit(term)
+        return {term: future.result() for term, future in self.futures.items()}
@@ -0,0 +1,177 @@
+"""Serve the clips of terms over HTTP
+
+The same routes as the clip server the app uses:
+
+    GET /m3u8/<term>.m3u8?repeat=1&padding=0   playlist
+    GET /m3u8/<term>.srt?repeat=1&padding=0    subtitles on the playlist
+    GET /m3u8/<term>.jpgs?repeat=1&padding=0   thumbnail URLs, one per line
+
+The store has no verified thumbnails of the clips yet, so the .jpgs list
+is empty: clients fall back to the playlist rather than to guessed URLs.
+
+The store is searched through AsyncSub, whose client keeps a pool of
+connections. The three documents of a term are rendered together from
+one search and cached, so the page asking for the .m3u8 and .srt of a
+word costs one search. Concurrent requests for the same clip share
+that search. Every response carries an ETag, and a matching
+If-None-Match is answered with 304. /metrics returns the timers and
+counters of tracing, e.g. the round-trips to the store per clip.
+
+The server keeps no state besides its cache, so several of them can run
+behind a load balancer.
+
+Usage:
+    python clip_server.py --port 8080
+    python clip_server.py --port 8080 --memory season2/*.srt   # local store
+"""
+
+import argparse
+import asyncio
+import hashlib
+
+from aiohttp import web
+
+import settings
+import tracing
+import video_lib
+from cache import TTLCache
+from esdata import AsyncData
+
+CONTENT_TYPES = {
+    "m3u8": "application/vnd.apple.mpegurl",
+    "srt": "application/x-subrip",
+    "jpgs": "text/plain",
+}
+MAX_REPEAT = 10
+MAX_PADDING = 5
+
+
+def _int_param(request, name, default, low, high):
+    try:
+        value = int(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+    if not low <= value <= high:
+        raise web.HTTPBadRequest(text=f"{name} must be between {low} and {high}")
+    return value
+
+
+class ClipServer:
+    """The routes, the rendered clips cache and the searches in flight"""
+
+    def __init__(self, max_duration=5, size=10):
+        self.max_duration = max_duration
+        self.size = size
+        self.cache = TTLCache(
+            max_entries=settings.PLAYLIST_CACHE_ENTRIES,
+            ttl=settings.PLAYLIST_CACHE_TTL,
+        )
+        self.inflight = {}
+
+    @tracing.traced("clip_server.render")
+    async def render(self, term, repeat, padding):
+        """The m3u8, srt and jpgs of a term, each with its ETag"""
+        hits = await video_lib.term_clips_async(term, self.max_duration, self.size)
+        subs = await video_lib.padded_subs_async(hits, repeat, padding)
+        bodies = {
+            "m3u8": video_lib.m3u8(subs),
+            "srt": video_lib.srt_of(subs),
+            "jpgs": "",
+        }
+        return {
+            ext: (body, '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"')
+            for ext, body in bodies.items()
+        }
+
+    async def clip(self, term, repeat, padding):
+        """The cached rendering of a clip, searched once at a time"""
+        key = (term, repeat, padding)
+        rendered = self.cache.get(key)
+        tracing.count("clip_cache.miss" if rendered is None else "clip_cache.hit")
+        if rendered is not None:
+            return rendered
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = asyncio.ensure_future(self._render(key))
+        # A client going away must not cancel the search of the others
+        return await asyncio.shield(future)
+
+    async def _render(self, key):
+        try:
+            rendered = await self.render(*key)
+            self.cache.set(key, rendered)
+            return rendered
+        finally:
+            del self.inflight[key]
+
+    async def handle_clip(self, request):
+        term = request.match_info["term"].strip()
+        ext = request.match_info["ext"]
+        if not term:
+            raise web.HTTPNotFound()
+        repeat = _int_param(request, "repeat", 1, 1, MAX_REPEAT)
+        padding = _int_param(request, "padding", 0, 0, MAX_PADDING)
+        body, etag = (await self.clip(term, repeat, padding))[ext]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={int(settings.PLAYLIST_CACHE_TTL)}",
+            "Access-Control-Allow-Origin": "*",
+        }
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        return web.Response(
+            text=body, content_type=CONTENT_TYPES[ext], charset="utf-8", headers=headers
+        )
+
+    async def handle_health(self, request):
+        return web.json_response({"status": "ok", "cache": self.cache.stats()})
+
+    async def handle_metrics(self, request):
+        return web.json_response(tracing.snapshot())
+
+
+async def _close_store(app):
+    await AsyncData.close()
+
+
+def make_app(server=None):
+    server = server or ClipServer()
+    app = web.Application()
+    app.router.add_get(r"/m3u8/{term}.{ext:m3u8|srt|jpgs}", server.handle_clip)
+    app.router.add_get("/healthz", server.handle_health)
+    app.router.add_get("/metrics", server.handle_metrics)
+    app.on_cleanup.append(_close_store)
+    return app
+
+
+def use_memory_store(paths):
+    """Serve the srt files from a MemoryBackend instead of Elasticsearch"""
+    import ingest
+    from backends import AsyncBackendAdapter, MemoryBackend
+    from esdata import Data
+
+    Data.backend = MemoryBackend()
+    AsyncData.backend = AsyncBackendAdapter(Data.backend)
+    ingest.ingest(paths, workers=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-duration", type=float, default=5)
+    parser.add_argument("--size", type=int, default=10, help="Clips per term")
+    parser.add_argument(
+        "--memory", nargs="+", metavar="SRT", help="Load these srt files in memory"
+    )
+    args = parser.parse_args()
+    tracing.configure_logging()
+    if args.memory:
+        use_memory_store(args.memory)
+    app = make_app(ClipServer(args.max_duration, args.size))
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
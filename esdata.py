@@ -4,12 +4,20 @@
 # This small library helps to build functions to interact with Elasticsearch
 # It is suggested that you inherit the Data class to build your own data class
 
+import fnmatch
+import json
+import logging
 import time
-from copy import copy
 
-from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import NotFoundError
 from elasticsearch_dsl import A, Q, Search
+from elasticsearch_dsl.utils import AttrDict
+
+import settings
+import tracing
+from backends import AsyncElasticsearchBackend, ElasticsearchBackend
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 
 class RequiredFieldMissingException(Exception):
@@ -34,29 +42,50 @@ class Field:
 
 
 class Response:
-    """The response data from find function"""
-
-    def __init__(self):
-        self.data = []
+    """The response data from find function.
+    Keeps the raw hits and only builds an item when a row is accessed,
+    so large pages cost little until they are used."""
+
+    def __init__(self, hits=None, factory=None):
+        self.hits = hits or []
+        self.factory = factory
+        self.rows = [None] * len(self.hits)
         self.count = 0
+        # Sort values of the last hit, the search_after of the next page
+        self.cursor = self.hits[-1].get("sort") if self.hits else None
+
+    @property
+    def data(self):
+        return [self[n] for n in range(len(self))]
 
     def __iter__(self):
-        return iter(self.data)
+        for n in range(len(self)):
+            yield self[n]
 
     def __len__(self):
-        return len(self.data)
+        return len(self.hits)
 
     def __getitem__(self, n):
-        return self.data[n]
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        if self.rows[n] is None:
+            self.rows[n] = self.factory(self.hits[n])
+        return self.rows[n]
+
+    def column(self, name):
+        """Values of one field for all the hits, without building items"""
+        if name == "id":
+            return [hit["_id"] for hit in self.hits]
+        return [hit.get("_source", {}).get(name) for hit in self.hits]
 
     def first(self, **kwargs):
         """Find the only one result from search"""
-        for result in self.data:
+        for result in self:
             return result
         return None
 
     def __str__(self):
-        return f"{self.__class__.__name__} {len(self.data)}/{self.count}"
+        return f"{self.__class__.__name__} {len(self)}/{self.count}"
 
 
 class Edge:
@@ -66,13 +95,9 @@ class Edge:
         self.name = name
 
 
-# This is the test ES Server managed by 纳什
-# jianshuo@100031339132
-# 子账号 ID: 100037619115
-# 主账号 ID: 100031339132
-ES_SERVER = "es-nluebvi0.public.tencentelasticsearch.com:9200"
-ES_AUTH_USER = "elastic"
-ES_AUTH_PASSWORD = "Baixing2023*"
+ES_SERVER = settings.ES_SERVER
+ES_AUTH_USER = settings.ES_AUTH_USER
+ES_AUTH_PASSWORD = settings.ES_AUTH_PASSWORD
 
 
 class Data:
@@ -85,11 +110,28 @@ class Data:
         Field("modified", type="datetime"),
         Field("deleted", type="bool", default=False),
     ]
-    es = Elasticsearch(
+    # Explicit mapping for fields dynamic mapping would get wrong
+    mapping = None
+    # Swap in another backend (e.g. backends.MemoryBackend) to run without
+    # the remote cluster. Subclasses share it unless they set their own.
+    # The client behind it is only created on first use.
+    backend = ElasticsearchBackend(
         hosts=[f"https://{ES_AUTH_USER}:{ES_AUTH_PASSWORD}@{ES_SERVER}"],
-        timeout=30,
-        max_retries=10,
-        retry_on_timeout=True,
+        request_timeout=settings.ES_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=settings.ES_RETRY_ON_TIMEOUT,
+        connections_per_node=settings.ES_POOL_SIZE,
+        task_timeout=settings.ES_TASK_TIMEOUT,
+    )
+    # Search results shared by all the Data classes, None to disable
+    cache = (
+        TTLCache(
+            max_entries=settings.QUERY_CACHE_ENTRIES,
+            ttl=settings.QUERY_CACHE_TTL,
+            max_bytes=settings.QUERY_CACHE_BYTES,
+        )
+        if settings.QUERY_CACHE_ENTRIES > 0
+        else None
     )
 
     def __init__(self, id=None):
@@ -97,21 +139,72 @@ class Data:
         if id:
             self.load(id)
 
+    @classmethod
+    def close(cls):
+        """Release the connections of the backend"""
+        cls.backend.close()
+
+    @classmethod
+    def index_name(cls):
+        """The index of the class. self.index may be shadowed by a field"""
+        return cls.index
+
+    @tracing.traced_method
     def load(self, id):
         """Load by id"""
-        try:
-            item = self.es.get(index=self.index, id=id)
-            print(f'{self.__class__.__name__} ("{self.index}") getting {id}')
-        except NotFoundError:
-            item = None
+        item = self.backend.get(self.index_name(), id)
+        tracing.round_trip("get", item)
+        return self._loaded(id, item)
 
+    def _loaded(self, id, item):
         if item is None:
             raise FileNotFoundError(f"{self.__class__.__name__} " f"<{id}> not found")
+        logger.debug(
+            '%s ("%s") getting %s', self.__class__.__name__, self.index_name(), id
+        )
 
         self.__dict__ = item["_source"].copy()
         self.id = item["_id"]
         return self
 
+    def _from_doc(self, doc):
+        """Build an item from a get/mget doc, None if it was not found"""
+        if doc is None:
+            return None
+        item = self.__class__()
+        item.__dict__ = doc["_source"].copy()
+        item.id = doc["_id"]
+        return item
+
+    def _from_hit(self, hit):
+        """Build an item from a search hit, with every field set"""
+        item = self.__class__.__new__(self.__class__)
+        source = hit.get("_source", {})
+        item.__dict__ = {name: source.get(name) for name in self._field_names()}
+        item.id = hit["_id"]
+        return item
+
+    @classmethod
+    def _field_names(cls):
+        """Names of the fields but id, computed once per class"""
+        if "_FIELD_NAMES" not in cls.__dict__:
+            cls._FIELD_NAMES = [
+                field.name for field in Data.fields + cls.fields if field.name != "id"
+            ]
+        return cls._FIELD_NAMES
+
+    @tracing.traced_method
+    def load_many(self, ids):
+        """Load several items by id in a single mget round-trip.
+        Return a list aligned with ids, with None for the missing ones"""
+        ids = list(ids)
+        if not ids:
+            return []
+        docs = self.backend.mget(self.index_name(), ids)
+        tracing.round_trip("mget", docs)
+        return [self._from_doc(doc) for doc in docs]
+
+    @tracing.traced_method
     def find(
         self,
         filter=None,
@@ -122,11 +215,198 @@ class Data:
         sort=None,
         collapse=None,
         extra=None,
+        fields=None,
+        search_after=None,
         **kwargs,
     ):
-
-        srch = Search(index=self.index)
-        srch = srch.using(self.es)
+        srch = self._search(
+            filter,
+            size,
+            page,
+            query,
+            query_string,
+            sort,
+            collapse,
+            extra,
+            fields,
+            search_after,
+            **kwargs,
+        )
+        body = srch.to_dict()
+        return self._response(body, self._cached_search(body), collapse)
+
+    @tracing.traced_method
+    def find_many(self, queries):
+        """Run several finds with one _msearch request.
+        queries are dicts of find() arguments; return a Response per query.
+        Searches already in the cache are not sent again"""
+        bodies, collapses, keys, results = self._many_searches(queries)
+        missing = [n for n, res in enumerate(results) if res is None]
+        if missing:
+            responses = self.backend.msearch(
+                self.index_name(), [bodies[n] for n in missing]
+            )
+            tracing.round_trip("msearch", responses)
+            self._many_found(bodies, keys, results, missing, responses)
+        return [
+            self._response(body, res, collapse)
+            for body, res, collapse in zip(bodies, results, collapses)
+        ]
+
+    def _many_searches(self, queries):
+        """The bodies, collapses and cache keys of the queries of find_many,
+        and their cached responses, None for the ones to search"""
+        bodies, collapses = [], []
+        for kwargs in queries:
+            bodies.append(self._search(**kwargs).to_dict())
+            collapses.append(kwargs.get("collapse"))
+        keys = [self._cache_key(body) for body in bodies]
+        return bodies, collapses, keys, [self._cache_get(key) for key in keys]
+
+    def _many_found(self, bodies, keys, results, missing, responses):
+        """Check and cache the _msearch responses of the missing results"""
+        for n, res in zip(missing, responses):
+            if "error" in res:
+                raise RuntimeError(f"Search {bodies[n]} failed: {res['error']}")
+            self._cache_set(keys[n], res)
+            results[n] = res
+
+    def iter_all(
+        self,
+        filter=None,
+        query=None,
+        query_string=None,
+        sort=None,
+        fields=None,
+        batch_size=500,
+        keep_alive=settings.PIT_KEEP_ALIVE,
+        include_deleted=False,
+        **kwargs,
+    ):
+        """Yield every matching item, reading batch_size hits at a time.
+        The batches are read with search_after on a point in time of the
+        index: memory stays bounded, each batch costs the same however
+        deep it is, and writes made meanwhile (e.g. by a backfill) do not
+        shift the batches. Results are not cached.
+        include_deleted also yields the deleted items, e.g. to replicate
+        the deletions"""
+        pit = self.backend.open_pit(self.index_name(), keep_alive)
+        tracing.round_trip("open_pit")
+        after = None
+        try:
+            while True:
+                body = self._batch_body(
+                    pit,
+                    after,
+                    filter,
+                    query,
+                    query_string,
+                    sort,
+                    fields,
+                    batch_size,
+                    keep_alive,
+                    include_deleted,
+                    **kwargs,
+                )
+                res = self.backend.search(self.index_name(), body)
+                tracing.round_trip("search", res)
+                pit = res.get("pit_id", pit)
+                hits = res["hits"]["hits"]
+                for hit in hits:
+                    yield self._from_hit(hit)
+                if len(hits) < batch_size:
+                    break
+                after = hits[-1]["sort"]
+        finally:
+            self.backend.close_pit(pit)
+            tracing.round_trip("close_pit")
+
+    def _batch_body(
+        self,
+        pit,
+        after,
+        filter,
+        query,
+        query_string,
+        sort,
+        fields,
+        batch_size,
+        keep_alive,
+        include_deleted,
+        **kwargs,
+    ):
+        """The search of the iter_all batch after the sort values after"""
+        srch = self._search(
+            filter,
+            batch_size,
+            1,
+            query,
+            query_string,
+            sort or "_shard_doc",
+            None,
+            None,
+            fields,
+            after,
+            include_deleted,
+            **kwargs,
+        )
+        body = srch.to_dict()
+        body["pit"] = {"id": pit, "keep_alive": keep_alive}
+        return body
+
+    def _cached_search(self, body):
+        """Run the search body, or take its response from the cache"""
+        key = self._cache_key(body)
+        res = self._cache_get(key)
+        if res is None:
+            res = self.backend.search(self.index_name(), body)
+            tracing.round_trip("search", res)
+            self._cache_set(key, res)
+        return res
+
+    def _cache_key(self, body):
+        """The normalized search, index and page (from/size) are the key"""
+        return (self.index_name(), json.dumps(body, sort_keys=True, default=str))
+
+    def _cache_get(self, key):
+        if self.cache is None:
+            return None
+        res = self.cache.get(key)
+        tracing.count("query_cache.miss" if res is None else "query_cache.hit")
+        return res
+
+    def _cache_set(self, key, res):
+        if self.cache is not None:
+            self.cache.set(key, res, tag=self.index_name())
+
+    def invalidate_cache(self):
+        """Forget the cached searches that may include this index"""
+        if self.cache is not None:
+            index = self.index_name()
+            self.cache.invalidate(lambda tag: fnmatch.fnmatch(index, tag))
+
+    def _search(
+        self,
+        filter=None,
+        size=20,
+        page=1,
+        query=None,
+        query_string=None,
+        sort=None,
+        collapse=None,
+        extra=None,
+        fields=None,
+        search_after=None,
+        include_deleted=False,
+        **kwargs,
+    ):
+        """Build the Search behind find.
+        fields limits the _source returned to the named fields; the items
+        built from such a partial hit should not be saved back.
+        search_after, the cursor of the previous Response, replaces page:
+        deep pages then cost the same as the first one. The sort must end
+        with a unique field, or run on a point in time (see iter_all)"""
+        srch = Search(index=self.index_name())
 
         filter = filter or {}
         for key, value in {**kwargs, **filter}.items():
@@ -139,40 +419,42 @@ class Data:
         if query_string:
             srch = srch.query(Q("query_string", query=query_string))
         if sort:
-            srch = srch.sort(sort)
+            srch = srch.sort(*(sort if isinstance(sort, (list, tuple)) else [sort]))
         if collapse:
             srch = srch.update_from_dict({"collapse": {"field": collapse}})
             a = A("cardinality", field=collapse)
             srch.aggs.bucket("total", a)
-        srch = srch.query(~Q("match", deleted=True))
-        srch = srch[(page - 1) * size : page * size]
+        if not include_deleted:
+            srch = srch.query(~Q("match", deleted=True))
+        if search_after is not None:
+            srch = srch.extra(search_after=list(search_after))[:size]
+        else:
+            srch = srch[(page - 1) * size : page * size]
+        if fields:
+            srch = srch.source(list(fields))
 
         extra = extra or {}
-        srch = srch.extra(**extra)
-        res = srch.execute()
+        return srch.extra(**extra)
 
-        resp = Response()
+    def _response(self, body, res, collapse=None):
+        """Turn a raw search response into a Response of items"""
+        resp = Response(res["hits"]["hits"], self._from_hit)
         if collapse:
-            resp.count = res.aggregations.total.value
+            resp.count = res["aggregations"]["total"]["value"]
         else:
-            resp.count = res.hits.total.value
-
-        for hit in res.hits:
-            item = copy(self)
-            item.id = hit.meta.id
-            dic = hit.to_dict()
-            print("SCORE", hit.meta.score)
-            for field in self.field_list(exclude="id"):
-                setattr(item, field.name, dic.get(field.name))
-            resp.data.append(item)
+            total = res["hits"]["total"]
+            resp.count = total["value"] if isinstance(total, dict) else total
 
         if "aggregations" in res:
-            resp.aggregations = res.aggregations
-
-        print(
-            f'{self.__class__.__name__} (index="{self.index}")'
-            f" search {srch.to_dict()}"
-            f" <{resp}>"
+            resp.aggregations = AttrDict(res["aggregations"])
+
+        tracing.annotate(body=body, hits=len(resp), total=resp.count)
+        logger.debug(
+            '%s (index="%s") search %s <%s>',
+            self.__class__.__name__,
+            self.index_name(),
+            body,
+            resp,
         )
 
         return resp
@@ -181,7 +463,65 @@ class Data:
         """Check if a data enitity exists in the search engine"""
         return self.find(**kwargs).first() is not None
 
+    @tracing.traced_method
     def save(self):
+        body, id = self._prepare_save()
+        self.id = self.backend.index(self.index_name(), body, id=id)
+        tracing.round_trip("index")
+        self.invalidate_cache()
+        return self
+
+    @tracing.traced_method
+    def update_by_query(self, query, source, params=None):
+        """Run a painless script on every item matching query, in the store.
+        Only what the script sets changes: the other fields of _source are
+        kept and modified is not stamped. Return the number updated"""
+        res = self.backend.update_by_query(
+            self.index_name(), self._update_body(query, source, params)
+        )
+        tracing.round_trip("update_by_query")
+        self.invalidate_cache()
+        return res["updated"]
+
+    @staticmethod
+    def _update_body(query, source, params=None):
+        return {
+            "query": Q(query).to_dict(),
+            "script": {"source": source, "lang": "painless", "params": params or {}},
+        }
+
+    def put_mapping(self):
+        """Declare the explicit field types of the class in the index"""
+        if self.mapping:
+            self.backend.put_mapping(self.index_name(), self.mapping)
+
+    @tracing.traced_method
+    def save_many(self, items):
+        """Save the items with one bulk request.
+        Return the (item, result) pairs that failed, e.g. with status 429"""
+        items = list(items)
+        if not items:
+            return []
+        docs = [item._prepare_save() for item in items]
+        results = self.backend.bulk(self.index_name(), [(id, body) for body, id in docs])
+        tracing.round_trip("bulk")
+        self.invalidate_cache()
+        return self._failed(items, results)
+
+    def _failed(self, items, results):
+        """The (item, result) pairs of a bulk that failed, setting the id of
+        the saved items"""
+        failed = []
+        for item, result in zip(items, results):
+            if result.get("status", 500) >= 300:
+                failed.append((item, result))
+            else:
+                item.id = result["_id"]
+        return failed
+
+    def _prepare_save(self):
+        """Stamp times, check and default the fields.
+        Return the body to index and the id to index it under"""
         self.modified = time.time()
         if not hasattr(self, "created"):
             self.created = time.time()
@@ -199,14 +539,10 @@ class Data:
 
         body = self.field_dict(exclude="id")
 
-        kwargs = {"index": self.index, "body": body}
-
-        if hasattr(self, "id"):
-            kwargs["id"] = self.id
-
-        resp = self.es.index(**kwargs)
-        self.id = resp.get("_id")
-        return self
+        id = getattr(self, "id", None)
+        if callable(id):  # e.g. Sub.id() derives it from the srt file
+            id = id()
+        return body, id
 
     def field_list(self, exclude=None):
         """A possible fields"""
@@ -216,24 +552,27 @@ class Data:
 
     def field_dict(self, exclude=None):
         """Turn self into a dict"""
-        exclude = exclude or []
+        names = {field.name for field in self.field_list(exclude=exclude)}
         return {
             key: value
             # 原因是发现title如果是'61e406800000000001026053'，这里生成的Infinity会导致save出错
             for key, value in vars(self).items()
-            if key not in exclude and key in [field.name for field in self.field_list()]
+            if key in names
         }
 
+    @tracing.traced_method
     def top_terms(self, field, size=10):
         """Return the top terms of the given field
         [{'key': '电影', 'doc_count': 1222}]
         """
 
-        srch = Search(index=self.index)
+        resp = self._cached_search(self._top_terms_search(field, size).to_dict())
+        return AttrDict(resp["aggregations"]).top.buckets
+
+    def _top_terms_search(self, field, size=10):
+        srch = Search(index=self.index_name()).extra(size=0)
         srch.aggs.bucket("top", A("terms", field=field, size=size))
-        print(f"{self.__class__.__name__} is searching", srch.to_dict())
-        resp = srch.execute()
-        return resp.aggregations.top.buckets
+        return srch
 
     def __repr__(self):
         return f"{self.__class__.__name__} <{str(id(self))}>" f" {str(vars(self))}"
@@ -256,25 +595,79 @@ class Data:
 class VectorData(Data):
     """
     Use l2norm to calculate similarity
+
+    By default find runs the exact script_score scan over every document,
+    which works whatever the mapping. knn=True runs an approximate kNN search
+    on the HNSW index of the dense_vector field instead, sublinear in the size
+    of the index; it needs the mapping put by put_mapping with dims set. The
+    match filters are applied inside the kNN search.
     """
 
-    def find(self, filter=None, **kwargs):
-        """Search Vector with similarity"""
-        if filter and "vector" in filter:
+    vector_field = "vector"
+    dims = None  # Set by subclasses to put the dense_vector mapping
+    similarity = "l2_norm"
+
+    def put_mapping(self):
+        """Map the vector field as an HNSW indexed dense_vector"""
+        if self.dims:
+            properties = {
+                self.vector_field: {
+                    "type": "dense_vector",
+                    "dims": self.dims,
+                    "index": True,
+                    "similarity": self.similarity,
+                    "index_options": {"type": "hnsw", "m": 16, "ef_construction": 100},
+                }
+            }
+            self.backend.put_mapping(self.index_name(), {"properties": properties})
+        super().put_mapping()
+
+    def find(
+        self,
+        filter=None,
+        k=None,
+        num_candidates=100,
+        knn=False,
+        size=20,
+        page=1,
+        **kwargs,
+    ):
+        """Search Vector with similarity.
+        With knn=True, k is the number of neighbors (page * size by default)
+        and num_candidates the number of candidates examined per shard"""
+        filter = dict(filter or {})
+        vector = filter.pop(self.vector_field, None)
+        if vector is None:
+            return super().find(filter=filter, size=size, page=page, **kwargs)
+        if not knn:
             query = Q(
                 {
                     "function_score": {
                         "script_score": {
                             "script": {
                                 "source": "1/(1+l2norm(params.queryVector,'vector'))",
-                                "params": {"queryVector": filter["vector"]},
+                                "params": {"queryVector": vector},
                             }
                         }
                     }
                 }
             )
-            return super().find(query=query, **kwargs)
-        return super().find(filter=filter, **kwargs)
+            return super().find(
+                filter=filter, query=query, size=size, page=page, **kwargs
+            )
+
+        k = k or page * size
+        body = self._search(filter, size=size, page=page, **kwargs).to_dict()
+        # The filters must narrow the kNN search rather than add hits to it
+        body["knn"] = {
+            "field": self.vector_field,
+            "query_vector": list(vector),
+            "k": k,
+            "num_candidates": max(num_candidates, k),
+        }
+        if "query" in body:
+            body["knn"]["filter"] = body.pop("query")
+        return self._response(body, self._cached_search(body), kwargs.get("collapse"))
 
 
 class Sub(Data):
@@ -290,6 +683,7 @@ class Sub(Data):
         sub_end: The end time of the subtitle in the subtitle.
         ts_ready: Whether the subtitle is ready to be converted to .ts
         srt_file: The name of the srt file
+        duration: end - start, filled on save to filter clips by length
 
 
     Examples:
@@ -315,11 +709,20 @@ class Sub(Data):
         Field("sub_end"),
         Field("srt_file"),
         Field("ts_ready"),
+        Field("duration", type="float"),
     ]
+    mapping = {"properties": {"duration": {"type": "float"}}}
 
     def __init__(self, id=None):
         super().__init__(id)
 
+    def _prepare_save(self):
+        if getattr(self, "start", None) is not None and (
+            getattr(self, "end", None) is not None
+        ):
+            self.duration = float(self.end - self.start)
+        return super()._prepare_save()
+
     def __str__(self):
         return self.media_url()
 
@@ -329,3 +732,202 @@ class Sub(Data):
     def id(self):
         """Generate a unique ID"""
         return f"{self.srt_file}_{self.index}"
+
+
+class AsyncData(Data):
+    """asyncio counterpart of Data, with the same find/load/save semantics.
+    Every operation is a coroutine, so one event loop can overlap many of
+    them. Use `await AsyncSub().load(id)` rather than AsyncSub(id)."""
+
+    # Set to backends.AsyncBackendAdapter(MemoryBackend()) to run locally
+    backend = AsyncElasticsearchBackend(
+        hosts=[f"https://{ES_AUTH_USER}:{ES_AUTH_PASSWORD}@{ES_SERVER}"],
+        request_timeout=settings.ES_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=settings.ES_RETRY_ON_TIMEOUT,
+        connections_per_node=settings.ES_POOL_SIZE,
+        task_timeout=settings.ES_TASK_TIMEOUT,
+    )
+
+    def __init__(self, id=None):
+        if id:
+            raise TypeError(f"Use await {self.__class__.__name__}().load(id)")
+
+    @classmethod
+    async def close(cls):
+        """Release the connections of the backend"""
+        await cls.backend.close()
+
+    @tracing.traced_method
+    async def load(self, id):
+        """Load by id"""
+        item = await self.backend.get(self.index_name(), id)
+        tracing.round_trip("get", item)
+        return self._loaded(id, item)
+
+    @tracing.traced_method
+    async def load_many(self, ids):
+        """Load several items by id in a single mget round-trip"""
+        ids = list(ids)
+        if not ids:
+            return []
+        docs = await self.backend.mget(self.index_name(), ids)
+        tracing.round_trip("mget", docs)
+        return [self._from_doc(doc) for doc in docs]
+
+    @tracing.traced_method
+    async def find(
+        self,
+        filter=None,
+        size=20,
+        page=1,
+        query=None,
+        query_string=None,
+        sort=None,
+        collapse=None,
+        extra=None,
+        fields=None,
+        search_after=None,
+        **kwargs,
+    ):
+        srch = self._search(
+            filter,
+            size,
+            page,
+            query,
+            query_string,
+            sort,
+            collapse,
+            extra,
+            fields,
+            search_after,
+            **kwargs,
+        )
+        body = srch.to_dict()
+        key = self._cache_key(body)
+        res = self._cache_get(key)
+        if res is None:
+            res = await self.backend.search(self.index_name(), body)
+            tracing.round_trip("search", res)
+            self._cache_set(key, res)
+        return self._response(body, res, collapse)
+
+    async def exists(self, **kwargs):
+        """Check if a data enitity exists in the search engine"""
+        return (await self.find(**kwargs)).first() is not None
+
+    @tracing.traced_method
+    async def find_many(self, queries):
+        """Run several finds with one _msearch request"""
+        bodies, collapses, keys, results = self._many_searches(queries)
+        missing = [n for n, res in enumerate(results) if res is None]
+        if missing:
+            responses = await self.backend.msearch(
+                self.index_name(), [bodies[n] for n in missing]
+            )
+            tracing.round_trip("msearch", responses)
+            self._many_found(bodies, keys, results, missing, responses)
+        return [
+            self._response(body, res, collapse)
+            for body, res, collapse in zip(bodies, results, collapses)
+        ]
+
+    async def iter_all(
+        self,
+        filter=None,
+        query=None,
+        query_string=None,
+        sort=None,
+        fields=None,
+        batch_size=500,
+        keep_alive=settings.PIT_KEEP_ALIVE,
+        include_deleted=False,
+        **kwargs,
+    ):
+        """Yield every matching item, batch by batch on a point in time.
+        An async generator: use `async for item in AsyncSub().iter_all()`"""
+        pit = await self.backend.open_pit(self.index_name(), keep_alive)
+        tracing.round_trip("open_pit")
+        after = None
+        try:
+            while True:
+                body = self._batch_body(
+                    pit,
+                    after,
+                    filter,
+                    query,
+                    query_string,
+                    sort,
+                    fields,
+                    batch_size,
+                    keep_alive,
+                    include_deleted,
+                    **kwargs,
+                )
+                res = await self.backend.search(self.index_name(), body)
+                tracing.round_trip("search", res)
+                pit = res.get("pit_id", pit)
+                hits = res["hits"]["hits"]
+                for hit in hits:
+                    yield self._from_hit(hit)
+                if len(hits) < batch_size:
+                    break
+                after = hits[-1]["sort"]
+        finally:
+            await self.backend.close_pit(pit)
+            tracing.round_trip("close_pit")
+
+    @tracing.traced_method
+    async def save(self):
+        body, id = self._prepare_save()
+        self.id = await self.backend.index(self.index_name(), body, id=id)
+        tracing.round_trip("index")
+        self.invalidate_cache()
+        return self
+
+    @tracing.traced_method
+    async def save_many(self, items):
+        """Save the items with one bulk request.
+        Return the (item, result) pairs that failed"""
+        items = list(items)
+        if not items:
+            return []
+        docs = [item._prepare_save() for item in items]
+        results = await self.backend.bulk(
+            self.index_name(), [(id, body) for body, id in docs]
+        )
+        tracing.round_trip("bulk")
+        self.invalidate_cache()
+        return self._failed(items, results)
+
+    @tracing.traced_method
+    async def update_by_query(self, query, source, params=None):
+        """Run a painless script on every item matching query, in the store.
+        Return the number updated"""
+        res = await self.backend.update_by_query(
+            self.index_name(), self._update_body(query, source, params)
+        )
+        tracing.round_trip("update_by_query")
+        self.invalidate_cache()
+        return res["updated"]
+
+    @tracing.traced_method
+    async def top_terms(self, field, size=10):
+        """Return the top terms of the given field"""
+        srch = self._top_terms_search(field, size)
+        body = srch.to_dict()
+        key = self._cache_key(body)
+        resp = self._cache_get(key)
+        if resp is None:
+            resp = await self.backend.search(self.index_name(), body)
+            tracing.round_trip("search", resp)
+            self._cache_set(key, resp)
+        return AttrDict(resp["aggregations"]).top.buckets
+
+    async def delete(self):
+        self.deleted = True
+        await self.save()
+
+
+class AsyncSub(AsyncData, Sub):
+    """Sub with the AsyncData API"""
@@ -0,0 +1,219 @@
+"""Bulk load .srt files into the Sub index
+
+Every subtitle line becomes a Sub with the id <srt_file>_<index>, so loading
+the same file twice overwrites instead of duplicating. Documents are sent
+through the bulk API in chunks bounded by count and size, by several
+workers in parallel. Files fully acknowledged are appended to a checkpoint
+file, and skipped when the job is started again after a crash. With
+--term-index, the saved subtitles are also added to the term index of
+term_index.py.
+
+Usage:
+    python ingest.py season2/*.srt --workers 4 --checkpoint ingest.done
+    python ingest.py season2/*.srt --dry-run
+    python ingest.py season2/*.srt --term-index snapshot/terms.sqlite3
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import srt
+from srtseg import SRTSeg
+
+from esdata import Sub
+from term_index import TermIndex
+
+CHUNK_DOCS = 500
+CHUNK_BYTES = 5 * 1024 * 1024
+MAX_RETRIES = 8
+
+
+def subs_from_srt(path):
+    """Parse an .srt file into Sub documents.
+    start/end are the boundaries of the video segment of each line, cut
+    the same way SRTSeg does; sub_start/sub_end are the subtitle times."""
+    srt_file = os.path.basename(path)
+    with open(path, encoding="utf-8-sig") as f:
+        subtitles = list(srt.parse(f.read()))
+    sseg = SRTSeg().from_subtitles(subtitles, srt_file)
+    for seg in sseg.segments:
+        sub = Sub()
+        sub.srt_file = srt_file
+        sub.index = seg.subtitle.index
+        sub.start = seg.start.total_seconds()
+        sub.end = seg.end.total_seconds()
+        sub.sub_start = seg.subtitle.start.total_seconds()
+        sub.sub_end = seg.subtitle.end.total_seconds()
+        sub.content = seg.subtitle.content
+        sub.ts_ready = False
+        sub.id = f"{srt_file}_{sub.index}"
+        yield sub
+
+
+def chunks(subs, max_docs=CHUNK_DOCS, max_bytes=CHUNK_BYTES):
+    """Group subs in lists bounded by count and serialized size"""
+    chunk, size = [], 0
+    for sub in subs:
+        doc_size = len(json.dumps(sub.field_dict(), ensure_ascii=False)) + 64
+        if chunk and (len(chunk) >= max_docs or size + doc_size > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(sub)
+        size += doc_size
+    if chunk:
+        yield chunk
+
+
+def _status(error):
+    return getattr(error, "status_code", None) or getattr(error, "status", None)
+
+
+def send(chunk, max_retries=MAX_RETRIES):
+    """Bulk save a chunk, backing off while the cluster answers 429.
+    Return the items that failed"""
+    pending, errors = chunk, []
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(60, 2**attempt) * (0.5 + random.random() / 2))
+        try:
+            failed = Sub().save_many(pending)
+        except Exception as error:
+            if _status(error) != 429:
+                raise
+            failed = [(item, {"status": 429}) for item in pending]
+
+        errors += [item for item, result in failed if result.get("status") != 429]
+        pending = [item for item, result in failed if result.get("status") == 429]
+        if not pending:
+            break
+    return errors + pending
+
+
+class Progress:
+    """Thread safe counters printed while the job runs"""
+
+    def __init__(self, every=5):
+        self.started = time.time()
+        self.docs = 0
+        self.failed = 0
+        self.files = 0
+        self.every = every
+        self.printed = 0
+        self.lock = threading.Lock()
+
+    def add(self, docs=0, failed=0, files=0):
+        with self.lock:
+            self.docs += docs
+            self.failed += failed
+            self.files += files
+            if time.time() - self.printed >= self.every:
+                self.printed = time.time()
+                print(self)
+
+    def __str__(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return (
+            f"{self.files} files, {self.docs} docs, {self.failed} failed"
+            f" in {elapsed:.1f}s ({self.docs / elapsed:.0f} docs/s)"
+        )
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def ingest(
+    paths,
+    workers=4,
+    max_docs=CHUNK_DOCS,
+    max_bytes=CHUNK_BYTES,
+    checkpoint=None,
+    dry_run=False,
+    term_index=None,
+):
+    """Load the srt files and return the Progress of the job.
+    term_index, a term_index.TermIndex, is updated with the saved Subs"""
+    done = load_checkpoint(checkpoint)
+    if not dry_run:
+        Sub().put_mapping()
+    progress = Progress()
+    pending = {}  # srt path -> chunks not acknowledged yet
+    failures = {}  # srt path -> docs that could not be saved
+    lock = threading.Lock()
+
+    def release(path, failed=0):
+        with lock:
+            pending[path] -= 1
+            failures[path] += failed
+            if pending[path] or failures[path]:
+                return
+        progress.add(files=1)
+        if checkpoint and not dry_run:
+            with open(checkpoint, "a", encoding="utf-8") as f:
+                f.write(path + "\n")
+
+    def load(path, chunk):
+        failed = [] if dry_run else send(chunk)
+        if term_index is not None and not dry_run:
+            failed_ids = {item.id for item in failed}
+            term_index.apply([sub for sub in chunk if sub.id not in failed_ids])
+        progress.add(docs=len(chunk) - len(failed), failed=len(failed))
+        release(path, len(failed))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = set()
+        for path in paths:
+            if path in done:
+                print(f"Skipping {path}, already loaded")
+                continue
+            with lock:
+                pending[path] = 1  # held until the file is fully read
+                failures[path] = 0
+            for chunk in chunks(subs_from_srt(path), max_docs, max_bytes):
+                with lock:
+                    pending[path] += 1
+                futures.add(pool.submit(load, path, chunk))
+                # Keep memory bounded: never read far ahead of the workers
+                if len(futures) >= workers * 2:
+                    finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+            release(path)
+        for future in futures:
+            future.result()
+
+    print(progress)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help=".srt files to load")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-docs", type=int, default=CHUNK_DOCS)
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES)
+    parser.add_argument("--checkpoint", help="File listing the loaded srt files")
+    parser.add_argument("--dry-run", action="store_true", help="Parse only")
+    parser.add_argument("--term-index", help="Term index to update")
+    args = parser.parse_args()
+    ingest(
+        args.paths,
+        workers=args.workers,
+        max_docs=args.chunk_docs,
+        max_bytes=args.chunk_bytes,
+        checkpoint=args.checkpoint,
+        dry_run=args.dry_run,
+        term_index=TermIndex(args.term_index) if args.term_index else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,12 @@
 import streamlit as st
-import os
-import urllib
-import requests
 
-files = [file for file in os.listdir("dicts") if file.endswith(".txt")]
-files = sorted(files)
+import assets
+import catalog
+import settings
+import wordlists
 
-data = {}
-
-
-def get_terms(raw):
-    results = {}
-    for line in raw.splitlines():
-        if len(line) < 5:
-            continue
-        term, *meaning = line.split("	")
-        results[term] = " ".join(meaning)
-    return results
+files = wordlists.names()
+PAGE_SIZES = (20, 50, 100)
 
 
 st.set_page_config(layout="wide", initial_sidebar_state="expanded")
@@ -27,136 +17,105 @@ st.write("The image illustrates the meaning of the word")
 repeat = 1
 padding = 0
 
+if "prefetcher" not in st.session_state:
+    st.session_state.prefetcher = assets.Prefetcher()
+prefetcher = st.session_state.prefetcher
+
 
-def show_video(term):
-    url = f"https://video.chato.cn/m3u8/{urllib.parse.quote(term)}.m3u8?repeat={repeat}&padding={padding}"
+def show_thumbnails(urls):
+    cols = st.columns(3)
+    for index, img in enumerate(urls[:8]):
+        cols[index % 3].image(img)
+
+
+def show_video(term, following=(), known=None):
+    if known is not None and not known.has_clips(term):
+        st.warning(f"{term}: 没有视频")
+        return
+    if known is not None and known.clips(term):
+        # Catalogued: the playlist is built from the clip ids, no search
+        playlist = known.playlist(term, repeat, padding)
+        if playlist is None:
+            st.warning(f"{term}: 没有视频")
+            return
+        st.video(
+            playlist.m3u8.encode("utf-8"),
+            format="application/vnd.apple.mpegurl",
+            autoplay=True,
+            loop=True,
+            subtitles=playlist.subtitles,
+        )
+        show_thumbnails(playlist.thumbnails)
+        return
+    clip = assets.fetch_clip_assets(term, repeat, padding)
+    if clip is None:
+        return
+    # Warm the next words while this one plays
+    prefetcher.prefetch(following, repeat, padding, target=(level, letter, prefix))
     st.video(
-        url,
+        clip.url,
         autoplay=True,
         loop=True,
-        subtitles=requests.get(url.replace(".m3u8", ".srt")).content,
+        subtitles=clip.subtitles,
     )
-    urls = requests.get(url.replace(".m3u8", ".jpgs"))
-    cols = st.columns(3)
-    index = 0
-    for img in urls.text.splitlines():
-        if img.startswith("http") and index < 8:
-            cols[index % 3].image(img)
-            index += 1
+    show_thumbnails(clip.thumbnails)
 
 
 with st.sidebar:
     vocab_tab, search_tab, setting_tab = st.tabs(["词汇", "搜索", "设置"])
     with vocab_tab:
         level = st.selectbox("单词表", files)
-        letter = st.selectbox(
-            "单词开头",
-            (
-                "A",
-                "B",
-                "C",
-                "D",
-                "E",
-                "F",
-                "G",
-                "H",
-                "I",
-                "J",
-                "K",
-                "L",
-                "M",
-                "N",
-                "O",
-                "P",
-                "Q",
-                "R",
-                "S",
-                "T",
-                "U",
-                "V",
-                "W",
-                "X",
-                "Y",
-                "Z",
-            ),
+        letter = st.selectbox("单词开头", wordlists.LETTERS)
+
+        prefix = st.text_input("查找", placeholder="输入单词开头，忽略上面的字母")
+        page_size = st.selectbox("每页", PAGE_SIZES)
+
+        wordlist = wordlists.load(level)
+        # Built offline by catalog.py, tells which terms have no clip
+        clips = catalog.load(level)
+        hide_missing = clips is not None and st.checkbox("隐藏没有视频的单词")
+        positions = wordlists.select(
+            wordlist, letter, prefix, clips.has_clips if hide_missing else None
+        )
+        prefetcher.retarget((level, letter, prefix))
+        pages = wordlists.page_count(len(positions), page_size)
+        # The key resets the page whenever the filter changes
+        page = st.number_input(
+            f"页 (共 {pages} 页, {len(positions)} 个)",
+            min_value=1,
+            max_value=pages,
+            key=f"page:{level}:{letter}:{prefix}:{page_size}",
         )
 
-        index = 0
-        for term, meaning in get_terms(open("dicts/" + level).read()).items():
-            if term.upper().startswith(letter):
-                col1, col2 = st.columns([1, 3])
-                with col1:
-                    st.button(
-                        f"{term}",
-                        key=term + str(index),
-                        on_click=show_video,
-                        args=[term],
-                    )
-                with col2:
-                    st.write(f"{meaning[0:30]}")
-                index += 1
+        # Only the visible window gets widgets
+        start, window = wordlists.page_slice(positions, page, page_size)
+        for i, n in enumerate(window, start):
+            term, meaning = wordlist[n]
+            # The next terms, warmed on the clip server when this one is
+            # clicked. Catalogued terms are not searched, so not warmed
+            following = wordlists.following(
+                wordlist,
+                positions,
+                i,
+                settings.PREFETCH_AHEAD,
+                skip=clips.terms if clips is not None else (),
+            )
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.button(
+                    f"{term}",
+                    key=f"term:{level}:{n}",
+                    on_click=show_video,
+                    args=[term, following, clips],
+                    disabled=clips is not None and not clips.has_clips(term),
+                )
+            with col2:
+                st.write(f"{meaning[0:30]}")
     with search_tab:
         search_term = st.text_input("Search")
-        show_video(search_term)
+        if search_term.strip():
+            show_video(search_term)
     with setting_tab:
         repeat = st.slider("How many times you want the video to repeat?", 1, 10)
         padding = st.slider("Context", 0, 3)
 
-
-# import json
-# import random
-
-# cards = []
-# for file in files:
-
-#     title = file.replace(".txt", "")
-#     terms = [
-#         "worthless",
-#         "worthwhile",
-#         "worthy",
-#         "would",
-#         "wound",
-#         "wrap",
-#         "wreath",
-#         "wreck",
-#         "wrist",
-#         "write",
-#         "writer",
-#         "writing",
-#         "winner",
-#         "winter",
-#         "wipe",
-#         "wire",
-#         "wireless",
-#         "wisdom",
-#         "wise",
-#         "wish",
-#         "wit",
-#         "with",
-#         "withdraw",
-#         "within"
-#     ]
-
-#     cards.append({
-#         "url": f'https://mira-1255830993.cos.ap-shanghai.myqcloud.com/m3u8s/{title}.json',
-#         "name": title,
-#         "image": f"https://video.chato.cn/m3u8/{random.choice(terms)}.jpg"
-#         })
-
-# st.code(json.dumps(cards, indent=4))
-
-# cards = []
-# terms = list(get_terms(open("dicts/" + file).read()).keys())
-# size = 12
-# chunks = [terms[i:i+size] for i in range(0, len(terms), size)]
-# for chunk in chunks:
-#     cards.append(
-#         {
-#         "url": f"https://video.chato.cn/m3u8/{chunk[0]}.m3u8",
-#         "terms": chunk
-#     })
-# result = {
-#     "cards": cards
-# }
-
-# json.dump(result, open(file.replace(".txt", ".json"), "w"), indent=4)
@@ -0,0 +1,86 @@
+# Settings of the project, read from the environment (or a .env file)
+# so that deployments can tune them without code changes.
+
+import os
+
+import dotenv
+
+dotenv.load_dotenv()
+
+
+def _bool(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+# This is the test ES Server managed by 纳什
+# jianshuo@100031339132
+# 子账号 ID: 100037619115
+# 主账号 ID: 100031339132
+ES_SERVER = os.getenv("ES_SERVER", "es-nluebvi0.public.tencentelasticsearch.com:9200")
+ES_AUTH_USER = os.getenv("ES_AUTH_USER", "elastic")
+ES_AUTH_PASSWORD = os.getenv("ES_AUTH_PASSWORD", "Baixing2023*")
+
+# Seconds to wait for one request before giving up on it
+ES_TIMEOUT = float(os.getenv("ES_TIMEOUT", "10"))
+# Retry budget per request. The worst case a caller waits is about
+# ES_TIMEOUT * (ES_MAX_RETRIES + 1)
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "2"))
+ES_RETRY_ON_TIMEOUT = _bool(os.getenv("ES_RETRY_ON_TIMEOUT", "true"))
+# Number of pooled HTTP connections kept per cluster node
+ES_POOL_SIZE = int(os.getenv("ES_POOL_SIZE", "10"))
+# Seconds to wait for an update_by_query task, e.g. of backfill.py
+ES_TASK_TIMEOUT = float(os.getenv("ES_TASK_TIMEOUT", "3600"))
+
+# Cache of Data.find results, keyed on the search body. Off by default.
+# It lives in each process: writes from this process invalidate it, but
+# nothing tells it about writes from other processes (ingest, backfill, the
+# other app workers), so their results can be stale for up to
+# QUERY_CACHE_TTL seconds. Set QUERY_CACHE_ENTRIES, e.g. to 1024, to enable
+# it where that staleness is acceptable.
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "0"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+QUERY_CACHE_BYTES = int(os.getenv("QUERY_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Rendered m3u8 entries per (term, repeat, padding)
+PLAYLIST_CACHE_ENTRIES = int(os.getenv("PLAYLIST_CACHE_ENTRIES", "1024"))
+PLAYLIST_CACHE_TTL = float(os.getenv("PLAYLIST_CACHE_TTL", "300"))
+
+# Clip server behind the /m3u8/<term>.m3u8|.srt|.jpgs URLs
+CLIP_SERVER = os.getenv("CLIP_SERVER", "https://video.chato.cn/m3u8")
+ASSET_CONNECT_TIMEOUT = float(os.getenv("ASSET_CONNECT_TIMEOUT", "3.05"))
+ASSET_TIMEOUT = float(os.getenv("ASSET_TIMEOUT", "10"))
+ASSET_POOL_SIZE = int(os.getenv("ASSET_POOL_SIZE", "8"))
+ASSET_CACHE_TTL = float(os.getenv("ASSET_CACHE_TTL", "3600"))
+# How many of the next words of a list are warmed, on how many threads
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "3"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
+# Chat of app.py: model, and tokens of history sent with each message
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))
+# Threads looking up the clips of the SHOW_VIDEO terms of replies
+RESOLVE_WORKERS = int(os.getenv("RESOLVE_WORKERS", "6"))
+
+# Speech to text of the voice input: "azure" Whisper deployment or "local"
+TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "azure")
+AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+WHISPER_DEPLOYMENT = os.getenv("WHISPER_DEPLOYMENT", "wisper")
+WHISPER_API_VERSION = os.getenv("WHISPER_API_VERSION", "2024-02-01")
+WHISPER_TIMEOUT = float(os.getenv("WHISPER_TIMEOUT", "30"))
+WHISPER_MAX_RETRIES = int(os.getenv("WHISPER_MAX_RETRIES", "2"))
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "base.en")
+TRANSCRIPT_CACHE_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_ENTRIES", "256"))
+
+# Logging and tracing: spans slower than SLOW_QUERY_MS are logged as
+# warnings, TRACE_BYTES also counts the bytes returned by the store
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+TRACE_BYTES = _bool(os.getenv("TRACE_BYTES", "false"))
+
+# How long a point in time of Data.iter_all is kept between two batches
+PIT_KEEP_ALIVE = os.getenv("PIT_KEEP_ALIVE", "1m")
+
+# Term index of term_index.py. When set, the clips of the words it knows
+# are read from it instead of searched; empty to always search
+TERM_INDEX = os.getenv("TERM_INDEX", "")
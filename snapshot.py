@@ -0,0 +1,356 @@
+"""Replicate the Sub index into local stores
+
+The subtitles of learn_english_with_movies_index are exported to a SQLite
+database with an FTS5 index of their content, and/or to a Chroma
+collection of their embeddings. Clips are then searched on the machine,
+without the round-trip to the cluster:
+
+    store = snapshot.open_store("sqlite")
+    sseg = video_lib.srtseg_from_snapshot(store, "abandon", padding=1)
+
+Each sync only reads the Subs modified since the previous one (again the
+last OVERLAP seconds, for the writes not yet searchable and the clocks of
+the writers), through a point in time, and replicates the deletions. The
+high-water mark is saved with the store once every change is applied, so
+an interrupted sync starts again from the previous one.
+
+Usage:
+    python snapshot.py                   # sync the SQLite store
+    python snapshot.py --chroma --full   # export everything to Chroma
+    python snapshot.py --search abandon
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from elasticsearch_dsl import Q
+
+import tracing
+from esdata import Sub
+
+SNAPSHOT_DIR = "snapshot"
+SQLITE_PATH = os.path.join(SNAPSHOT_DIR, "subs.sqlite3")
+CHROMA_PATH = os.path.join(SNAPSHOT_DIR, "chroma")
+OVERLAP = 300
+BATCH_DOCS = 500
+
+# Fields of the Sub kept in the stores, besides the id and the content
+COLUMNS = [
+    "srt_file",
+    "index",
+    "start",
+    "end",
+    "sub_start",
+    "sub_end",
+    "duration",
+    "ts_ready",
+    "modified",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subs (
+    id TEXT PRIMARY KEY,
+    srt_file TEXT,
+    "index" INTEGER,
+    start REAL,
+    "end" REAL,
+    sub_start REAL,
+    sub_end REAL,
+    duration REAL,
+    ts_ready INTEGER,
+    modified REAL,
+    content TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS subs_fts USING fts5(
+    content, content='subs', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS subs_ai AFTER INSERT ON subs BEGIN
+    INSERT INTO subs_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS subs_ad AFTER DELETE ON subs BEGIN
+    INSERT INTO subs_fts(subs_fts, rowid, content)
+    VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS subs_au AFTER UPDATE ON subs BEGIN
+    INSERT INTO subs_fts(subs_fts, rowid, content)
+    VALUES ('delete', old.rowid, old.content);
+    INSERT INTO subs_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _sub(fields):
+    """A Sub built from the fields of a store, like Data._from_hit"""
+    sub = Sub.__new__(Sub)
+    sub.__dict__ = {name: fields.get(name) for name in Sub._field_names()}
+    sub.id = fields["id"]
+    return sub
+
+
+def match_query(term):
+    """The FTS5 query of a term: any of its words, like query_string"""
+    words = re.findall(r"\w+", term)
+    return " OR ".join('"' + word + '"' for word in words)
+
+
+class SqliteStore:
+    """Subs in SQLite, their content searched with FTS5 and ranked by bm25.
+    Each thread has its own connection"""
+
+    kind = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    def watermark(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'modified'").fetchone()
+        return float(row["value"]) if row else None
+
+    def set_watermark(self, modified):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('modified', ?)", (str(modified),)
+            )
+
+    def apply(self, subs):
+        """Save the subs, and remove the deleted ones"""
+        rows = [sub for sub in subs if not getattr(sub, "deleted", False)]
+        names = ["id"] + COLUMNS + ["content"]
+        columns = ", ".join(f'"{name}"' for name in names)
+        updates = ", ".join(f'"{name}" = excluded."{name}"' for name in names[1:])
+        with self.db:
+            self.db.executemany(
+                f"INSERT INTO subs ({columns}) VALUES ({', '.join('?' * len(names))})"
+                f" ON CONFLICT(id) DO UPDATE SET {updates}",
+                [[getattr(sub, name, None) for name in names] for sub in rows],
+            )
+            self.db.executemany(
+                "DELETE FROM subs WHERE id = ?",
+                [(sub.id,) for sub in subs if getattr(sub, "deleted", False)],
+            )
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM subs")
+            self.db.execute("DELETE FROM meta")
+
+    @tracing.traced("snapshot.sqlite.term_clips")
+    def term_clips(self, query, max_duration=5, size=10):
+        """The Subs of up to size clips shorter than max_duration seconds"""
+        match = match_query(query)
+        if not match:
+            return []
+        rows = self.db.execute(
+            "SELECT subs.* FROM subs_fts JOIN subs ON subs.rowid = subs_fts.rowid"
+            " WHERE subs_fts MATCH ? AND subs.duration < ?"
+            " ORDER BY subs_fts.rank LIMIT ?",
+            (match, max_duration, size),
+        ).fetchall()
+        return [_sub(dict(row)) for row in rows]
+
+    def load_many(self, ids):
+        """The Subs of the ids, None for the missing ones"""
+        ids = list(ids)
+        if not ids:
+            return []
+        rows = self.db.execute(
+            f"SELECT * FROM subs WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ).fetchall()
+        found = {row["id"]: _sub(dict(row)) for row in rows}
+        return [found.get(id) for id in ids]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM subs").fetchone()[0]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class ChromaStore:
+    """Subs in a persistent Chroma collection, searched by the similarity
+    of their content to the term. The high-water mark is kept next to it"""
+
+    kind = "chroma"
+
+    def __init__(self, path=CHROMA_PATH, collection="subs"):
+        self.path = path
+        self.collection_name = collection
+        self._collection = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    try:
+                        import chromadb
+                    except ImportError as e:
+                        raise RuntimeError(
+                            "pip install chromadb to use the Chroma snapshot"
+                        ) from e
+                    client = chromadb.PersistentClient(path=self.path)
+                    self._collection = client.get_or_create_collection(
+                        self.collection_name
+                    )
+        return self._collection
+
+    def _state_path(self):
+        return os.path.join(self.path, "sync.json")
+
+    def watermark(self):
+        if not os.path.exists(self._state_path()):
+            return None
+        with open(self._state_path(), encoding="utf-8") as f:
+            return json.load(f).get("modified")
+
+    def set_watermark(self, modified):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{self._state_path()}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"modified": modified}, f)
+        os.replace(tmp, self._state_path())
+
+    def apply(self, subs):
+        """Save the subs, and remove the deleted ones"""
+        rows = [sub for sub in subs if not getattr(sub, "deleted", False)]
+        deleted = [sub.id for sub in subs if getattr(sub, "deleted", False)]
+        if rows:
+            self.collection.upsert(
+                ids=[sub.id for sub in rows],
+                documents=[sub.content or "" for sub in rows],
+                # Chroma refuses None in metadata
+                metadatas=[
+                    {
+                        name: getattr(sub, name)
+                        for name in COLUMNS
+                        if getattr(sub, name, None) is not None
+                    }
+                    for sub in rows
+                ],
+            )
+        if deleted:
+            self.collection.delete(ids=deleted)
+
+    def clear(self):
+        ids = self.collection.get(include=[])["ids"]
+        if ids:
+            self.collection.delete(ids=ids)
+        if os.path.exists(self._state_path()):
+            os.remove(self._state_path())
+
+    @tracing.traced("snapshot.chroma.term_clips")
+    def term_clips(self, query, max_duration=5, size=10):
+        """The Subs of up to size clips shorter than max_duration seconds"""
+        result = self.collection.query(
+            query_texts=[query],
+            n_results=size,
+            where={"duration": {"$lt": max_duration}},
+        )
+        return [
+            _sub({**metadata, "id": id, "content": document})
+            for id, metadata, document in zip(
+                result["ids"][0], result["metadatas"][0], result["documents"][0]
+            )
+        ]
+
+    def load_many(self, ids):
+        """The Subs of the ids, None for the missing ones"""
+        ids = list(ids)
+        if not ids:
+            return []
+        result = self.collection.get(ids=ids)
+        found = {
+            id: _sub({**metadata, "id": id, "content": document})
+            for id, metadata, document in zip(
+                result["ids"], result["metadatas"], result["documents"]
+            )
+        }
+        return [found.get(id) for id in ids]
+
+    def count(self):
+        return self.collection.count()
+
+    def close(self):
+        self._collection = None
+
+
+STORES = {"sqlite": SqliteStore, "chroma": ChromaStore}
+
+
+def open_store(kind="sqlite", path=None):
+    """The SqliteStore or ChromaStore at path, or at its default path"""
+    return STORES[kind](path) if path else STORES[kind]()
+
+
+@tracing.traced("snapshot.sync")
+def sync(store, full=False, batch_size=BATCH_DOCS, overlap=OVERLAP):
+    """Bring the store up to date with the Sub index.
+    Return the number of Subs saved or removed"""
+    since = None if full else store.watermark()
+    if full:
+        store.clear()
+    query = None
+    if since is not None:
+        query = Q("range", modified={"gte": since - overlap})
+    latest = since or 0
+    synced = 0
+    batch = []
+    for sub in Sub().iter_all(
+        query=query, batch_size=batch_size, include_deleted=True
+    ):
+        batch.append(sub)
+        latest = max(latest, sub.modified or 0)
+        if len(batch) >= batch_size:
+            store.apply(batch)
+            synced += len(batch)
+            batch = []
+    if batch:
+        store.apply(batch)
+        synced += len(batch)
+    store.set_watermark(latest)
+    return synced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chroma", action="store_true", help="Sync the Chroma store")
+    parser.add_argument("--path", help="Where the store is")
+    parser.add_argument("--full", action="store_true", help="Export everything")
+    parser.add_argument("--batch-size", type=int, default=BATCH_DOCS)
+    parser.add_argument("--search", help="Search a term in the store, no sync")
+    args = parser.parse_args()
+    tracing.configure_logging()
+
+    store = open_store("chroma" if args.chroma else "sqlite", args.path)
+    if args.search:
+        for sub in store.term_clips(args.search):
+            print(f"{sub.id:40} {sub.duration:5.2f}s  {sub.content}")
+        return
+    synced = sync(store, args.full, args.batch_size)
+    print(f"{synced} Subs synced, {store.count()} in the {store.kind} store")
+
+
+if __name__ == "__main__":
+    main()
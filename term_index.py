@@ -0,0 +1,405 @@
+"""Inverted index from the words of the lists to their clips
+
+Every subtitle is tokenized once, offline, and each token is reduced to
+the headwords of dicts/*.txt it can be an inflection of ("abandoned" ->
+abandon, "stopping" -> stop, "went" -> go). Phrases of the lists, up to
+MAX_PHRASE words, are found the same way. The ids of the Subs of each
+headword are kept in SQLite with a score, so the clips of a word are one
+indexed read instead of a full-text search:
+
+    index = term_index.TermIndex()
+    ids = index.lookup("abandon", max_duration=5, size=10)
+
+Clips are ranked on their duration and on the quality of their line as a
+context: a whole sentence of a few words, with the exact form of the word,
+beats a lone word or a song. Only the best MAX_CLIPS of a word are kept.
+
+The index follows the Sub index like snapshot.py does, on the modified
+field, and ingest.py updates it as the subtitles are loaded.
+
+Usage:
+    python term_index.py                 # index the Subs modified since last run
+    python term_index.py --full
+    python term_index.py --lookup abandon
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+
+import settings
+import snapshot
+import tracing
+import wordlists
+from backends import tokenize
+
+INDEX_PATH = os.path.join(snapshot.SNAPSHOT_DIR, "terms.sqlite3")
+MAX_PHRASE = 4
+MAX_CLIPS = 200
+IDEAL_DURATION = 2.5  # seconds, long enough to hear the word in context
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT,
+    sub_id TEXT,
+    score REAL,
+    duration REAL,
+    PRIMARY KEY (term, sub_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_sub ON postings(sub_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+IRREGULAR = {
+    "am": "be",
+    "is": "be",
+    "are": "be",
+    "was": "be",
+    "were": "be",
+    "been": "be",
+    "has": "have",
+    "had": "have",
+    "does": "do",
+    "did": "do",
+    "done": "do",
+    "goes": "go",
+    "went": "go",
+    "gone": "go",
+    "ate": "eat",
+    "eaten": "eat",
+    "began": "begin",
+    "begun": "begin",
+    "bought": "buy",
+    "brought": "bring",
+    "broke": "break",
+    "broken": "break",
+    "built": "build",
+    "came": "come",
+    "caught": "catch",
+    "chose": "choose",
+    "chosen": "choose",
+    "drew": "draw",
+    "drawn": "draw",
+    "drove": "drive",
+    "driven": "drive",
+    "fell": "fall",
+    "fallen": "fall",
+    "felt": "feel",
+    "found": "find",
+    "forgot": "forget",
+    "forgotten": "forget",
+    "gave": "give",
+    "given": "give",
+    "got": "get",
+    "gotten": "get",
+    "grew": "grow",
+    "grown": "grow",
+    "heard": "hear",
+    "held": "hold",
+    "kept": "keep",
+    "knew": "know",
+    "known": "know",
+    "led": "lead",
+    "left": "leave",
+    "lost": "lose",
+    "made": "make",
+    "meant": "mean",
+    "met": "meet",
+    "paid": "pay",
+    "ran": "run",
+    "said": "say",
+    "sat": "sit",
+    "saw": "see",
+    "seen": "see",
+    "sent": "send",
+    "sought": "seek",
+    "spent": "spend",
+    "spoke": "speak",
+    "spoken": "speak",
+    "stood": "stand",
+    "taught": "teach",
+    "thought": "think",
+    "threw": "throw",
+    "thrown": "throw",
+    "told": "tell",
+    "took": "take",
+    "taken": "take",
+    "understood": "understand",
+    "woke": "wake",
+    "won": "win",
+    "wore": "wear",
+    "worn": "wear",
+    "wrote": "write",
+    "written": "write",
+    "children": "child",
+    "feet": "foot",
+    "men": "man",
+    "mice": "mouse",
+    "people": "person",
+    "teeth": "tooth",
+    "women": "woman",
+    "better": "good",
+    "best": "good",
+    "worse": "bad",
+    "worst": "bad",
+}
+
+VOWELS = "aeiou"
+
+
+def _stem_bases(stem):
+    """Bases of the stem left by -ing, -ed, -er or -est, most likely first:
+    stopp -> stop, car -> care (caring), sing -> sing (singing)"""
+    bases = []
+    if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in VOWELS + "ls":
+        bases.append(stem[:-1])  # stopped, bigger
+    # A vowel and a consonant, or a c, g or v, usually lost a silent e:
+    # hoping, using, dancing, charging. Not sing + ing or feel + ing
+    silent_e = len(stem) >= 2 and (
+        (
+            stem[-1] not in VOWELS + "wxy"
+            and stem[-2] in VOWELS
+            and (len(stem) < 3 or stem[-3] not in VOWELS)
+        )
+        or stem[-1] in "cvuz"
+        or (stem[-1] in "gs" and stem[-2] not in "ngs")
+    )
+    forms = [stem + "e", stem] if silent_e else [stem, stem + "e"]
+    return bases + forms
+
+
+def _bases(token, own):
+    """Base forms of token by the suffix rules, most likely first. When the
+    token is a word itself (own), only verb inflections are tried: news is
+    not new + s, teacher not teach + er"""
+    bases = []
+    if token.endswith("'s"):
+        bases.append(token[:-2])
+    if token.endswith(("ies", "ied")):
+        bases.append(token[:-3] + "y")
+    for suffix in ("ing", "ed") if own else ("ing", "ed", "iest", "ier", "est", "er"):
+        if token.endswith(suffix):
+            if suffix in ("iest", "ier"):
+                bases.append(token[: -len(suffix)] + "y")
+            else:
+                bases += _stem_bases(token[: -len(suffix)])
+            break
+    if not own and token.endswith("s") and not token.endswith("ss"):
+        bases.append(token[:-1])  # cares, and boxes -> boxe, not a word
+        if token.endswith("es"):
+            bases.append(token[:-2])  # boxes -> box
+    return bases
+
+
+def lemmas(token, words):
+    """The words of the lists a token is a form of: itself, its irregular
+    base, and the first base of the suffix rules that is a word. A rule
+    gives one base at most, so an inflection is not filed under the
+    accidents of the other rules (caring is care, not car)"""
+    own = token in words
+    found = [token] if own else []
+    if IRREGULAR.get(token) in words:
+        found.append(IRREGULAR[token])
+    for base in _bases(token, own):
+        if len(base) >= 3 and base != token and base in words:
+            found.append(base)
+            break
+    return list(dict.fromkeys(found))
+
+
+def term_key(term):
+    """The key of a headword or phrase in the index"""
+    return " ".join(tokenize(term.replace("’", "'")))
+
+
+_vocabulary = {}
+_vocabulary_lock = threading.Lock()
+
+
+def vocabulary(dirname=wordlists.DICTS_DIR):
+    """The keys of the terms of every list of dirname, up to MAX_PHRASE words"""
+    with _vocabulary_lock:
+        if dirname not in _vocabulary:
+            keys = set()
+            for name in wordlists.names(dirname):
+                for term in wordlists.load(name, dirname).terms:
+                    key = term_key(term)
+                    if key and len(key.split()) <= MAX_PHRASE:
+                        keys.add(key)
+            _vocabulary[dirname] = keys
+        return _vocabulary[dirname]
+
+
+def _clean(content):
+    return re.sub(r"<[^>]+>", " ", content or "").replace("’", "'")
+
+
+def terms_of(content, words):
+    """{key: exact} of the terms of words found in a subtitle, exact when
+    the subtitle has the form of the list rather than an inflection"""
+    tokens = tokenize(_clean(content))
+    found = {}
+    for n, token in enumerate(tokens):
+        for size in range(1, MAX_PHRASE + 1):
+            if n + size > len(tokens):
+                break
+            rest = tokens[n + 1 : n + size]
+            # Inflections of the first word only: "gave up" -> give up
+            for lemma in dict.fromkeys([token] + lemmas(token, words)):
+                key = " ".join([lemma] + rest)
+                if key in words:
+                    found[key] = found.get(key, False) or lemma == token
+    return found
+
+
+def score(sub, exact):
+    """How good a clip the sub is to show one of its words"""
+    content = _clean(sub.content).strip()
+    duration = getattr(sub, "duration", None) or 0
+    words = len(tokenize(content))
+    result = -abs(duration - IDEAL_DURATION)
+    if words < 3:
+        result -= 1  # a lone word says little of how it is used
+    elif words <= 12:
+        result += 1
+    if exact:
+        result += 0.5
+    if content[-1:] in (".", "?", "!"):
+        result += 0.5  # a whole sentence
+    if "♪" in content or "[" in content:
+        result -= 2  # songs and sound cues
+    return round(result, 3)
+
+
+class TermIndex:
+    """Ranked Sub ids per term, in SQLite. It has the interface of the
+    snapshot stores, so snapshot.sync keeps it up to date"""
+
+    kind = "term_index"
+
+    def __init__(self, path=INDEX_PATH, dirname=wordlists.DICTS_DIR):
+        self.path = path
+        self.dirname = dirname
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    def watermark(self):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'modified'"
+        ).fetchone()
+        return float(row[0]) if row else None
+
+    def set_watermark(self, modified):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('modified', ?)", (str(modified),)
+            )
+
+    @tracing.traced("term_index.apply")
+    def apply(self, subs):
+        """Index the subs, replacing what they had, and drop the deleted ones"""
+        words = vocabulary(self.dirname)
+        subs = list(subs)
+        rows = []
+        for sub in subs:
+            if getattr(sub, "deleted", False):
+                continue
+            for key, exact in terms_of(sub.content, words).items():
+                duration = getattr(sub, "duration", None) or 0
+                rows.append((key, sub.id, score(sub, exact), duration))
+        touched = {row[0] for row in rows}
+        with self._lock, self.db:
+            self.db.executemany(
+                "DELETE FROM postings WHERE sub_id = ?", [(sub.id,) for sub in subs]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO postings VALUES (?, ?, ?, ?)", rows
+            )
+            self.db.executemany(
+                "DELETE FROM postings WHERE term = ?1 AND sub_id NOT IN ("
+                " SELECT sub_id FROM postings WHERE term = ?1"
+                " ORDER BY score DESC LIMIT ?2)",
+                [(key, MAX_CLIPS) for key in touched],
+            )
+
+    def clear(self):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM postings")
+            self.db.execute("DELETE FROM meta")
+
+    @tracing.traced("term_index.lookup")
+    def lookup(self, term, max_duration=5, size=10):
+        """The ids of the best clips of a term shorter than max_duration
+        seconds, trying its base forms when the term itself is not a key"""
+        key = term_key(term)
+        if not key:
+            return []
+        words = key.split()
+        forms = [words[0]] + lemmas(words[0], vocabulary(self.dirname))
+        for lemma in dict.fromkeys(forms):
+            rows = self.db.execute(
+                "SELECT sub_id FROM postings WHERE term = ? AND duration < ?"
+                " ORDER BY score DESC LIMIT ?",
+                (" ".join([lemma] + words[1:]), max_duration, size),
+            ).fetchall()
+            if rows:
+                return [row[0] for row in rows]
+        return []
+
+    def count(self):
+        query = "SELECT COUNT(DISTINCT term) FROM postings"
+        return self.db.execute(query).fetchone()[0]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The TermIndex at settings.TERM_INDEX, shared by the process"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TermIndex(settings.TERM_INDEX)
+        return _default
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default=settings.TERM_INDEX or INDEX_PATH)
+    parser.add_argument("--full", action="store_true", help="Index everything again")
+    parser.add_argument("--batch-size", type=int, default=snapshot.BATCH_DOCS)
+    parser.add_argument("--lookup", help="Print the clips of a term, no sync")
+    args = parser.parse_args()
+    tracing.configure_logging()
+
+    index = TermIndex(args.path)
+    if args.lookup:
+        for sub_id in index.lookup(args.lookup, size=20):
+            print(sub_id)
+        return
+    synced = snapshot.sync(index, args.full, args.batch_size)
+    print(f"{synced} Subs indexed, {index.count()} terms with clips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import AsyncBackendAdapter, MemoryBackend  # noqa: E402
+from esdata import AsyncData, Data  # noqa: E402
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """A MemoryBackend behind Data and AsyncData, without the query cache"""
+    backend = MemoryBackend()
+    monkeypatch.setattr(Data, "backend", backend)
+    monkeypatch.setattr(AsyncData, "backend", AsyncBackendAdapter(backend))
+    monkeypatch.setattr(Data, "cache", None)
+    return backend
+
+
+def make_sub(srt_file, index, content, start=None, duration=2.0):
+    """A Sub as ingest.py builds it, one line every 3 seconds by default"""
+    from esdata import Sub
+
+    start = 3.0 * index if start is None else start
+    sub = Sub()
+    sub.srt_file = srt_file
+    sub.index = index
+    sub.start = start
+    sub.end = start + duration
+    sub.duration = duration
+    sub.sub_start = start + 0.1
+    sub.sub_end = start + duration - 0.1
+    sub.content = content
+    sub.ts_ready = True
+    sub.id = f"{srt_file}_{index}"
+    return sub
@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import assets
+import settings
+from cache import TTLCache
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    """A clip server answering from a dict of URLs, with fresh caches"""
+    pages = {}
+    requested = []
+
+    def get(url):
+        requested.append(url)
+        if url not in pages:
+            raise requests.ConnectionError(url)
+        return SimpleNamespace(text=pages[url])
+
+    monkeypatch.setattr(assets, "get", get)
+    monkeypatch.setattr(assets, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "memory", TTLCache())
+    monkeypatch.setattr(settings, "CLIP_SERVER", "http://clips/m3u8")
+    return SimpleNamespace(pages=pages, requested=requested)
+
+
+def serve(server, term, jpgs="http://img/1.jpg\n"):
+    server.pages[assets.clip_url(term)] = "#EXTM3U"
+    server.pages[assets.clip_url(term, ext="srt")] = "1\n00:00:00,000 --> ..."
+    server.pages[assets.clip_url(term, ext="jpgs")] = jpgs
+
+
+def test_clip_url():
+    assert assets.clip_url("give up", 2, 1, "srt").endswith(
+        "/give%20up.srt?repeat=2&padding=1"
+    )
+
+
+def test_fetch_is_cached_in_memory_and_on_disk(server, monkeypatch):
+    serve(server, "give", jpgs="http://img/1.jpg\nnot a url\nhttp://img/2.jpg")
+    clip = assets.fetch_clip_assets(" give ")
+    assert clip.url == assets.clip_url("give")
+    assert clip.thumbnails == ["http://img/1.jpg", "http://img/2.jpg"]
+    assert assets.fetch_clip_assets("give") == clip
+    assert len(server.requested) == 2
+
+    monkeypatch.setattr(assets, "memory", TTLCache())
+    assert assets.cached_clip_assets("give") == clip
+    assert assets.fetch_clip_assets("") is None
+
+
+def test_failed_parts_are_not_cached(server):
+    serve(server, "give")
+    del server.pages[assets.clip_url("give", ext="jpgs")]
+    clip = assets.fetch_clip_assets("give")
+    assert clip.subtitles and clip.thumbnails == []
+    assert assets.cached_clip_assets("give") is None
+    serve(server, "give")
+    assert assets.fetch_clip_assets("give").thumbnails == ["http://img/1.jpg"]
+
+
+def test_warm(server):
+    serve(server, "give")
+    assert assets.warm("give")
+    assert assets.clip_url("give") in server.requested
+    assert not assets.warm("give")
+    # A failed playlist is logged, the assets are still cached
+    server.pages[assets.clip_url("hope", ext="srt")] = "srt"
+    server.pages[assets.clip_url("hope", ext="jpgs")] = ""
+    assert assets.warm("hope")
+    assert assets.cached_clip_assets("hope") is not None
+
+
+@pytest.fixture
+def blocked(monkeypatch):
+    """Warms that wait for the release event, recording their terms, on a
+    prefetch pool of two threads"""
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(assets, "prefetch_executor", pool)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    warmed = []
+
+    def warm(term, repeat, padding):
+        started.release()
+        release.wait(5)
+        warmed.append(term)
+        return True
+
+    monkeypatch.setattr(assets, "warm", warm)
+    yield SimpleNamespace(release=release, started=started, warmed=warmed)
+    release.set()
+    pool.shutdown()
+
+
+def test_prefetchers_share_one_pool(blocked):
+    first, second = assets.Prefetcher(), assets.Prefetcher()
+    first.prefetch(["a", "b", "c", "d"], target="list 1")
+    for _ in range(2):
+        assert blocked.started.acquire(timeout=5)  # the pool is busy
+    second.prefetch(["x", "y"], target="list 2")
+    assert first.pending() == 4 and second.pending() == 2
+
+    # Moving to another target cancels the warms not started yet
+    running = first.futures[:2]
+    first.retarget("list 3")
+    first.shutdown()
+    assert first.futures == [] and first.pending() == 0
+    blocked.release.set()
+    for future in running + second.futures:
+        assert future.result(5)
+    assert sorted(blocked.warmed) == ["a", "b", "x", "y"]
+    # The pool is shared: stopping a session leaves it running
+    assert assets.prefetch_executor.submit(lambda: True).result(5)
+
+
+def test_a_new_batch_replaces_the_queued_one(blocked):
+    prefetcher = assets.Prefetcher()
+    prefetcher.prefetch(["a", "b", "c", "d"], target="list")
+    for _ in range(2):
+        assert blocked.started.acquire(timeout=5)
+    queued = prefetcher.futures
+    prefetcher.prefetch(["e"], target="list")
+    assert [future.cancelled() for future in queued] == [False, False, True, True]
+    blocked.release.set()
+    for future in queued[:2] + prefetcher.futures:
+        assert future.result(5)
+    assert sorted(blocked.warmed) == ["a", "b", "e"]
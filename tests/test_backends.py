@@ -0,0 +1,277 @@
+from types import SimpleNamespace
+
+import pytest
+
+import backends
+from backends import AsyncBackendAdapter, MemoryBackend
+
+DOCS = {
+    "a": {"content": "I give up", "srt_file": "s1.srt", "start": 0.0, "end": 2.0},
+    "b": {"content": "Give it to me", "srt_file": "s1.srt", "start": 3.0, "end": 9.0},
+    "c": {"content": "never give up", "srt_file": "s2.srt", "start": 1.0, "end": 2.5},
+    "d": {"content": "up and away", "srt_file": "s2.srt", "start": 5.0, "end": None},
+}
+
+
+@pytest.fixture
+def backend():
+    backend = MemoryBackend()
+    for id, body in DOCS.items():
+        backend.index("subs", body, id=id)
+    return backend
+
+
+def ids(backend, body, index="subs"):
+    return [hit["_id"] for hit in backend.search(index, body)["hits"]["hits"]]
+
+
+def test_get_and_mget(backend):
+    assert backend.get("subs", "a")["_source"]["content"] == "I give up"
+    assert backend.get("subs", "missing") is None
+    docs = backend.mget("subs", ["c", "missing", "a"])
+    assert [doc and doc["_id"] for doc in docs] == ["c", None, "a"]
+
+
+def test_index_patterns(backend):
+    backend.index("other", {"content": "give"}, id="x")
+    assert "x" in ids(backend, {"query": {"match": {"content": "give"}}}, "*")
+    assert "x" not in ids(backend, {"query": {"match": {"content": "give"}}})
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ({"match": {"content": "give"}}, {"a", "b", "c"}),
+        ({"match": {"content": {"query": "away"}}}, {"d"}),
+        ({"term": {"srt_file.keyword": "s2.srt"}}, {"c", "d"}),
+        ({"terms": {"srt_file": ["s1.srt"]}}, {"a", "b"}),
+        ({"ids": {"values": ["a", "d", "zz"]}}, {"a", "d"}),
+        ({"range": {"start": {"gte": 1, "lt": 5}}}, {"b", "c"}),
+        ({"exists": {"field": "end"}}, {"a", "b", "c"}),
+        ({"query_string": {"query": "never OR away"}}, {"c", "d"}),
+        ({"query_string": {"query": '"give up"'}}, {"a", "c"}),
+        ({"query_string": {"query": "+give -never"}}, {"a", "b"}),
+        ({"query_string": {"query": "give NOT never"}}, {"a", "b"}),
+        ({"query_string": {"query": "aw*"}}, {"d"}),
+        ({"query_string": {"query": "content:never"}}, {"c"}),
+        (
+            {"query_string": {"query": "give up", "default_operator": "AND"}},
+            {"a", "c"},
+        ),
+    ],
+)
+def test_queries(backend, query, expected):
+    assert set(ids(backend, {"query": query})) == expected
+
+
+def test_bool(backend):
+    query = {
+        "bool": {
+            "must": [{"match": {"content": "give"}}],
+            "filter": [{"range": {"start": {"lt": 2}}}],
+            "must_not": [{"term": {"srt_file": "s2.srt"}}],
+        }
+    }
+    assert ids(backend, {"query": query}) == ["a"]
+
+
+def test_bool_should(backend):
+    should = [{"match": {"content": "never"}}, {"match": {"content": "away"}}]
+    assert set(ids(backend, {"query": {"bool": {"should": should}}})) == {"c", "d"}
+    query = {"bool": {"should": should + [{"match": {"content": "up"}}]}}
+    query["bool"]["minimum_should_match"] = 2
+    assert set(ids(backend, {"query": query})) == {"c", "d"}
+
+
+def test_match_scores_rank_hits(backend):
+    assert ids(backend, {"query": {"match": {"content": "never give up"}}})[0] == "c"
+
+
+def test_script_query(backend):
+    script = {
+        "source": "doc['end'].value - doc['start'].value < params.max && "
+        "!(doc['start'].value == 0)",
+        "params": {"max": 2},
+    }
+    # d has no end, so the script does not match it
+    assert ids(backend, {"query": {"script": {"script": script}}}) == ["c"]
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "doc['end'].value ** 2 < 1",
+        "Math.abs(doc['end'].value) < 1",
+        "doc['end'].value.length < 1",
+    ],
+)
+def test_script_rejects_anything_but_arithmetic(backend, source):
+    with pytest.raises(NotImplementedError):
+        backend.search("subs", {"query": {"script": {"script": {"source": source}}}})
+
+
+def test_unsupported_query(backend):
+    with pytest.raises(NotImplementedError):
+        backend.search("subs", {"query": {"fuzzy": {"content": "giv"}}})
+
+
+def test_sort_from_size_and_source(backend):
+    body = {
+        "query": {"match_all": {}},
+        "sort": [{"end": {"order": "desc"}}],
+        "from": 1,
+        "size": 2,
+        "_source": ["start"],
+    }
+    hits = backend.search("subs", body)["hits"]["hits"]
+    assert [hit["_id"] for hit in hits] == ["c", "a"]
+    assert hits[0]["_source"] == {"start": 1.0}
+    # Missing values sort last
+    assert ids(backend, {"sort": ["end"]})[-1] == "d"
+
+
+def test_collapse_and_aggregations(backend):
+    body = {
+        "sort": ["start"],
+        "collapse": {"field": "srt_file.keyword"},
+        "aggs": {
+            "files": {"cardinality": {"field": "srt_file.keyword"}},
+            "top": {"terms": {"field": "srt_file.keyword", "size": 1}},
+        },
+    }
+    resp = backend.search("subs", body)
+    assert [hit["_id"] for hit in resp["hits"]["hits"]] == ["a", "c"]
+    assert resp["hits"]["total"]["value"] == 4
+    assert resp["aggregations"]["files"] == {"value": 2}
+    assert len(resp["aggregations"]["top"]["buckets"]) == 1
+
+
+def test_writes_update_the_inverted_index(backend):
+    backend.index("subs", {"content": "something else"}, id="a")
+    assert "a" not in ids(backend, {"query": {"match": {"content": "give"}}})
+    assert ids(backend, {"query": {"match": {"content": "else"}}}) == ["a"]
+
+
+def test_bulk_and_msearch(backend):
+    results = backend.bulk("subs", [("e", {"content": "hello"}), ("f", {"x": 1})])
+    assert [result["_id"] for result in results] == ["e", "f"]
+    bodies = [
+        {"query": {"match": {"content": "hello"}}},
+        {"query": {"ids": {"values": ["f"]}}},
+    ]
+    responses = backend.msearch("subs", bodies)
+    assert [[hit["_id"] for hit in r["hits"]["hits"]] for r in responses] == [
+        ["e"],
+        ["f"],
+    ]
+
+
+def test_knn(backend):
+    mapping = {"properties": {"vector": {"similarity": "l2_norm"}}}
+    backend.put_mapping("vectors", mapping)
+    for id, vector in {"x": [0, 0], "y": [1, 1], "z": [5, 5]}.items():
+        backend.index("vectors", {"vector": vector, "tag": id}, id=id)
+    knn = {"field": "vector", "query_vector": [1, 1.2], "k": 2}
+    assert ids(backend, {"knn": knn}, "vectors") == ["y", "x"]
+    knn["filter"] = {"term": {"tag": "z"}}
+    assert ids(backend, {"knn": knn}, "vectors") == ["z"]
+
+
+def test_update_by_query(backend):
+    body = {
+        "query": {"bool": {"must_not": [{"exists": {"field": "duration"}}]}},
+        "script": {
+            "source": "ctx._source.duration = ctx._source.end - ctx._source.start;"
+            " ctx._source.scaled = ctx._source.start * params.factor",
+            "params": {"factor": 2},
+        },
+    }
+    backend.index("subs", {**DOCS["d"], "end": 6.0}, id="d")
+    backend.index("subs", {"start": 0, "end": 1, "duration": 7}, id="e")
+    assert backend.update_by_query("subs", body)["updated"] == 4
+    source = backend.get("subs", "b")["_source"]
+    assert source["duration"] == 6.0 and source["scaled"] == 6.0
+    assert source["content"] == "Give it to me"
+    assert backend.get("subs", "e")["_source"]["duration"] == 7
+
+
+def test_update_by_query_rejects_other_scripts(backend):
+    body = {"script": {"source": "ctx._source.tags.add('x')"}}
+    with pytest.raises(NotImplementedError):
+        backend.update_by_query("subs", body)
+
+
+def test_point_in_time_and_search_after(backend):
+    pit = backend.open_pit("subs")
+    backend.index("subs", {"content": "added later"}, id="e")
+    pages, after = [], None
+    while True:
+        body = {"pit": {"id": pit}, "sort": ["srt_file"], "size": 3}
+        if after is not None:
+            body["search_after"] = after
+        hits = backend.search("ignored", body)["hits"]["hits"]
+        if not hits:
+            break
+        pages.append([hit["_id"] for hit in hits])
+        after = hits[-1]["sort"]
+    backend.close_pit(pit)
+    # Ties on srt_file are broken by the order in the point in time
+    assert pages == [["a", "b", "c"], ["d"]]
+    with pytest.raises(ValueError):
+        backend.search("subs", {"pit": {"id": pit}})
+
+
+async def _async_get(adapter):
+    return await adapter.get("subs", "a")
+
+
+def test_async_adapter(backend):
+    import asyncio
+
+    adapter = AsyncBackendAdapter(backend)
+    assert asyncio.run(_async_get(adapter))["_id"] == "a"
+
+
+def test_elasticsearch_client_is_created_on_first_use(monkeypatch):
+    created = []
+
+    class Client:
+        def __init__(self, **options):
+            created.append(options)
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(backends, "Elasticsearch", Client)
+    backend = backends.ElasticsearchBackend(hosts=["http://es:9200"], max_retries=1)
+    assert created == []
+    client = backend.client
+    assert backend.client is client
+    assert created == [{"hosts": ["http://es:9200"], "max_retries": 1}]
+    backend.close()
+    assert client.closed
+    assert backend.client is not client and len(created) == 2
+
+
+@pytest.mark.parametrize(
+    "status, error",
+    [
+        ({"completed": True, "error": {"type": "boom"}}, RuntimeError),
+        ({"completed": True, "response": {"failures": [{"id": "a"}]}}, RuntimeError),
+        ({"completed": False}, TimeoutError),
+    ],
+)
+def test_elasticsearch_update_by_query_task(monkeypatch, status, error):
+    tasks = SimpleNamespace(get=lambda task_id: status)
+    client = SimpleNamespace(
+        update_by_query=lambda **kwargs: {"task": "t1"}, tasks=tasks
+    )
+    monkeypatch.setattr(backends.time, "sleep", lambda seconds: None)
+    backend = backends.ElasticsearchBackend(task_timeout=0)
+    backend._client = client
+    with pytest.raises(error, match="t1"):
+        backend.update_by_query("subs", {})
+
+    status.update(completed=True, error=None, response={"updated": 3})
+    assert backend.update_by_query("subs", {}) == {"updated": 3}
@@ -0,0 +1,22 @@
+import backfill
+from esdata import Sub
+
+
+def put(memory, id, **source):
+    memory.index(Sub.index, {"content": "hello", "modified": 1.0, **source}, id=id)
+
+
+def test_backfill_duration(memory):
+    put(memory, "old_1", start=1.0, end=3.5, extra="kept")
+    put(memory, "old_2", start=4.0)
+    put(memory, "new_1", start=0.0, end=1.0, duration=1.0)
+
+    assert backfill.backfill_duration(dry_run=True) == 0
+    assert "duration" not in memory.get(Sub.index, "old_1")["_source"]
+
+    assert backfill.backfill_duration() == 1
+    source = memory.get(Sub.index, "old_1")["_source"]
+    assert source["duration"] == 2.5
+    assert source["extra"] == "kept" and source["modified"] == 1.0
+    assert "duration" not in memory.get(Sub.index, "old_2")["_source"]
+    assert backfill.backfill_duration() == 0
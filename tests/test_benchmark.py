@@ -0,0 +1,43 @@
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def results(memory):
+    """A small run of every scenario"""
+    return benchmark.run(movies=2, lines=40, iterations=2, terms=3)
+
+
+def test_every_scenario_runs(results):
+    scenarios = results["scenarios"]
+    errors = {name: r["error"] for name, r in scenarios.items() if "error" in r}
+    assert errors == {}
+    assert "srtseg_padding_1" in scenarios
+    assert scenarios["find"]["round_trips"] == 1
+    # A lesson costs one _msearch and one mget, whatever its size
+    assert scenarios["lesson_msearch"]["round_trips"] <= 2
+    assert scenarios["playlist_padding_5"]["round_trips"] <= 2
+
+
+def test_compare_flags_regressions(capsys):
+    baseline = {"scenarios": {"a": {"p50_ms": 1.0, "round_trips": 1}}}
+    results = {
+        "scenarios": {
+            "a": {"p50_ms": 1.5, "round_trips": 1},
+            "b": {"p50_ms": 9.0, "round_trips": 1},
+        }
+    }
+    assert benchmark.compare(results, baseline) == ["a"]
+    assert benchmark.compare(results, baseline, threshold=0.6) == []
+    assert "REGRESSION" in capsys.readouterr().out
+
+
+def test_counting_backend(memory):
+    backend = benchmark.CountingBackend(memory)
+    backend.index("test", {"content": "hello"}, id="a")
+    backend.mget("test", ["a"])
+    pit = backend.open_pit("test")
+    backend.close_pit(pit)
+    assert backend.calls == {"index": 1, "mget": 1, "open_pit": 1, "close_pit": 1}
+    assert backend.round_trips() == 4
@@ -0,0 +1,79 @@
+import time
+
+from cache import TTLCache, size_of
+from conftest import make_sub
+from esdata import Data, Sub
+
+
+def test_lru_eviction_by_entries():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_bytes():
+    cache = TTLCache(max_bytes=10)
+    cache.set("a", "x", size=4)
+    cache.set("b", "y", size=4)
+    cache.set("c", "z", size=4)
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.bytes == 8
+    # Larger than the whole cache: not kept, nothing evicted
+    cache.set("d", "big", size=11)
+    assert cache.get("d") is None and len(cache) == 2
+
+
+def test_replacing_a_key_keeps_the_byte_count():
+    cache = TTLCache()
+    cache.set("a", "x", size=4)
+    cache.set("a", "y", size=6)
+    assert cache.bytes == 6 and cache.get("a") == "y"
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=60)
+    cache.set("a", 1)
+    now[0] += 59
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a", "gone") == "gone"
+    assert len(cache) == 0 and cache.bytes == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_invalidate_by_tag():
+    cache = TTLCache()
+    cache.set("a", 1, tag="subs")
+    cache.set("b", 2, tag="words")
+    cache.invalidate(lambda tag: tag == "subs")
+    assert cache.get("a") is None and cache.get("b") == 2
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_size_of():
+    assert size_of({"a": "é"}) == len('{"a": "é"}')
+    assert size_of(object()) > 0
+
+
+def test_data_find_is_cached_until_a_write(memory, monkeypatch):
+    monkeypatch.setattr(Data, "cache", TTLCache())
+    make_sub("s1.srt", 1, "give up").save()
+    calls = []
+    search = memory.search
+    monkeypatch.setattr(
+        memory, "search", lambda *args: calls.append(args) or search(*args)
+    )
+    assert len(Sub().find(query_string="give")) == 1
+    assert len(Sub().find(query_string="give")) == 1
+    assert len(calls) == 1
+    make_sub("s1.srt", 2, "give it").save()
+    assert len(Sub().find(query_string="give")) == 2
+    assert len(calls) == 2
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import catalog
+import wordlists
+from conftest import make_sub
+
+
+@pytest.fixture
+def words(memory, monkeypatch, tmp_path):
+    """A list of three terms, two of them with clips"""
+    for index, content in enumerate(["hello there", "I give up", "the end"]):
+        make_sub("s1.srt", index, content).save()
+    entries = [("give", ""), ("end", ""), ("zebra", "")]
+    monkeypatch.setattr(
+        wordlists, "load", lambda name: wordlists.WordList(name, entries)
+    )
+    monkeypatch.setattr(
+        catalog, "thumbnails", lambda term: [f"http://img/{term}.jpg"]
+    )
+    monkeypatch.setattr(catalog, "_loaded", {})
+    return str(tmp_path / "catalog")
+
+
+def test_resolve(words):
+    assert catalog.resolve(["give", "zebra"]) == [
+        ("give", [["s1.srt_1", 2.0, "http://img/give.jpg"]]),
+        ("zebra", []),
+    ]
+
+
+def test_resolve_reports_failures(words, monkeypatch):
+    def down(term):
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(catalog, "thumbnails", down)
+    assert catalog.resolve(["give", "zebra"]) == [("give", None), ("zebra", [])]
+
+
+def test_build_and_load(words):
+    catalog.build(["words.txt"], workers=1, catalog_dir=words)
+    assert os.listdir(words) == ["words.json"]
+    built = catalog.load("words.txt", words)
+    assert built.clips("end") == [["s1.srt_2", 2.0, "http://img/end.jpg"]]
+    assert built.missing() == ["zebra"]
+    assert built.has_clips("give") and built.has_clips("unknown")
+    assert not built.has_clips("zebra")
+    assert catalog.load("words.txt", words) is built
+    assert catalog.load("other.txt", words) is None
+    assert "1 without clips (66.7% covered)" in catalog.report("words.txt", words)
+
+
+def test_build_starts_again_from_the_partial_file(words, monkeypatch):
+    os.makedirs(words)
+    with open(catalog.partial_path("words.txt", words), "w") as f:
+        f.write('["give", []]\n["end", [')  # a crash in the middle of a line
+    searched = []
+    resolve = catalog.resolve
+
+    def recorded(terms, *args):
+        searched.extend(terms)
+        return resolve(terms, *args)
+
+    monkeypatch.setattr(catalog, "resolve", recorded)
+    catalog.build(["words.txt"], workers=1, catalog_dir=words)
+    assert searched == ["end", "zebra"]
+    assert catalog.load("words.txt", words).clips("give") == []
+
+
+def test_failed_terms_keep_the_partial_file(words, monkeypatch):
+    monkeypatch.setattr(
+        catalog, "resolve", lambda terms, *args: [(term, None) for term in terms]
+    )
+    catalog.build(["words.txt"], workers=1, catalog_dir=words)
+    assert os.listdir(words) == ["words.partial.jsonl"]
+
+
+def test_playlist_with_one_mget(words, memory, monkeypatch):
+    catalog.build(["words.txt"], workers=1, catalog_dir=words)
+    built = catalog.load("words.txt", words)
+    calls = []
+    monkeypatch.setattr(memory, "search", lambda *args: pytest.fail("searched"))
+    mget = memory.mget
+    monkeypatch.setattr(
+        memory, "mget", lambda index, ids: calls.append(ids) or mget(index, ids)
+    )
+    playlist = built.playlist("give", padding=1)
+    assert playlist.m3u8.count("#EXTINF") == 3
+    assert "I give up" in playlist.subtitles
+    assert playlist.thumbnails == ["http://img/give.jpg"]
+    assert len(calls) == 1
+    assert built.playlist("zebra") is None
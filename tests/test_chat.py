@@ -0,0 +1,147 @@
+from types import SimpleNamespace
+
+import pytest
+
+import chat
+
+
+def chunk(content):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeClient:
+    """An OpenAI client whose completions answer with the summary"""
+
+    def __init__(self, summary="they know give up"):
+        self.summary = summary
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        message = SimpleNamespace(content=self.summary)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def words(monkeypatch):
+    """Count one token per word, plus the 4 of each message"""
+    monkeypatch.setattr(chat, "count_tokens", lambda text: len(text.split()))
+
+
+def test_stream_lines():
+    pieces = ["Hello", " there\nSHOW_", "VIDEO: give", " up\n\nBye"]
+    assert list(chat.stream_lines(pieces)) == [
+        ("Hello", False),
+        ("Hello there", True),
+        ("SHOW_", False),
+        ("SHOW_VIDEO: give", False),
+        ("SHOW_VIDEO: give up", True),
+        ("", True),
+        ("Bye", False),
+        ("Bye", True),
+    ]
+    assert list(chat.stream_lines(["done\n"])) == [("done", True)]
+    assert list(chat.stream_lines([])) == []
+
+
+def test_deltas_skip_empty_chunks():
+    stream = [chunk("a"), chunk(None), SimpleNamespace(choices=[]), chunk("b")]
+    assert list(chat.deltas(stream)) == ["a", "b"]
+
+
+def test_history_keeps_the_recent_turns_in_budget(words):
+    history = chat.History(budget=12)
+    for n in range(4):
+        history.add("user", f"question {n}")  # 6 tokens each
+    assert history._split() == 2
+    messages = history.messages()
+    assert messages[0]["role"] == "system"
+    assert [m["content"] for m in messages[1:]] == ["question 2", "question 3"]
+
+
+def test_history_always_keeps_the_last_turn(words):
+    history = chat.History(budget=5)
+    history.add("user", "hi")
+    history.add("user", " ".join(["long"] * 50))
+    assert history._split() == 1
+    assert history.messages()[-1] == history.turns[-1]
+
+
+def test_compact_folds_old_turns_into_the_summary(words):
+    history = chat.History(budget=24)
+    for n in range(4):
+        history.add("user" if n % 2 == 0 else "assistant", f"turn {n}")
+    client = FakeClient()
+    assert not history.compact(client)  # 24 tokens, at the budget
+    history.add("user", "turn 4")
+    assert history.compact(client)
+    # Compacted down to half of the budget
+    assert [turn["content"] for turn in history.turns] == ["turn 3", "turn 4"]
+    transcript = client.requests[0]["messages"][1]["content"]
+    assert transcript == "user: turn 0\nassistant: turn 1\nuser: turn 2"
+    assert "they know give up" in history.messages()[0]["content"]
+    # The next exchange fits without another summary
+    history.add("assistant", "turn 5")
+    history.add("user", "turn 6")
+    assert not history.compact(client)
+    assert len(client.requests) == 1
+
+
+def test_compact_keeps_the_earlier_summary(words):
+    history = chat.History(budget=6)
+    history.summary = "earlier"
+    history.add("user", "one")
+    history.add("user", "two")
+    client = FakeClient()
+    history.compact(client)
+    assert client.requests[0]["messages"][1]["content"].startswith(
+        "Earlier summary: earlier"
+    )
+
+
+@pytest.mark.parametrize(
+    "term, expected",
+    [
+        ("**Break down** (分解)", "break down"),
+        ('"Hola!"', "hola"),
+        ("give up - 放弃", "give up"),
+        ("abandon，放弃", "abandon"),
+    ],
+)
+def test_normalize_term(term, expected):
+    assert chat.normalize_term(term) == expected
+
+
+def test_directives():
+    text = "Hi\nSHOW_VIDEO: Give up\nSHOW_VIDEO: give up (放弃)\nSHOW_VIDEO:\n"
+    assert chat.directives(text) == ["give up"]
+    assert chat.fallbacks("give it up") == ["give it up"]
+    assert chat.fallbacks("break down quickly") == [
+        "break down quickly",
+        "quickly",
+        "break",
+        "down",
+    ]
+    assert chat.fallbacks("go") == ["go"]
+
+
+def test_video_resolver_falls_back_to_a_word():
+    resolver = chat.VideoResolver(lambda term: term in {"abandon", "hope"})
+    text = "SHOW_VIDEO: abandon ship\nSHOW_VIDEO: hope\nSHOW_VIDEO: xyz"
+    assert resolver.resolve_all(text) == {
+        "abandon ship": "abandon",
+        "hope": "hope",
+        "xyz": None,
+    }
+    assert resolver.submit("Hope") is None  # already submitted
+
+
+def test_video_resolver_lets_the_player_try_on_errors():
+    def has_clips(term):
+        raise ConnectionError("down")
+
+    assert chat.VideoResolver(has_clips).resolve_all("SHOW_VIDEO: hope") == {
+        "hope": "hope"
+    }
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import clip_server
+from conftest import make_sub
+
+
+@pytest.fixture
+def searches(memory, monkeypatch):
+    """Three lines of s1.srt, and a count of the searches"""
+    for index, content in enumerate(["hello there", "I give up", "the end"]):
+        make_sub("s1.srt", index, content).save()
+    calls = []
+    search = memory.search
+    monkeypatch.setattr(
+        memory, "search", lambda index, body: calls.append(body) or search(index, body)
+    )
+    return calls
+
+
+def run(requests):
+    """Run requests(client) against a new server"""
+
+    async def main():
+        app = clip_server.make_app()
+        app.on_cleanup.clear()
+        async with TestClient(TestServer(app)) as client:
+            return await requests(client)
+
+    return asyncio.run(main())
+
+
+def test_the_documents_of_a_term_cost_one_search(searches):
+    async def requests(client):
+        m3u8 = await client.get("/m3u8/give.m3u8?padding=1")
+        srt = await client.get("/m3u8/give.srt?padding=1")
+        jpgs = await client.get("/m3u8/give.jpgs?padding=1")
+        return [(r.status, r.content_type, await r.text()) for r in [m3u8, srt, jpgs]]
+
+    (m3u8, srt, jpgs) = run(requests)
+    assert m3u8[:2] == (200, "application/vnd.apple.mpegurl")
+    assert m3u8[2].count("#EXTINF") == 3
+    assert "I give up" in srt[2]
+    assert jpgs[:2] == (200, "text/plain")
+    assert jpgs[2] == ""  # no guessed thumbnail URLs
+    assert len(searches) == 1
+
+
+def test_concurrent_requests_share_the_search(searches):
+    async def requests(client):
+        return await asyncio.gather(
+            *(client.get("/m3u8/give.m3u8") for _ in range(5))
+        )
+
+    assert [r.status for r in run(requests)] == [200] * 5
+    assert len(searches) == 1
+
+
+def test_etags(searches):
+    async def requests(client):
+        first = await client.get("/m3u8/give.m3u8")
+        etag = first.headers["ETag"]
+        again = await client.get("/m3u8/give.m3u8", headers={"If-None-Match": etag})
+        return etag, again.status
+
+    etag, status = run(requests)
+    assert etag.startswith('"') and status == 304
+
+
+@pytest.mark.parametrize(
+    "path, status",
+    [
+        ("/m3u8/give.m3u8?repeat=0", 400),
+        ("/m3u8/give.m3u8?padding=6", 400),
+        ("/m3u8/give.m3u8?repeat=x", 400),
+        ("/m3u8/give.mp4", 404),
+        ("/m3u8/%20.m3u8", 404),
+        ("/healthz", 200),
+        ("/metrics", 200),
+    ],
+)
+def test_routes(searches, path, status):
+    async def requests(client):
+        return (await client.get(path)).status
+
+    assert run(requests) == status
@@ -0,0 +1,232 @@
+import asyncio
+
+import pytest
+
+from conftest import make_sub
+from esdata import AsyncSub, Field, Response, Sub, VectorData
+
+
+class Point(VectorData):
+    index = "test_points"
+    dims = 2
+    fields = [Field("vector"), Field("name")]
+
+
+@pytest.fixture
+def subs(memory):
+    for index in range(7):
+        make_sub("s1.srt", index, f"line {index} give" if index % 2 else "other").save()
+    return memory
+
+
+def test_response_builds_items_on_access():
+    built = []
+    hits = [{"_id": "a", "_source": {"x": 1}}, {"_id": "b", "sort": [2]}]
+    resp = Response(hits, lambda hit: built.append(hit["_id"]) or hit["_id"])
+    assert resp.column("id") == ["a", "b"]
+    assert resp.column("x") == [1, None]
+    assert built == []
+    assert resp[1] == "b" and resp[1] == "b"
+    assert built == ["b"]
+    assert resp[:] == ["a", "b"] and resp.first() == "a"
+    assert resp.cursor == [2]
+    assert Response().cursor is None
+
+
+def test_save_stamps_the_duration_and_the_id(memory):
+    sub = make_sub("s1.srt", 3, "hello", duration=1.5)
+    del sub.duration
+    sub.save()
+    loaded = Sub("s1.srt_3")
+    assert loaded.duration == 1.5 and loaded.modified and loaded.created
+    with pytest.raises(FileNotFoundError):
+        Sub("missing")
+
+
+def test_find_pages_and_search_after(subs):
+    first = Sub().find(query_string="give", sort=["index"], size=2)
+    assert first.count == 3
+    assert [sub.index for sub in first] == [1, 3]
+    second = Sub().find(
+        query_string="give", sort=["index"], size=2, search_after=first.cursor
+    )
+    assert [sub.index for sub in second] == [5]
+    page = Sub().find(query_string="give", sort=["index"], size=2, page=2)
+    assert [sub.index for sub in page] == [5]
+
+
+def test_find_fields_and_deleted(subs):
+    resp = Sub().find(query_string="give", fields=["index"])
+    assert resp.first().content is None and resp.first().index is not None
+    Sub("s1.srt_1").delete()
+    assert Sub().find(query_string="give").count == 2
+    assert Sub().find(query_string="give", include_deleted=True).count == 3
+
+
+def test_find_collapse_counts_groups(subs):
+    make_sub("s2.srt", 1, "give").save()
+    resp = Sub().find(query_string="give", collapse="srt_file.keyword")
+    assert resp.count == 2 and len(resp) == 2
+
+
+def test_load_many_with_one_mget(subs, monkeypatch):
+    calls = []
+    mget = subs.mget
+    monkeypatch.setattr(
+        subs, "mget", lambda index, ids: calls.append(ids) or mget(index, ids)
+    )
+    loaded = Sub().load_many(["s1.srt_2", "missing", "s1.srt_0"])
+    assert [sub and sub.index for sub in loaded] == [2, None, 0]
+    assert len(calls) == 1
+    assert Sub().load_many([]) == []
+
+
+def test_find_many_with_one_msearch(subs, monkeypatch):
+    calls = []
+    msearch = subs.msearch
+    monkeypatch.setattr(
+        subs,
+        "msearch",
+        lambda index, bodies: calls.append(bodies) or msearch(index, bodies),
+    )
+    give, other = Sub().find_many(
+        [{"query_string": "give"}, {"query_string": "other", "size": 2}]
+    )
+    assert give.count == 3 and len(other) == 2
+    assert len(calls) == 1
+
+    monkeypatch.setattr(subs, "msearch", lambda index, bodies: [{"error": "boom"}])
+    with pytest.raises(RuntimeError):
+        Sub().find_many([{"query_string": "give"}])
+
+
+def test_save_many_reports_failures(memory, monkeypatch):
+    subs = [make_sub("s1.srt", index, "hello") for index in range(3)]
+    bulk = memory.bulk
+
+    def flaky(index, docs):
+        results = bulk(index, docs)
+        results[1] = {"_id": docs[1][0], "status": 429, "error": "busy"}
+        return results
+
+    monkeypatch.setattr(memory, "bulk", flaky)
+    failed = Sub().save_many(subs)
+    assert [item.index for item, _ in failed] == [1]
+    assert failed[0][1]["status"] == 429
+
+
+def test_iter_all_reads_batches_on_a_point_in_time(subs, monkeypatch):
+    searches = []
+    search = subs.search
+    monkeypatch.setattr(
+        subs, "search", lambda index, body: searches.append(body) or search(index, body)
+    )
+    items = Sub().iter_all(batch_size=3)
+    first = next(items)
+    # Written after the point in time: not part of this iteration
+    make_sub("s1.srt", 9, "late").save()
+    ids = [first.id] + [sub.id for sub in items]
+    assert sorted(ids) == sorted(f"s1.srt_{index}" for index in range(7))
+    assert len(searches) == 3
+    assert all("pit" in body for body in searches)
+    assert "search_after" in searches[1]
+    assert subs.pits == {}
+
+
+def test_iter_all_closes_the_point_in_time_when_stopped(subs):
+    items = Sub().iter_all(batch_size=2)
+    next(items)
+    assert len(subs.pits) == 1
+    items.close()
+    assert subs.pits == {}
+
+
+def test_iter_all_filters_and_deleted(subs):
+    Sub("s1.srt_1").delete()
+    assert len(list(Sub().iter_all(query_string="give"))) == 2
+    assert len(list(Sub().iter_all(query_string="give", include_deleted=True))) == 3
+
+
+def test_update_by_query_keeps_the_other_fields(subs):
+    sub = Sub("s1.srt_2")
+    subs.index(Sub.index, {**vars(sub), "extra": 1, "duration": None}, id=sub.id)
+    updated = Sub().update_by_query(
+        {"ids": {"values": [sub.id]}},
+        "ctx._source.duration = ctx._source.end - ctx._source.start",
+    )
+    assert updated == 1
+    source = subs.get(Sub.index, sub.id)["_source"]
+    assert source["duration"] == 2.0 and source["extra"] == 1
+    assert source["modified"] == sub.modified
+
+
+def test_top_terms(subs):
+    make_sub("s2.srt", 0, "other").save()
+    buckets = Sub().top_terms("srt_file.keyword")
+    assert [(bucket.key, bucket.doc_count) for bucket in buckets] == [
+        ("s1.srt", 7),
+        ("s2.srt", 1),
+    ]
+
+
+def test_async_sub(subs):
+    async def run():
+        found = await AsyncSub().find(query_string="give", sort=["index"])
+        loaded = await AsyncSub().load_many(["s1.srt_0", "missing"])
+        sub = AsyncSub()
+        vars(sub).update(vars(make_sub("s3.srt", 0, "async give")))
+        await sub.save()
+        return found, loaded
+
+    found, loaded = asyncio.run(run())
+    assert [sub.index for sub in found] == [1, 3, 5]
+    assert loaded[0].index == 0 and loaded[1] is None
+    assert Sub("s3.srt_0").content == "async give"
+    with pytest.raises(TypeError):
+        AsyncSub("s1.srt_0")
+
+
+def test_async_sub_batches(subs):
+    async def run():
+        give, other = await AsyncSub().find_many(
+            [{"query_string": "give"}, {"query_string": "other", "size": 2}]
+        )
+        items = [sub.id async for sub in AsyncSub().iter_all(batch_size=3)]
+        new = [make_sub("s4.srt", index, "bulk") for index in range(2)]
+        failed = await AsyncSub().save_many(new)
+        updated = await AsyncSub().update_by_query(
+            {"term": {"srt_file": "s4.srt"}}, "ctx._source.duration = 7"
+        )
+        return give, other, items, failed, updated
+
+    give, other, items, failed, updated = asyncio.run(run())
+    assert give.count == 3 and len(other) == 2
+    assert sorted(items) == sorted(f"s1.srt_{index}" for index in range(7))
+    assert subs.pits == {}
+    assert failed == [] and updated == 2
+    assert Sub("s4.srt_1").duration == 7
+
+
+def test_vector_find_knn(memory):
+    Point().put_mapping()
+    for name, vector in {"x": [0, 0], "y": [1, 1], "z": [5, 5]}.items():
+        point = Point()
+        point.name, point.vector = name, vector
+        point.save()
+    resp = Point().find({"vector": [1, 1.2]}, knn=True, size=2)
+    assert [point.name for point in resp] == ["y", "x"]
+    resp = Point().find({"vector": [1, 1.2], "name": "z"}, knn=True)
+    assert [point.name for point in resp] == ["z"]
+
+
+def test_vector_find_scans_by_default(memory, monkeypatch):
+    bodies = []
+    monkeypatch.setattr(
+        memory,
+        "search",
+        lambda index, body: bodies.append(body)
+        or {"hits": {"total": {"value": 0}, "hits": []}},
+    )
+    Point().find({"vector": [1, 1]})
+    assert "knn" not in bodies[0]
+    assert "l2norm" in str(bodies[0]["query"])
@@ -0,0 +1,102 @@
+import pytest
+
+import ingest
+from esdata import Sub
+
+SRT = """1
+00:00:01,000 --> 00:00:02,500
+I give up
+
+2
+00:00:04,000 --> 00:00:05,000
+Never give in
+
+3
+00:00:07,000 --> 00:00:08,000
+The end
+"""
+
+
+@pytest.fixture
+def srt_files(tmp_path):
+    paths = []
+    for name in ["a.srt", "b.srt"]:
+        path = tmp_path / name
+        path.write_text(SRT, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def test_subs_from_srt(srt_files):
+    subs = list(ingest.subs_from_srt(srt_files[0]))
+    assert [sub.id for sub in subs] == ["a.srt_1", "a.srt_2", "a.srt_3"]
+    assert subs[1].content == "Never give in"
+    assert (subs[1].sub_start, subs[1].sub_end) == (4.0, 5.0)
+    assert subs[1].start <= 4.0 and subs[1].end >= 5.0
+
+
+def test_chunks_are_bounded_by_count_and_size(srt_files):
+    subs = list(ingest.subs_from_srt(srt_files[0]))
+    assert [len(chunk) for chunk in ingest.chunks(subs, max_docs=2)] == [2, 1]
+    assert [len(chunk) for chunk in ingest.chunks(subs, max_bytes=1)] == [1, 1, 1]
+
+
+def test_ingest_with_checkpoint(memory, srt_files, tmp_path):
+    checkpoint = str(tmp_path / "ingest.done")
+    progress = ingest.ingest(srt_files, workers=2, max_docs=2, checkpoint=checkpoint)
+    assert (progress.docs, progress.failed, progress.files) == (6, 0, 2)
+    assert Sub("b.srt_3").content == "The end"
+    assert Sub("b.srt_3").duration > 0
+    assert ingest.load_checkpoint(checkpoint) == set(srt_files)
+
+    # Loaded files are skipped, and loading again overwrites
+    assert ingest.ingest(srt_files, checkpoint=checkpoint).docs == 0
+    assert ingest.ingest(srt_files[:1]).docs == 3
+    assert Sub().find(size=0).count == 6
+
+
+def test_dry_run_saves_nothing(memory, srt_files, tmp_path):
+    checkpoint = str(tmp_path / "ingest.done")
+    assert ingest.ingest(srt_files, dry_run=True, checkpoint=checkpoint).docs == 6
+    assert Sub().find(size=0).count == 0
+    assert ingest.load_checkpoint(checkpoint) == set()
+
+
+def test_send_backs_off_on_429(memory, srt_files, monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    bulk = memory.bulk
+    attempts = []
+
+    def busy_once(index, docs):
+        attempts.append(len(docs))
+        results = bulk(index, docs)
+        if len(attempts) == 1:
+            results[0] = {"_id": docs[0][0], "status": 429}
+            results[1] = {"_id": docs[1][0], "status": 400, "error": "bad"}
+        return results
+
+    monkeypatch.setattr(memory, "bulk", busy_once)
+    chunk = list(ingest.subs_from_srt(srt_files[0]))
+    failed = ingest.send(chunk)
+    assert [sub.id for sub in failed] == ["a.srt_2"]
+    assert attempts == [3, 1]
+
+
+def test_send_gives_up(memory, srt_files, monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(
+        memory,
+        "bulk",
+        lambda index, docs: [{"_id": id, "status": 429} for id, _ in docs],
+    )
+    chunk = list(ingest.subs_from_srt(srt_files[0]))
+    assert len(ingest.send(chunk, max_retries=2)) == 3
+
+
+def test_ingest_updates_the_term_index(memory, srt_files, tmp_path):
+    from term_index import TermIndex
+
+    (tmp_path / "words.txt").write_text("give\tv. 给\nend\tn. 结束\n", encoding="utf-8")
+    index = TermIndex(str(tmp_path / "terms.sqlite3"), str(tmp_path))
+    ingest.ingest(srt_files[:1], term_index=index)
+    assert set(index.lookup("give")) == {"a.srt_1", "a.srt_2"}
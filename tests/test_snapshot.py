@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import snapshot
+import video_lib
+from conftest import make_sub
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() as a list, to date the writes"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = snapshot.SqliteStore(str(tmp_path / "subs.sqlite3"))
+    yield store
+    store.close()
+
+
+def save(index, content, **kwargs):
+    return make_sub("s1.srt", index, content, **kwargs).save()
+
+
+def test_sync_exports_everything_then_only_the_changes(memory, clock, store):
+    for index, content in enumerate(["hello there", "I give up", "never give in"]):
+        save(index, content)
+    assert snapshot.sync(store, overlap=0) == 3
+    assert store.count() == 3
+    assert store.watermark() == 1000.0
+
+    clock[0] = 2000.0
+    save(1, "I gave up")
+    save(3, "the end")
+    # The Subs modified at the watermark itself are read again
+    assert snapshot.sync(store, overlap=0) == 4
+    assert store.watermark() == 2000.0
+    assert store.count() == 4
+    assert store.load_many(["s1.srt_1"])[0].content == "I gave up"
+    assert snapshot.sync(store, overlap=0) == 2
+
+
+def test_sync_reads_the_overlap_again(memory, clock, store):
+    save(0, "hello there")
+    snapshot.sync(store)
+    clock[0] += 100
+    save(1, "I give up")
+    assert snapshot.sync(store, overlap=300) == 2
+    assert snapshot.sync(store, overlap=50) == 1
+
+
+def test_sync_replicates_deletions(memory, clock, store):
+    save(0, "hello there")
+    save(1, "I give up")
+    snapshot.sync(store)
+    clock[0] += 10
+    sub = make_sub("s1.srt", 1, "I give up")
+    sub.delete()
+    snapshot.sync(store, overlap=0)
+    assert store.count() == 1
+    assert store.load_many(["s1.srt_0", "s1.srt_1"])[1] is None
+    assert store.term_clips("give") == []
+
+
+def test_full_sync_starts_again(memory, clock, store):
+    save(0, "hello there")
+    snapshot.sync(store, batch_size=1)
+    store.apply([make_sub("gone.srt", 0, "not in the index")])
+    assert store.count() == 2
+    assert snapshot.sync(store, full=True) == 1
+    assert store.count() == 1
+
+
+def test_term_clips(memory, clock, store):
+    save(0, "I give up")
+    save(1, "give it back", duration=9.0)
+    save(2, "giving in")
+    snapshot.sync(store)
+    assert [sub.id for sub in store.term_clips("give")] == ["s1.srt_0"]
+    assert len(store.term_clips("give", max_duration=10)) == 2
+    assert store.term_clips("?!") == []
+
+
+def test_srtseg_from_snapshot(memory, clock, store):
+    for index, content in enumerate(["hello there", "I give up", "the end"]):
+        save(index, content)
+    snapshot.sync(store)
+    sseg = video_lib.srtseg_from_snapshot(store, "give", padding=1)
+    assert [seg.subtitle.content for seg in sseg.segs()] == [
+        "hello there",
+        "I give up",
+        "the end",
+    ]
+
+
+def test_match_query():
+    assert snapshot.match_query("give up!") == '"give" OR "up"'
+    assert snapshot.match_query("...") == ""
@@ -0,0 +1,173 @@
+from types import SimpleNamespace
+
+import pytest
+
+import term_index
+from conftest import make_sub
+from esdata import Sub
+
+WORDS = {
+    "abandon",
+    "box",
+    "car",
+    "care",
+    "die",
+    "give",
+    "give up",
+    "go",
+    "hop",
+    "hope",
+    "news",
+    "new",
+    "sing",
+    "singe",
+    "stop",
+    "try",
+    "us",
+    "use",
+    "used",
+}
+
+
+@pytest.mark.parametrize(
+    "token, expected",
+    [
+        ("abandoned", ["abandon"]),
+        ("caring", ["care"]),
+        ("hoping", ["hope"]),
+        ("hopping", ["hop"]),
+        ("boxes", ["box"]),
+        ("used", ["used", "use"]),
+        ("using", ["use"]),
+        ("stopped", ["stop"]),
+        ("singing", ["sing"]),
+        ("tried", ["try"]),
+        ("died", ["die"]),
+        ("went", ["go"]),
+        ("news", ["news"]),
+        ("cars", ["car"]),
+        ("xyz", []),
+    ],
+)
+def test_lemmas(token, expected):
+    assert term_index.lemmas(token, WORDS) == expected
+
+
+def test_lemmas_give_one_base_per_token():
+    for token in ("caring", "hoping", "boxes", "used"):
+        bases = [w for w in term_index.lemmas(token, WORDS) if w != token]
+        assert len(bases) == 1
+
+
+def test_terms_of_finds_inflections_and_phrases():
+    found = term_index.terms_of("<i>He gave up, hoping to stop.</i>", WORDS)
+    assert found == {"give": False, "give up": False, "hope": False, "stop": True}
+
+
+def test_terms_of_marks_the_exact_form():
+    assert term_index.terms_of("Use it", WORDS) == {"use": True}
+    assert term_index.terms_of("Used it", WORDS) == {"used": True, "use": False}
+
+
+def _sub(content, duration):
+    return SimpleNamespace(content=content, duration=duration)
+
+
+def test_score_prefers_short_whole_sentences():
+    good = term_index.score(_sub("I will never abandon you.", 2.5), True)
+    assert good > term_index.score(_sub("I will never abandon you.", 6), True)
+    assert good > term_index.score(_sub("I will never abandon you.", 2.5), False)
+    assert good > term_index.score(_sub("Abandon", 2.5), True)
+    assert good > term_index.score(_sub("♪ never abandon you ♪", 2.5), True)
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(term_index, "vocabulary", lambda dirname: WORDS)
+    index = term_index.TermIndex(str(tmp_path / "terms.sqlite3"))
+    yield index
+    index.close()
+
+
+def test_apply_replaces_and_removes_postings(index):
+    sub = make_sub("a.srt", 1, "I hope so.")
+    index.apply([sub])
+    assert index.lookup("hope") == ["a.srt_1"]
+
+    sub.content = "Stop it."
+    index.apply([sub])
+    assert index.lookup("hope") == []
+    assert index.lookup("stopping") == ["a.srt_1"]
+
+    sub.deleted = True
+    index.apply([sub])
+    assert index.lookup("stop") == []
+
+
+def test_apply_keeps_the_best_clips(index, monkeypatch):
+    monkeypatch.setattr(term_index, "MAX_CLIPS", 3)
+    subs = [
+        make_sub("a.srt", n, "I hope so.", duration=2.5 + n / 10) for n in range(6)
+    ]
+    index.apply(subs)
+    assert index.lookup("hope", size=10) == ["a.srt_0", "a.srt_1", "a.srt_2"]
+
+
+def test_lookup_filters_on_duration(index):
+    index.apply([make_sub("a.srt", 1, "I hope so.", duration=8)])
+    assert index.lookup("hope", max_duration=5) == []
+    assert index.lookup("hope", max_duration=10) == ["a.srt_1"]
+
+
+def test_sync_and_term_clips_read_the_index(index, memory, monkeypatch):
+    import settings
+    import snapshot
+    import video_lib
+
+    for n, content in enumerate(["I hope so.", "We hoped.", "Stop!"]):
+        make_sub("a.srt", n, content).save()
+    assert snapshot.sync(index) == 3
+    monkeypatch.setattr(settings, "TERM_INDEX", index.path)
+    monkeypatch.setattr(term_index, "_default", index)
+    monkeypatch.setattr(memory, "search", lambda *args: pytest.fail("searched"))
+    assert {sub.id for sub in video_lib.term_clips("hoping")} == {"a.srt_0", "a.srt_1"}
+
+    # A Sub deleted since the last sync is not played
+    memory.index(Sub.index, {"content": "We hoped.", "deleted": True}, id="a.srt_1")
+    assert [sub.id for sub in video_lib.term_clips("hope")] == ["a.srt_0"]
+
+
+def test_term_clips_many_searches_only_the_unknown_terms(index, memory, monkeypatch):
+    import asyncio
+
+    import settings
+    import snapshot
+    import tracing
+    import video_lib
+
+    for n, content in enumerate(["I hope so.", "We hoped.", "Stop!"]):
+        make_sub("a.srt", n, content).save()
+    snapshot.sync(index)
+    make_sub("b.srt", 0, "zebra crossing").save()
+    monkeypatch.setattr(settings, "TERM_INDEX", index.path)
+    monkeypatch.setattr(term_index, "_default", index)
+    searched = []
+    msearch = memory.msearch
+    monkeypatch.setattr(
+        memory,
+        "msearch",
+        lambda index, bodies: searched.extend(bodies) or msearch(index, bodies),
+    )
+    tracing.reset()
+    found = video_lib.term_clips_many(["hoping", "zebra", "stop"])
+    assert [{sub.id for sub in clips} for clips in found] == [
+        {"a.srt_0", "a.srt_1"},
+        {"b.srt_0"},
+        {"a.srt_2"},
+    ]
+    assert len(searched) == 1 and "zebra" in str(searched[0])
+    assert tracing.snapshot()["counters"] == {"store.mget": 1, "store.msearch": 1}
+    tracing.reset()
+
+    clips = asyncio.run(video_lib.term_clips_async("hoping"))
+    assert {sub.id for sub in clips} == {"a.srt_0", "a.srt_1"}
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+
+import pytest
+
+import settings
+import tracing
+from conftest import make_sub
+from esdata import Sub
+
+
+@pytest.fixture
+def spans():
+    """The spans ended during the test"""
+    tracing.reset()
+    ended = []
+    tracing.add_hook(ended.append)
+    yield ended
+    tracing.remove_hook(ended.append)
+    tracing.reset()
+
+
+def test_round_trips_count_in_every_open_span(spans):
+    with tracing.span("outer", term="give"):
+        tracing.round_trip("search")
+        with tracing.span("inner"):
+            tracing.round_trip("mget")
+            tracing.annotate(hits=3)
+    inner, outer = spans
+    assert (inner.name, inner.round_trips, inner.attrs) == ("inner", 1, {"hits": 3})
+    assert (outer.round_trips, outer.attrs) == (2, {"term": "give"})
+    assert inner.parent is outer
+    counters = tracing.snapshot()["counters"]
+    assert counters == {"store.search": 1, "store.mget": 1}
+
+
+def test_errors_are_recorded(spans):
+    with pytest.raises(KeyError):
+        with tracing.span("failing"):
+            raise KeyError("x")
+    assert isinstance(spans[0].error, KeyError)
+    assert tracing.snapshot()["operations"]["failing"]["errors"] == 1
+
+
+def test_traced_functions_and_methods(memory, spans):
+    @tracing.traced()
+    def plain():
+        return Sub().find(query_string="give")
+
+    @tracing.traced("named")
+    async def coroutine():
+        return 1
+
+    make_sub("s1.srt", 0, "give").save()
+    plain()
+    assert asyncio.run(coroutine()) == 1
+    names = [span.name for span in spans]
+    assert names == ["Sub.save", "Sub.find", "plain", "named"]
+    operations = tracing.snapshot()["operations"]
+    assert operations["plain"]["round_trips"] == 1
+    assert operations["Sub.find"]["count"] == 1
+
+
+def test_a_failing_hook_does_not_break_the_operation(spans, caplog):
+    def broken(span):
+        raise RuntimeError("hook")
+
+    tracing.add_hook(broken)
+    try:
+        with tracing.span("safe"):
+            pass
+    finally:
+        tracing.remove_hook(broken)
+    assert spans[0].name == "safe"
+    assert "Tracing hook" in caplog.text
+
+
+def test_slow_spans_are_logged(spans, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "SLOW_QUERY_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="tracing"):
+        with tracing.span("slow", body={"query": "give"}):
+            pass
+    assert "Slow slow" in caplog.text and "give" in caplog.text
+
+
+def test_timer_percentiles(spans):
+    for n in range(100):
+        with tracing.span("timed") as span:
+            pass
+        span.duration = n / 1000
+    timer = tracing.Timer()
+    for span in spans:
+        timer.add(span)
+    stats = timer.snapshot()
+    assert stats["count"] == 100 and stats["p50_ms"] == 49.0
+    assert stats["p99_ms"] == 98.0 and stats["max_ms"] == 99.0
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import transcribe
+
+
+class Echo(transcribe.Transcriber):
+    """Transcribe the audio bytes into their text, counting the calls"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def _transcribe(self, audio, filename):
+        self.calls += 1
+        return audio.decode()
+
+
+def test_transcripts_are_cached_by_content():
+    transcriber = Echo()
+    assert transcriber.transcribe(b" hello ") == "hello"
+    assert transcriber.transcribe(b" hello ") == "hello"
+    assert transcriber.transcribe(b"bye") == "bye"
+    assert transcriber.calls == 2
+
+
+@pytest.mark.parametrize("audio", [b"", None, b"   "])
+def test_nothing_to_transcribe(audio):
+    transcriber = Echo()
+    with pytest.raises(transcribe.TranscriptionError):
+        transcriber.transcribe(audio)
+    assert len(transcriber.cache) == 0
+
+
+def test_whisper_sends_the_audio_from_memory(monkeypatch):
+    sent = []
+    clients = []
+
+    class Client:
+        def __init__(self, **options):
+            clients.append(options)
+            self.closed = False
+            transcriptions = SimpleNamespace(create=self.create)
+            self.audio = SimpleNamespace(transcriptions=transcriptions)
+
+        def create(self, **kwargs):
+            sent.append(kwargs)
+            return SimpleNamespace(text="I give up")
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(openai, "AzureOpenAI", Client)
+    transcriber = transcribe.WhisperTranscriber(model="whisper", timeout=5)
+    assert transcriber.transcribe(b"audio") == "I give up"
+    assert transcriber.transcribe(b"other") == "I give up"
+    assert sent[0] == {"file": ("speech.wav", b"audio"), "model": "whisper"}
+    assert len(clients) == 1 and clients[0]["timeout"] == 5
+    client = transcriber.client
+    transcriber.close()
+    assert client.closed and transcriber._client is None
+
+
+def test_whisper_errors(monkeypatch):
+    def create(**kwargs):
+        raise openai.OpenAIError("quota")
+
+    client = SimpleNamespace(
+        audio=SimpleNamespace(transcriptions=SimpleNamespace(create=create))
+    )
+    transcriber = transcribe.WhisperTranscriber()
+    transcriber._client = client
+    with pytest.raises(transcribe.TranscriptionError, match="quota"):
+        transcriber.transcribe(b"audio")
+
+
+def test_default_is_shared(monkeypatch):
+    monkeypatch.setattr(transcribe, "_default", None)
+    monkeypatch.setattr(transcribe.settings, "TRANSCRIBE_BACKEND", "local")
+    assert transcribe.default() is transcribe.default()
+    assert isinstance(transcribe.default(), transcribe.LocalTranscriber)
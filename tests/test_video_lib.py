@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+import tracing
+import video_lib
+from conftest import make_sub
+from esdata import Sub
+
+CONTENTS = [
+    "hello there",
+    "I give up",
+    "give it back",
+    "nothing here",
+    "still nothing",
+    "I never give in",
+    "the end",
+]
+
+
+@pytest.fixture
+def corpus(memory, monkeypatch):
+    """s1.srt with the lines of CONTENTS, and a count of the mgets"""
+    for index, content in enumerate(CONTENTS):
+        make_sub("s1.srt", index, content).save()
+    make_sub("s2.srt", 0, "give a long speech", duration=9.0).save()
+    video_lib.PLAYLIST_CACHE.invalidate()
+    mgets = []
+    mget = memory.mget
+    monkeypatch.setattr(
+        memory, "mget", lambda index, ids: mgets.append(list(ids)) or mget(index, ids)
+    )
+    return mgets
+
+
+def sub(index):
+    return make_sub("s1.srt", index, CONTENTS[index])
+
+
+def ids(subs):
+    return [s.id for s in subs]
+
+
+def test_padding_plan_drops_hits_and_shared_neighbors():
+    plan = video_lib._padding_plan([sub(1), sub(2), sub(5)], padding=2)
+    assert [(before, s.id, after) for before, s, after in plan] == [
+        # s1.srt_2 is a hit itself, not a neighbor of s1.srt_1
+        (["s1.srt_0"], "s1.srt_1", []),
+        # s1.srt_3 and s1.srt_4 pad s1.srt_2 already, not s1.srt_5 again
+        ([], "s1.srt_2", ["s1.srt_3", "s1.srt_4"]),
+        ([], "s1.srt_5", ["s1.srt_6", "s1.srt_7"]),
+    ]
+
+
+def test_padding_plan_keeps_a_neighbor_once():
+    plan = video_lib._padding_plan([sub(1), sub(4)], padding=2)
+    neighbors = [i for before, _, after in plan for i in before + after]
+    assert neighbors == ["s1.srt_0", "s1.srt_2", "s1.srt_3", "s1.srt_5", "s1.srt_6"]
+
+
+def test_padding_plan_stops_at_the_start_of_the_file():
+    plan = video_lib._padding_plan([sub(0)], padding=3)
+    assert plan[0][0] == []
+
+
+def test_padded_subs_loads_neighbors_with_one_mget(corpus):
+    subs = video_lib.padded_subs([sub(1), sub(5)], padding=1)
+    assert ids(subs) == [f"s1.srt_{i}" for i in (0, 1, 2, 4, 5, 6)]
+    assert len(corpus) == 1
+
+
+def test_padded_subs_repeat_and_missing_neighbors(corpus):
+    subs = video_lib.padded_subs([sub(6)], repeat=2, padding=1)
+    # Each repetition is padded, s1.srt_7 does not exist
+    assert ids(subs) == ["s1.srt_5", "s1.srt_6"] * 2
+    assert corpus == [["s1.srt_5", "s1.srt_7"]]
+
+
+def test_padded_subs_by_id(corpus):
+    subs = video_lib.padded_subs_by_id(["s1.srt_2", "missing_3"], padding=1)
+    assert ids(subs) == ["s1.srt_1", "s1.srt_2", "s1.srt_3"]
+    assert len(corpus) == 1
+
+
+def test_term_clips_filters_long_clips(corpus):
+    assert set(ids(video_lib.term_clips("give"))) == {
+        "s1.srt_1",
+        "s1.srt_2",
+        "s1.srt_5",
+    }
+    assert ids(video_lib.term_clips("give", max_duration=10, size=10))
+    assert video_lib.term_has_clips("speech", max_duration=10)
+    assert not video_lib.term_has_clips("speech")
+
+
+def test_term_clips_before_the_backfill(corpus):
+    # Subs saved before duration existed are measured on end - start
+    for old in [make_sub("s3.srt", 0, "give way"), make_sub("s3.srt", 1, "give", 0, 8)]:
+        body = old.field_dict(exclude="id")
+        del body["duration"]
+        Sub.backend.index(Sub.index, body, id=old.id)
+    found = ids(video_lib.term_clips("give", size=10))
+    assert "s3.srt_0" in found and "s3.srt_1" not in found
+
+
+def test_srtseg_padding(corpus):
+    sseg = video_lib._repeated_srtseg([sub(3)])
+    padded = video_lib.srtseg_padding(sseg, padding=1)
+    assert [seg.subtitle.content for seg in padded.segs()] == CONTENTS[2:5]
+    assert len(corpus) == 1
+
+
+def test_srtseg_from_es_async(corpus):
+    sseg = asyncio.run(video_lib.srtseg_from_es_async("never", padding=1))
+    assert [seg.subtitle.content for seg in sseg.segs()] == CONTENTS[4:7]
+
+
+def test_term_m3u8(corpus):
+    playlist = video_lib.term_m3u8("never", padding=1)
+    assert playlist.startswith("#EXTM3U")
+    assert playlist.count("#EXTINF:2.0,") == 3
+    assert "#EXT-X-TARGETDURATION:2\n" in playlist
+    assert playlist.endswith("#EXT-X-ENDLIST\n")
+    assert video_lib.term_m3u8("never", padding=1) == playlist
+    assert len(corpus) == 1  # the second one is cached
+
+
+def test_srt_of_lays_clips_end_to_end():
+    subtitles = video_lib.srt_of([sub(1), sub(5)])
+    assert "00:00:00,100 --> 00:00:01,900\nI give up" in subtitles
+    assert "00:00:02,100 --> 00:00:03,900\nI never give in" in subtitles
+
+
+def test_terms_m3u8_costs_one_msearch_and_one_mget(corpus):
+    tracing.reset()
+    playlist = video_lib.terms_m3u8(["never", "back", "zebra"], padding=1)
+    assert playlist.count("#EXTINF") == 6
+    assert tracing.snapshot()["counters"] == {"store.msearch": 1, "store.mget": 1}
+    tracing.reset()
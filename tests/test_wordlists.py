@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import wordlists
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("abandon\t[əˈbændən] v.  放弃", ("abandon", "[əˈbændən] v. 放弃")),
+        ("abandon     [ə'bændən]   vt. 放弃", ("abandon", "[ə'bændən] vt. 放弃")),
+        ("abase  []  v. 贬低", ("abase", "v. 贬低")),
+        ("a art.一(个)；每一(个)", ("a", "art.一(个)；每一(个)")),
+        ("Hey.\t1189077", ("Hey.", "1189077")),
+        ("How’s it going?", ("How’s it going?", "")),
+        ("*abase\tv. 贬低", ("abase", "v. 贬低")),
+        ("a (an)\t[ə, eɪ(ən)] art. 一", ("a", "[ə, eɪ(ən)] art. 一")),
+        ("a, an\tart. 一个", ("a", "art. 一个")),
+        ("colour (美color)\tn. 颜色", ("colour", "n. 颜色")),
+        ("﻿give up\tv. 放弃", ("give up", "v. 放弃")),
+        ("Thank you.", ("Thank you.", "")),
+        ("No worries.", ("No worries.", "")),
+        ("No thanks.", ("No thanks.", "")),
+        ("Drive safe.", ("Drive safe.", "")),
+        ("Go ahead.", ("Go ahead.", "")),
+        ("hello int. 你好", ("hello", "int. 你好")),
+    ],
+)
+def test_parse_line(line, expected):
+    assert wordlists.parse_line(line) == expected
+
+
+@pytest.mark.parametrize("line", ["", "   ", "sentence\tcount", "A", "1234", "--"])
+def test_parse_line_skips_headers(line):
+    assert wordlists.parse_line(line) is None
+
+
+def test_parse_keeps_first_position_and_last_meaning():
+    raw = "A\nabandon\tv. 放弃\nbox\tn. 盒子\nabandon\tv. 抛弃\n"
+    assert wordlists.parse(raw) == [("abandon", "v. 抛弃"), ("box", "n. 盒子")]
+
+
+def test_search():
+    entries = [(term, "") for term in ["Apple", "bake", "apply", "Bank", "ant"]]
+    wordlist = wordlists.WordList("test.txt", entries)
+    assert wordlist.search() == [0, 1, 2, 3, 4]
+    assert wordlist.search(letter="A") == [0, 2, 4]
+    assert wordlist.search("app") == [0, 2]
+    assert wordlist.search(" BA ", letter="B") == [1, 3]
+    assert wordlist.search("ba", letter="A") == []
+    assert wordlist.items(wordlist.search("ant")) == [("ant", "")]
+
+
+def test_select():
+    entries = [(term, "") for term in ["Apple", "bake", "apply", "Bank", "ant"]]
+    wordlist = wordlists.WordList("test.txt", entries)
+    assert wordlists.select(wordlist, "A") == [0, 2, 4]
+    # The prefix wins over the letter
+    assert wordlists.select(wordlist, "A", " ba") == [1, 3]
+    assert wordlists.select(wordlist, "A", has_clips=lambda t: t != "apply") == [0, 4]
+
+
+@pytest.mark.parametrize(
+    "total, page_size, expected", [(0, 20, 1), (20, 20, 1), (21, 20, 2), (99, 50, 2)]
+)
+def test_page_count(total, page_size, expected):
+    assert wordlists.page_count(total, page_size) == expected
+
+
+def test_page_slice():
+    positions = list(range(10, 35))
+    assert wordlists.page_slice(positions, 1, 10) == (0, list(range(10, 20)))
+    assert wordlists.page_slice(positions, 3, 10) == (20, list(range(30, 35)))
+    # Out of range pages are clamped
+    assert wordlists.page_slice(positions, 9, 10) == (20, list(range(30, 35)))
+    assert wordlists.page_slice([], 1, 10) == (0, [])
+
+
+def test_following():
+    entries = [(f"w{n}", "") for n in range(10)]
+    wordlist = wordlists.WordList("test.txt", entries)
+    positions = [0, 2, 4, 6, 8]
+    assert wordlists.following(wordlist, positions, 1, 2) == ["w4", "w6"]
+    assert wordlists.following(wordlist, positions, 1, 5, skip={"w6"}) == ["w4", "w8"]
+    assert wordlists.following(wordlist, positions, 4, 3) == []
+    assert wordlists.following(wordlist, positions, 0, 9, window=3) == ["w2", "w4"]
+
+
+def test_load_parses_once_per_version(tmp_path, monkeypatch):
+    dicts, cache = tmp_path / "dicts", tmp_path / "cache"
+    dicts.mkdir()
+    path = dicts / "test.txt"
+    path.write_text("abandon\tv. 放弃\n", encoding="utf-8")
+    monkeypatch.setattr(wordlists, "_loaded", {})
+    load = lambda: wordlists.load("test.txt", str(dicts), str(cache))  # noqa: E731
+
+    first = load()
+    assert first.terms == ["abandon"]
+    assert load() is first
+    assert os.listdir(cache) == ["test.txt.pickle"]
+
+    # A new process reads the pickle, not the .txt
+    monkeypatch.setattr(wordlists, "_loaded", {})
+    monkeypatch.setattr(wordlists, "parse", lambda raw: pytest.fail("parsed"))
+    assert load().terms == ["abandon"]
+    monkeypatch.undo()
+
+    monkeypatch.setattr(wordlists, "_loaded", {})
+    path.write_text("abandon\tv. 放弃\nbox\tn. 盒子\n", encoding="utf-8")
+    assert load().terms == ["abandon", "box"]
+    assert wordlists.names(str(dicts)) == ["test.txt"]
@@ -0,0 +1,218 @@
+"""Timers, counters and spans of the store and clip operations
+
+Operations run in spans, opened with the span() context manager or the
+traced()/traced_method() decorators. A span records its duration and the
+round-trips to the store made while it was open, nested spans included,
+so a clip request knows how many searches and mgets it cost. Ended spans
+feed per-operation timers and are passed to the hooks, e.g. to forward
+them to a tracing system:
+
+    tracing.add_hook(lambda span: print(span.name, span.duration))
+
+Spans slower than SLOW_QUERY_MS are logged as warnings with their
+attributes (the search body for a find). Everything else is logged at
+DEBUG level only, so the hot path stays quiet. snapshot() returns the
+counters and timers, served as /metrics by the clip server.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+import settings
+from cache import size_of
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("span", default=None)
+_hooks = []
+_lock = threading.Lock()
+
+
+class Span:
+    """One run of an operation"""
+
+    def __init__(self, name, attrs, parent=None):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.round_trips = 0
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+
+class Timer:
+    """Statistics of an operation, percentiles over the recent spans"""
+
+    def __init__(self, recent=1000):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.round_trips = 0
+        self.recent = deque(maxlen=recent)
+
+    def add(self, span):
+        self.count += 1
+        self.errors += span.error is not None
+        self.total += span.duration
+        self.max = max(self.max, span.duration)
+        self.round_trips += span.round_trips
+        self.recent.append(span.duration)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+
+        def ms(q):
+            return round(1000 * recent[int(q * (len(recent) - 1))], 3)
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(1000 * self.total / self.count, 3),
+            "p50_ms": ms(0.5),
+            "p99_ms": ms(0.99),
+            "max_ms": round(1000 * self.max, 3),
+            "round_trips": round(self.round_trips / self.count, 2),
+        }
+
+
+_timers = defaultdict(Timer)
+_counters = Counter()
+
+
+def add_hook(hook):
+    """Call hook(span) whenever a span ends"""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time the block as an operation called name"""
+    current = Span(name, attrs, _current.get())
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = e
+        raise
+    finally:
+        _current.reset(token)
+        current.duration = time.perf_counter() - current.started
+        _end(current)
+
+
+def _end(span):
+    with _lock:
+        _timers[span.name].add(span)
+    for hook in list(_hooks):
+        try:
+            hook(span)
+        except Exception:
+            logger.exception("Tracing hook %r failed", hook)
+    ms = 1000 * span.duration
+    if ms >= settings.SLOW_QUERY_MS:
+        logger.warning(
+            "Slow %s: %.1fms, %d round-trips %s",
+            span.name,
+            ms,
+            span.round_trips,
+            span.attrs,
+        )
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "%s: %.1fms, %d round-trips %s", span.name, ms, span.round_trips, span.attrs
+        )
+
+
+def annotate(**attrs):
+    """Add attributes to the current span, e.g. the body of a search"""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def round_trip(op, response=None):
+    """Record a request to the store, and the size of its response when
+    TRACE_BYTES is set (estimating it costs a serialization)"""
+    count("store." + op)
+    if response is not None and settings.TRACE_BYTES:
+        count("store.bytes", size_of(response))
+    current = _current.get()
+    while current is not None:
+        current.round_trips += 1
+        current = current.parent
+
+
+def _wrap(func, name_of):
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(name_of(args)):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name_of(args)):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def traced(name=None):
+    """Decorator running a function in a span, named after it by default"""
+
+    def decorator(func):
+        span_name = name or func.__name__
+        return _wrap(func, lambda args: span_name)
+
+    return decorator
+
+
+def traced_method(func):
+    """Decorator running a method in a span named <class>.<method>,
+    e.g. Sub.find, so that subclasses are timed apart"""
+    return _wrap(func, lambda args: f"{type(args[0]).__name__}.{func.__name__}")
+
+
+def snapshot():
+    """The counters and the timers of the operations"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "operations": {
+                name: timer.snapshot() for name, timer in sorted(_timers.items())
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def configure_logging(level=None):
+    """Log to stderr at LOG_LEVEL, for the scripts and servers"""
+    logging.basicConfig(
+        level=level or settings.LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
@@ -0,0 +1,141 @@
+"""Speech to text for the voice input of the app
+
+The recorded audio is sent from memory, never written to disk. One client
+is kept for the process so its connections are reused, and transcripts
+are cached by the sha256 of the audio: the recorder hands back the same
+bytes on every rerun of the page, which then costs nothing.
+
+    transcriber = transcribe.default()
+    text = transcriber.transcribe(audio_bytes)
+
+A failure raises TranscriptionError. Set TRANSCRIBE_BACKEND=local to use
+faster-whisper on the machine instead of the Azure deployment.
+"""
+
+import hashlib
+import io
+import threading
+
+import openai
+
+import settings
+from cache import TTLCache
+
+
+class TranscriptionError(Exception):
+    """The audio could not be transcribed"""
+
+
+class Transcriber:
+    """Cached speech to text. Subclasses implement _transcribe"""
+
+    def __init__(self, cache_entries=settings.TRANSCRIPT_CACHE_ENTRIES):
+        self.cache = TTLCache(max_entries=cache_entries, ttl=24 * 3600)
+
+    def transcribe(self, audio, filename="speech.wav"):
+        """The text spoken in audio, the bytes of a recording"""
+        if not audio:
+            raise TranscriptionError("No audio recorded")
+        key = hashlib.sha256(audio).hexdigest()
+        text = self.cache.get(key)
+        if text is None:
+            text = self._transcribe(audio, filename).strip()
+            if not text:
+                raise TranscriptionError("Nothing was understood")
+            self.cache.set(key, text)
+        return text
+
+    def _transcribe(self, audio, filename):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WhisperTranscriber(Transcriber):
+    """Whisper deployed on Azure OpenAI"""
+
+    def __init__(self, model=settings.WHISPER_DEPLOYMENT, **kwargs):
+        super().__init__()
+        self.model = model
+        self.options = {
+            "api_key": settings.AZURE_OPENAI_KEY,
+            "api_version": settings.WHISPER_API_VERSION,
+            "azure_endpoint": settings.AZURE_OPENAI_ENDPOINT,
+            "timeout": settings.WHISPER_TIMEOUT,
+            "max_retries": settings.WHISPER_MAX_RETRIES,
+        }
+        self.options.update(kwargs)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = openai.AzureOpenAI(**self.options)
+        return self._client
+
+    def _transcribe(self, audio, filename):
+        try:
+            result = self.client.audio.transcriptions.create(
+                file=(filename, audio), model=self.model
+            )
+        except openai.OpenAIError as e:
+            raise TranscriptionError(str(e)) from e
+        return result.text
+
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+class LocalTranscriber(Transcriber):
+    """faster-whisper running on this machine, for offline use and tests"""
+
+    def __init__(self, model=settings.LOCAL_WHISPER_MODEL):
+        super().__init__()
+        self.model_name = model
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from faster_whisper import WhisperModel
+                    except ImportError as e:
+                        raise TranscriptionError(
+                            "pip install faster-whisper to transcribe locally"
+                        ) from e
+                    self._model = WhisperModel(self.model_name)
+        return self._model
+
+    def _transcribe(self, audio, filename):
+        try:
+            segments, _ = self.model.transcribe(io.BytesIO(audio))
+            return " ".join(segment.text.strip() for segment in segments)
+        except TranscriptionError:
+            raise
+        except Exception as e:
+            raise TranscriptionError(str(e)) from e
+
+
+BACKENDS = {"azure": WhisperTranscriber, "local": LocalTranscriber}
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The Transcriber of settings.TRANSCRIBE_BACKEND, shared by the process"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = BACKENDS[settings.TRANSCRIBE_BACKEND]()
+        return _default
@@ -1,65 +1,155 @@
-import srt
+import asyncio
+import logging
+import math
 from datetime import timedelta
+
+import srt
 from srtseg import Seg, SRTSeg
-from esdata import Sub
-from srtseg.adaptors import titles_to_segs
+from esdata import AsyncSub, Sub
 from elasticsearch_dsl import Q
 
+import settings
+import term_index
+import tracing
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _srt_file(seg):
+    """The srt file of a Sub or of a Seg"""
+    return seg.srt_file if isinstance(seg, Sub) else seg.path.replace("/", "")
+
+
+def _seg_id(seg, offset=0):
+    """The Sub id of seg, or of its neighbor offset lines away"""
+    return _srt_file(seg) + "_" + str(seg.index + offset)
+
+
+def _subs_to_segs(subs):
+    """Segs of Subs laid end to end, what srtseg's titles_to_segs intends
+    (the one of srtseg 0.5.0 cannot run: it misses imports and expects
+    other fields). Each Seg keeps the index of its Sub, for the padding"""
+    start = 0
+    segs = []
+    for sub in subs:
+        seg = Seg()
+        seg_duration = sub.end - sub.start
+        sub_offset = sub.sub_start - sub.start
+        seg.subtitle = srt.Subtitle(
+            index=sub.index,
+            start=timedelta(seconds=start + sub_offset),
+            end=timedelta(seconds=start + sub_offset + sub.sub_end - sub.sub_start),
+            content=sub.content,
+        )
+        seg.index = sub.index
+        seg.selected = True
+        seg.path = sub.srt_file
+        seg.start = timedelta(seconds=start)
+        seg.end = timedelta(seconds=start + seg_duration)
+        seg.duration = timedelta(seconds=seg_duration)
+        segs.append(seg)
+        start += seg_duration
+    return segs
+
+
+def _padding_plan(segs, padding=0):
+    """Decide which neighbor ids surround each of the segs (Seg or Sub).
+    Return a list of (before_ids, seg, after_ids). A neighbor that is a hit
+    itself, or that already pads another hit, is dropped so that
+    overlapping hits do not repeat the same context clip."""
+    hit_ids = {_seg_id(seg) for seg in segs}
+    owners = {}
+    plan = []
+
+    def keep(sub_id, owner):
+        return sub_id not in hit_ids and owners.setdefault(sub_id, owner) == owner
+
+    for seg, nxt in zip(segs, segs[1:] + [None]):
+        owner = _seg_id(seg)
+        # Leave the lines before the next hit to that hit, to keep the order
+        limit = padding
+        if (
+            nxt is not None
+            and _srt_file(nxt) == _srt_file(seg)
+            and nxt.index > seg.index
+        ):
+            limit = min(padding, nxt.index - seg.index - 1)
+        before = [
+            _seg_id(seg, -i) for i in range(padding, 0, -1) if seg.index - i >= 0
+        ]
+        after = [_seg_id(seg, i) for i in range(1, limit + 1)]
+        plan.append(
+            (
+                [sub_id for sub_id in before if keep(sub_id, owner)],
+                seg,
+                [sub_id for sub_id in after if keep(sub_id, owner)],
+            )
+        )
+    return plan
+
+
+def _padded_srtseg(plan, subs):
+    """Rebuild the SRTSeg from a padding plan and the loaded neighbors"""
+    rseg = SRTSeg()
+    for before, seg, after in plan:
+        for sub_id in before:
+            if subs.get(sub_id):
+                rseg.segments.append(_subs_to_segs([subs[sub_id]])[0])
+        rseg.segments.append(seg)
+        for sub_id in after:
+            if subs.get(sub_id):
+                rseg.segments.append(_subs_to_segs([subs[sub_id]])[0])
+    rseg._calculate_times()
+    return rseg
+
 
+@tracing.traced()
 def srtseg_padding(sseg: SRTSeg, padding=0):
     """Padding the SRTSeg with padding number of sentences
     For example, if padding is 1, and there is a segment with index 3
     in the original sseg, then the new sseg will have segments with index
     2, 3, 4.
+    All the neighbors are fetched with one mget, and the ones that do not
+    exist (beyond the end of the srt file) are skipped.
     """
-    rseg = SRTSeg()
-    for seg in sseg.segs():
-        for i in range(padding, 0, -1):
-            if seg.index - i >= 0:
-                sub = Sub().load(
-                    id=seg.path.replace("/", "") + "_" + str(seg.index - i)
-                )
-                seg2 = titles_to_segs([sub])[0]
-                print(i, seg2)
-                rseg.segments.append(seg2)
-        rseg.segments.append(seg)
-        for i in range(1, padding, 1):
-            sub = Sub().load(id=seg.path.replace("/", "") + "_" + str(seg.index + i))
-            seg2 = titles_to_segs([sub])[0]
-            print(i, seg2)
-            rseg.segments.append(seg2)
-    rseg._calculate_times()
-    return rseg
+    plan = _padding_plan(sseg.segs(), padding)
+    ids = list(dict.fromkeys(i for before, _, after in plan for i in before + after))
+    subs = dict(zip(ids, Sub().load_many(ids)))
+    return _padded_srtseg(plan, subs)
 
 
-def srtseg_from_es(query, repeat=1, padding=0):
-    q = {
-        "bool": {
-            "filter": [
-                {
-                    "script": {
-                        "source": "doc['end'].value - doc['start'].value < params.threshold",
-                        "params": {"threshold": 3},
-                    }
-                }
-            ]
-        }
-    }
-
-    script_query = Q(
+def _clip_query(max_duration=5):
+    """Only keep the clips short enough to show a word.
+    The Subs saved before duration existed are measured with a script on
+    end - start until backfill.py has filled their duration"""
+    unfilled = Q(
         "bool",
+        must_not=[Q("exists", field="duration")],
         filter=[
             Q(
                 "script",
                 script={
-                    "source": "doc['end'].value - doc['start'].value < params.threshold",
-                    "params": {"threshold": 5},
+                    "source": "doc['end'].value - doc['start'].value < params.max",
+                    "params": {"max": max_duration},
                 },
             )
         ],
     )
+    return Q(
+        "bool",
+        filter=[
+            Q(
+                "bool",
+                should=[Q("range", duration={"lt": max_duration}), unfilled],
+                minimum_should_match=1,
+            )
+        ],
+    )
 
-    subs = list(Sub().find(query_string=query, query=script_query, size=10))
+
+def _repeated_srtseg(subs, repeat=1):
+    """The SRTSeg of the subs, each one repeated repeat times"""
     subs1 = []
     for sub in subs:
         for _ in range(repeat):
@@ -67,8 +157,110 @@ def srtseg_from_es(query, repeat=1, padding=0):
 
     # subs = [sub for sub in subs if sub.end - sub.start < 3]
     sseg = SRTSeg()
-    sseg.segments = titles_to_segs(subs1)
-    return srtseg_padding(sseg, padding)
+    sseg.segments = _subs_to_segs(subs1)
+    return sseg
+
+
+def _indexed_ids(query, max_duration=5, size=10):
+    """The Sub ids of the clips of query in the term index, [] when it is
+    disabled or does not know the term"""
+    if not settings.TERM_INDEX:
+        return []
+    return term_index.default().lookup(query, max_duration, size)
+
+
+def _live(subs):
+    """The loaded Subs still in the index"""
+    return [
+        sub for sub in subs if sub is not None and not getattr(sub, "deleted", False)
+    ]
+
+
+def term_clips(query, max_duration=5, size=10):
+    """The Subs of up to size clips shorter than max_duration seconds.
+    The words of the term index are read from it with one mget, the
+    others are searched"""
+    ids = _indexed_ids(query, max_duration, size)
+    if ids:
+        return _live(Sub().load_many(ids))
+    return list(
+        Sub().find(query_string=query, query=_clip_query(max_duration), size=size)
+    )
+
+
+@tracing.traced()
+def srtseg_from_es(query, repeat=1, padding=0, max_duration=5, size=10):
+    """Search up to size clips shorter than max_duration seconds"""
+    subs = term_clips(query, max_duration, size)
+    return srtseg_padding(_repeated_srtseg(subs, repeat), padding)
+
+
+def term_clips_many(queries, max_duration=5, size=10):
+    """The clip Subs of each query, like term_clips. The clips of the words
+    of the term index are read with one mget, the others are searched
+    with one _msearch"""
+    queries = list(queries)
+    indexed = [_indexed_ids(query, max_duration, size) for query in queries]
+    ids = list(dict.fromkeys(id for clips in indexed for id in clips))
+    loaded = dict(zip(ids, Sub().load_many(ids)))
+    found = [_live([loaded[id] for id in clips]) for clips in indexed]
+    missing = [n for n, clips in enumerate(indexed) if not clips]
+    if missing:
+        resps = Sub().find_many(
+            [
+                {
+                    "query_string": queries[n],
+                    "query": _clip_query(max_duration),
+                    "size": size,
+                }
+                for n in missing
+            ]
+        )
+        for n, resp in zip(missing, resps):
+            found[n] = list(resp)
+    return found
+
+
+@tracing.traced()
+def srtseg_from_es_many(terms, repeat=1, padding=0, max_duration=5, size=10):
+    """One SRTSeg with the clips of all the terms, in order. It costs an
+    mget for the clips in the term index, one _msearch for the others and
+    one mget for their padding"""
+    found = term_clips_many(terms, max_duration, size)
+    subs = [sub for clips in found for sub in clips]
+    return srtseg_padding(_repeated_srtseg(subs, repeat), padding)
+
+
+@tracing.traced()
+async def srtseg_padding_async(sseg: SRTSeg, padding=0):
+    """Coroutine version of srtseg_padding"""
+    plan = _padding_plan(sseg.segs(), padding)
+    ids = list(dict.fromkeys(i for before, _, after in plan for i in before + after))
+    subs = dict(zip(ids, await AsyncSub().load_many(ids)))
+    return _padded_srtseg(plan, subs)
+
+
+async def term_clips_async(query, max_duration=5, size=10):
+    """Coroutine version of term_clips"""
+    ids = []
+    if settings.TERM_INDEX:
+        # SQLite and the word lists of the lemmas block: not on the loop
+        ids = await asyncio.to_thread(_indexed_ids, query, max_duration, size)
+    if ids:
+        return _live(await AsyncSub().load_many(ids))
+    return list(
+        await AsyncSub().find(
+            query_string=query, query=_clip_query(max_duration), size=size
+        )
+    )
+
+
+@tracing.traced()
+async def srtseg_from_es_async(query, repeat=1, padding=0, max_duration=5, size=10):
+    """Coroutine version of srtseg_from_es. Run many of them with
+    asyncio.gather to build several clips concurrently on one loop"""
+    subs = await term_clips_async(query, max_duration, size)
+    return await srtseg_padding_async(_repeated_srtseg(subs, repeat), padding)
 
 
 def media_url(srt_file, index):
@@ -76,36 +268,189 @@ def media_url(srt_file, index):
     return "https://mira-1255830993.cos.ap-shanghai.myqcloud.com/season2/" + path
 
 
+def _field(seg, name):
+    """Read a field of a Sub or of a dict of Sub fields"""
+    return seg.get(name) if isinstance(seg, dict) else getattr(seg, name, None)
+
+
+def segment_duration(seg, default=6):
+    """The length in seconds of the clip of a Sub"""
+    start, end = _field(seg, "start"), _field(seg, "end")
+    if start is None or end is None:
+        return default
+    return round(end - start, 3)
+
+
+def _m3u8_header(target_duration=10, playlist_type=None):
+    header = f"""#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-MEDIA-SEQUENCE:0
+#EXT-X-TARGETDURATION:{target_duration}
+"""
+    if playlist_type:
+        header += f"#EXT-X-PLAYLIST-TYPE:{playlist_type}\n"
+    return header
+
+
+def _m3u8_entry(seg):
+    path = media_url(_field(seg, "srt_file"), _field(seg, "index"))
+    return f"""#EXT-X-DISCONTINUITY
+#EXTINF:{segment_duration(seg)},
+{path}
+"""
+
+
+def iter_m3u8(segs, target_duration=10, playlist_type=None, end_list=True):
+    """
+    Yield the m3u8 piece by piece, an entry as soon as each seg arrives
+
+    Args:
+        segs: Subs (or dicts of Sub fields), possibly from a generator
+        target_duration: Must cover the longest seg, since the header is
+            sent before the segs are known
+        playlist_type: None, "VOD" or "EVENT"
+        end_list: Whether to close the playlist with #EXT-X-ENDLIST
+    """
+    yield _m3u8_header(target_duration, playlist_type)
+    for seg in segs:
+        yield _m3u8_entry(seg)
+    if end_list:
+        yield "#EXT-X-ENDLIST\n"
+
+
+@tracing.traced()
 def m3u8(segs):
     """
     Return m3u8 of the current selected content
 
     Args:
+        segs: Subs or dicts of Sub fields
     Returns:
         The content of m3u8
     """
-    duration = 6
-    m3u8_infs = ""
-    for seg in segs:
-        path = media_url(seg["srt_file"], seg["index"])
-        m3u8_infs += f"""#EXT-X-DISCONTINUITY
-#EXTINF:{duration},
-{path}
-"""
-    m3u8_header = f"""#EXTM3U
-#EXT-X-VERSION:3
-#EXT-X-MEDIA-SEQUENCE:0
-#EXT-X-TARGETDURATION:10
-"""
-    m3u8_footer = """#EXT-X-ENDLIST\n"""
-    return m3u8_header + m3u8_infs + m3u8_footer
+    segs = list(segs)
+    longest = max((segment_duration(seg) for seg in segs), default=1)
+    return "".join(iter_m3u8(segs, max(1, math.ceil(longest))))
+
+
+def _ordered_subs(plan, loaded):
+    """The Subs of a padding plan in playing order, skipping the
+    neighbors that do not exist"""
+    result = []
+    for before, sub, after in plan:
+        result += [loaded[i] for i in before if loaded.get(i)]
+        result.append(sub)
+        result += [loaded[i] for i in after if loaded.get(i)]
+    return result
+
+
+@tracing.traced()
+def padded_subs(subs, repeat=1, padding=0):
+    """The subs, each repeated, with padding neighbors around them, as
+    Subs in playing order. The neighbors are loaded with one mget."""
+    plan = _padding_plan([sub for sub in subs for _ in range(repeat)], padding)
+    ids = list(dict.fromkeys(i for before, _, after in plan for i in before + after))
+    return _ordered_subs(plan, dict(zip(ids, Sub().load_many(ids))))
+
+
+@tracing.traced()
+def padded_subs_by_id(ids, repeat=1, padding=0):
+    """padded_subs of the Subs of ids, e.g. the clips of a catalog. The
+    Subs and every neighbor they may need are loaded with one mget"""
+    ids = list(ids)
+    wanted = list(ids)
+    for sub_id in ids:
+        srt_file, index = sub_id.rsplit("_", 1)
+        wanted += [
+            f"{srt_file}_{int(index) + offset}"
+            for offset in range(-padding, padding + 1)
+            if offset and int(index) + offset >= 0
+        ]
+    wanted = list(dict.fromkeys(wanted))
+    loaded = dict(zip(wanted, Sub().load_many(wanted)))
+    subs = _live(loaded.get(sub_id) for sub_id in ids)
+    plan = _padding_plan([sub for sub in subs for _ in range(repeat)], padding)
+    return _ordered_subs(plan, loaded)
+
+
+@tracing.traced()
+async def padded_subs_async(subs, repeat=1, padding=0):
+    """Coroutine version of padded_subs"""
+    plan = _padding_plan([sub for sub in subs for _ in range(repeat)], padding)
+    ids = list(dict.fromkeys(i for before, _, after in plan for i in before + after))
+    return _ordered_subs(plan, dict(zip(ids, await AsyncSub().load_many(ids))))
+
+
+@tracing.traced()
+def srt_of(subs):
+    """The subtitles of a playlist of Subs, timed on the playlist like
+    SRTSeg.srtstr: each clip starts where the previous one ends"""
+    subtitles, start = [], 0.0
+    for n, sub in enumerate(subs, 1):
+        offset = start - _field(sub, "start")
+        subtitles.append(
+            srt.Subtitle(
+                index=n,
+                start=timedelta(seconds=_field(sub, "sub_start") + offset),
+                end=timedelta(seconds=_field(sub, "sub_end") + offset),
+                content=_field(sub, "content"),
+            )
+        )
+        start += segment_duration(sub)
+    return srt.compose(subtitles)
+
+
+PLAYLIST_CACHE = TTLCache(
+    max_entries=settings.PLAYLIST_CACHE_ENTRIES, ttl=settings.PLAYLIST_CACHE_TTL
+)
+
+
+def _term_entries(term, repeat=1, padding=0, max_duration=5):
+    """Rendered m3u8 entries of a term and their longest duration, cached
+    per (term, repeat, padding)"""
+    key = (term, repeat, padding, max_duration)
+    cached = PLAYLIST_CACHE.get(key)
+    tracing.count("playlist_cache.miss" if cached is None else "playlist_cache.hit")
+    if cached is None:
+        subs = padded_subs(term_clips(term, max_duration), repeat, padding)
+        cached = (
+            "".join(_m3u8_entry(sub) for sub in subs),
+            max((segment_duration(sub) for sub in subs), default=1),
+        )
+        PLAYLIST_CACHE.set(key, cached)
+    return cached
+
+
+@tracing.traced()
+def term_has_clips(term, max_duration=5):
+    """Whether a term has clips, from a search of one hit. The playlist
+    is left to the clip server the player asks"""
+    return bool(term_clips(term, max_duration, size=1))
+
+
+@tracing.traced()
+def term_m3u8(term, repeat=1, padding=0, max_duration=5):
+    """The m3u8 of the clips of a term, with their real durations"""
+    entries, longest = _term_entries(term, repeat, padding, max_duration)
+    header = _m3u8_header(max(1, math.ceil(longest)))
+    return header + entries + "#EXT-X-ENDLIST\n"
+
+
+@tracing.traced()
+def terms_m3u8(terms, repeat=1, padding=0, max_duration=5, size=10):
+    """The m3u8 of a lesson of several terms, built with at most one mget of
+    the indexed clips, one _msearch and one mget whatever the number of
+    terms"""
+    found = term_clips_many(terms, max_duration, size)
+    subs = [sub for clips in found for sub in clips]
+    return m3u8(padded_subs(subs, repeat, padding))
 
 
 def srtseg_from_sqlite(hits):
-    """Restore SRTSeg from Chroma Hits"""
+    """Restore SRTSeg from SQLite hits, Subs of a snapshot.SqliteStore"""
     start = 0
     sseg = SRTSeg()
-    print(hits)
+    logger.debug("%s", hits)
     for hit in hits:
         seg = Seg()
         seg_duration = hit.end - hit.start
@@ -127,12 +472,13 @@ def srtseg_from_sqlite(hits):
 
 
 def srtseg_from_chroma(hits, documents):
-    """Restore SRTSeg from Chroma Hits"""
+    """Restore SRTSeg from Chroma Hits, the metadatas and the documents of
+    the Subs of a snapshot.ChromaStore"""
     start = 0
-    sseg = srtseg.srtseg.SRTSeg()
-    print(hits)
+    sseg = SRTSeg()
+    logger.debug("%s", hits)
     for hit, doc in zip(hits, documents):
-        seg = srtseg.srtseg.Seg()
+        seg = Seg()
         sub_duration = hit["sub_end"] - hit["sub_start"]
         seg_duration = hit["end"] - hit["start"]
         sub_offset = hit["sub_start"] - hit["start"]
@@ -151,3 +497,19 @@ def srtseg_from_chroma(hits, documents):
         sseg.segments.append(seg)
         start += seg_duration
     return sseg
+
+
+@tracing.traced()
+def srtseg_from_snapshot(store, query, repeat=1, padding=0, max_duration=5, size=10):
+    """srtseg_from_es served by a local replica of the Sub index, a
+    snapshot.SqliteStore or ChromaStore: the clips and their neighbors
+    are read from the store, without any request to the cluster"""
+    subs = store.term_clips(query, max_duration, size)
+    plan = _padding_plan([sub for sub in subs for _ in range(repeat)], padding)
+    ids = list(dict.fromkeys(i for before, _, after in plan for i in before + after))
+    subs = _ordered_subs(plan, dict(zip(ids, store.load_many(ids))))
+    if store.kind == "chroma":
+        return srtseg_from_chroma(
+            [vars(sub) for sub in subs], [sub.content for sub in subs]
+        )
+    return srtseg_from_sqlite(subs)
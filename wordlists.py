@@ -0,0 +1,198 @@
+"""Word lists of the dicts folder
+
+Each list is parsed once into a WordList with per-letter and prefix
+indexes, pickled under .cache/ and reloaded from there until the .txt file
+changes. The lists come in several formats, all handled by parse_line:
+
+    abandon\t[əˈbændən] v. 放弃            tab separated, maybe phonetics
+    abandon           [ə'bændən]   vt. 放弃   columns aligned with spaces
+    a art.一(个)；每一(个)                  term followed by its meaning
+    Hey.\t1189077                          sentence and count
+    How’s it going?                        one sentence per line
+
+select, page_slice and following are the browsing of the vocabulary page:
+the terms of a letter or prefix, the window of a page and the terms to
+prefetch after the one playing.
+"""
+
+import bisect
+import math
+import os
+import pickle
+import re
+import threading
+
+DICTS_DIR = "dicts"
+CACHE_DIR = os.path.join(".cache", "wordlists")
+CACHE_VERSION = 2
+
+LETTERS = tuple("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+# Parts of speech that may open a meaning: "Thank you." is no "you." tag
+POS_TAGS = "n|v|vt|vi|adj|adv|ad|a|prep|conj|pron|art|num|int|interj|aux|abbr"
+_inline_meaning = re.compile(rf"^([A-Za-z][\w'\-]*) ((?:(?:{POS_TAGS})\.)+.*)$")
+
+
+def clean_term(term):
+    """Strip list markers and alternatives: '*abase' -> 'abase',
+    'a (an)' -> 'a', 'a, an' -> 'a', 'colour (美color)' -> 'colour'"""
+    term = term.strip().lstrip("*")
+    if len(term.split()) > 1 and term[-1] in ".?!":
+        return term  # a sentence
+    term = re.sub(r"\s*[(（].*?[)）]", "", term)
+    return term.split(",")[0].strip()
+
+
+def parse_line(line):
+    """Return (term, meaning) for a word list line, None for headers"""
+    line = line.strip().lstrip("﻿")
+    if not line or line == "sentence\tcount":
+        return None
+    if "\t" in line:
+        term, meaning = line.split("\t", 1)
+        meaning = " ".join(meaning.split())
+    elif re.search(r"\S\s{2,}\S", line):
+        term, *meaning = re.split(r"\s{2,}", line)
+        meaning = " ".join(part for part in meaning if part != "[]")
+    elif match := _inline_meaning.match(line):
+        term, meaning = match.groups()
+    elif re.search(r"[A-Za-z]", line) and len(line) > 1:
+        term, meaning = line, ""
+    else:
+        return None  # letter headers, titles, word counts
+    term = clean_term(term)
+    if not re.search(r"[A-Za-z]", term):
+        return None
+    return term, meaning.strip()
+
+
+def parse(raw):
+    """All the (term, meaning) of a list. A term listed twice keeps its
+    first position and its last meaning"""
+    results = {}
+    for line in raw.splitlines():
+        entry = parse_line(line)
+        if entry:
+            results[entry[0]] = entry[1]
+    return list(results.items())
+
+
+class WordList:
+    """The terms of a list in file order, with letter and prefix indexes"""
+
+    def __init__(self, name, entries):
+        self.name = name
+        self.terms = [term for term, _ in entries]
+        self.meanings = [meaning for _, meaning in entries]
+        self.by_letter = {}
+        for n, term in enumerate(self.terms):
+            self.by_letter.setdefault(term[0].upper(), []).append(n)
+        self.sorted = sorted((term.lower(), n) for n, term in enumerate(self.terms))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __getitem__(self, n):
+        return self.terms[n], self.meanings[n]
+
+    def starting_with(self, prefix):
+        """Positions of the terms starting with prefix, in file order"""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.sorted, (prefix,))
+        found = []
+        for term, n in self.sorted[start:]:
+            if not term.startswith(prefix):
+                break
+            found.append(n)
+        return sorted(found)
+
+    def search(self, prefix="", letter=None):
+        """Positions of the terms matching prefix and first letter"""
+        prefix = prefix.strip()
+        if letter and prefix and not prefix.upper().startswith(letter):
+            return []
+        if prefix:
+            return self.starting_with(prefix)
+        if letter:
+            return self.by_letter.get(letter, [])
+        return list(range(len(self)))
+
+    def items(self, positions):
+        return [self[n] for n in positions]
+
+
+def select(wordlist, letter=None, prefix="", has_clips=None):
+    """Positions of the terms to browse: the ones starting with prefix,
+    else with letter, keeping only those has_clips(term) accepts if given"""
+    if prefix.strip():
+        positions = wordlist.search(prefix)
+    else:
+        positions = wordlist.search(letter=letter)
+    if has_clips is not None:
+        positions = [n for n in positions if has_clips(wordlist.terms[n])]
+    return positions
+
+
+def page_count(total, page_size):
+    """Number of pages of total terms, at least one"""
+    return max(1, math.ceil(total / page_size))
+
+
+def page_slice(positions, page, page_size):
+    """(start, positions) of a page, counting pages from 1"""
+    page = min(max(page, 1), page_count(len(positions), page_size))
+    start = (page - 1) * page_size
+    return start, positions[start : start + page_size]
+
+
+def following(wordlist, positions, i, count, skip=(), window=50):
+    """Up to count terms after the i-th position, the ones in skip left out,
+    looking at most window terms ahead. They are prefetched while the
+    i-th term plays"""
+    terms = [wordlist.terms[n] for n in positions[i + 1 : i + window]]
+    return [term for term in terms if term not in skip][:count]
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def names(dirname=DICTS_DIR):
+    """The word list files of the folder"""
+    return sorted(file for file in os.listdir(dirname) if file.endswith(".txt"))
+
+
+def load(name, dirname=DICTS_DIR, cache_dir=CACHE_DIR):
+    """The WordList of a file, parsed at most once per version of it"""
+    path = os.path.join(dirname, name)
+    stat = os.stat(path)
+    stamp = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if path in _loaded and _loaded[path][0] == stamp:
+            return _loaded[path][1]
+
+    wordlist = None
+    pickled = os.path.join(cache_dir, name + ".pickle")
+    try:
+        with open(pickled, "rb") as f:
+            cached_stamp, wordlist = pickle.load(f)
+        if cached_stamp != stamp:
+            wordlist = None
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        wordlist = None
+
+    if wordlist is None:
+        with open(path, encoding="utf-8") as f:
+            wordlist = WordList(name, parse(f.read()))
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{pickled}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump((stamp, wordlist), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, pickled)
+        except OSError:
+            pass  # a read-only deployment still works, just slower
+
+    with _lock:
+        _loaded[path] = (stamp, wordlist)
+    return wordlist